@@ -0,0 +1,76 @@
+import pandas as pd
+
+from esquema import contiene
+from ingesta import columna_mes
+
+# Cubo de agregados para el Resumen General: conteo de facturas y suma de
+# 'Total' por (día, Mes, Estatus, Método de Pago, Forma de Pago). Se construye
+# una vez al cargar; las tarjetas y gráficas solo leen el cubo, cuyo tamaño
+# depende del número de combinaciones y no del número de facturas. El día
+# permite aplicar el rango de fechas de la barra lateral sin volver a la tabla;
+# el mes se deriva del día ya en el cubo, sin la columna 'Mes' de la tabla.
+
+DIMENSIONES = ['Estatus', 'Método de Pago', 'Forma de Pago']
+
+
+class CuboAgregados:
+    def __init__(self, df):
+        self.filas_totales = len(df)
+        claves = {}
+        if 'Fecha' in df.columns:
+            claves['Dia'] = df['Fecha'].dt.floor('D')
+        for col in DIMENSIONES:
+            if col in df.columns:
+                claves[col] = df[col]
+        self.dimensiones = list(claves)
+
+        if not claves:
+            self.cubo = pd.DataFrame({'Cantidad': [len(df)], 'Total': [self._suma_total(df)]})
+            return
+
+        llaves = [serie.rename(nombre) for nombre, serie in claves.items()]
+        opciones = dict(observed=True, dropna=False, sort=False)
+        self.cubo = df.groupby(llaves, **opciones).size().rename('Cantidad').to_frame()
+        if 'Total' in df.columns:
+            self.cubo['Total'] = pd.to_numeric(df['Total'], errors='coerce').groupby(llaves, **opciones).sum()
+        self.cubo = self.cubo.reset_index()
+        if 'Dia' in self.cubo.columns:
+            self.cubo.insert(1, 'Mes', columna_mes(self.cubo['Dia']))
+            self.dimensiones.insert(1, 'Mes')
+
+    @staticmethod
+    def _suma_total(df):
+        return pd.to_numeric(df['Total'], errors='coerce').sum() if 'Total' in df.columns else 0.0
+
+    def __len__(self):
+        return len(self.cubo)
+
+    # Sub-cubo con los filtros de la barra lateral (mismos criterios que MotorFiltros)
+    def filtrar(self, estatus=None, desde=None, hasta=None):
+        cubo = self.cubo
+        if estatus is not None and 'Estatus' in cubo.columns:
+            cubo = cubo[cubo['Estatus'].astype(str).isin([str(e) for e in estatus])]
+        if desde is not None and hasta is not None and 'Dia' in cubo.columns:
+            # Los días se comparan contra el día de los extremos
+            cubo = cubo[
+                (cubo['Dia'] >= pd.Timestamp(desde).floor('D')) &
+                (cubo['Dia'] <= pd.Timestamp(hasta).floor('D'))
+            ]
+        return cubo
+
+
+def cantidad(cubo):
+    return int(cubo['Cantidad'].sum())
+
+
+# Facturas cuya columna contiene el texto (evaluado sobre las categorías del cubo)
+def cantidad_con(cubo, columna, texto):
+    if columna not in cubo.columns:
+        return 0
+    return int(cubo.loc[contiene(cubo[columna], texto).to_numpy(dtype=bool), 'Cantidad'].sum())
+
+
+# Conteo por una dimensión, sin categorías vacías
+def por(cubo, columna, ordenar=False):
+    conteo = cubo.groupby(columna, observed=True, sort=ordenar)['Cantidad'].sum()
+    return conteo[conteo > 0]
@@ -0,0 +1,375 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from cache_datos import hash_contenido
+from esquema import (
+    COLUMNAS_CATEGORICAS,
+    TIPO_UUID,
+    arreglo_arrow,
+    lista_de_uuids,
+    serie_arrow,
+    uuid_a_bytes,
+)
+from ingesta import VERSION_NORMALIZACION, con_derivadas, ordenar_por_fecha
+from particiones import SIN_FECHA, DatasetMensual, particion_de
+
+# Historiales locales de facturas en SQLite. Cada exporte que se sube se integra
+# con upsert por UUID, así que basta con subir el mes nuevo. Las relaciones de
+# los complementos se guardan en una tabla aparte (complemento_uuid, related_uuid).
+#
+# Para abrir el historial la tabla no se lee de SQLite: junto a la base se
+# mantiene una copia particionada por mes (particiones.py) que cada upsert
+# actualiza solo en los meses que toca, y se abren únicamente los meses del
+# periodo pedido. Si la copia no corresponde a la versión del almacén (por
+# ejemplo, una base anterior a las particiones) se reconstruye completa.
+#
+# Las páginas trabajan sobre esa tabla en memoria (compartida en el registro,
+# con sus índices y cubo), no con consultas SQL por página: el SQL solo se usa
+# para integrar exportes, reconstruir meses y buscar en todo el historial los
+# complementos que citan ciertas facturas (índices de fecha y de relaciones).
+
+# Un historial por cliente (RFC u otro nombre que elige el usuario), cada uno en
+# su propia base: las facturas de clientes distintos nunca se mezclan
+DIRECTORIO_HISTORIALES = os.environ.get(
+    "FACTURADOR_HISTORIALES",
+    os.path.join(os.path.expanduser("~"), ".facturador", "historiales")
+)
+
+# Columna de la tabla -> columna SQL
+COLUMNAS = {
+    'UUID': 'uuid',
+    'Fecha': 'fecha',
+    'Método de Pago': 'metodo_pago',
+    'Forma de Pago': 'forma_pago',
+    'Estatus': 'estatus',
+    'Total': 'total',
+    'XML': 'xml',
+    'Relacionados': 'relacionados',
+    'Mes': 'mes',
+    'Mes_XML': 'mes_xml',
+}
+# Columnas derivadas que no se guardan (se reconstruyen al leer)
+DERIVADAS = ['UUIDs_Relacionados']
+
+ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS facturas (
+    uuid BLOB PRIMARY KEY,
+    fecha INTEGER,
+    metodo_pago TEXT,
+    forma_pago TEXT,
+    estatus TEXT,
+    total REAL,
+    xml TEXT,
+    relacionados TEXT,
+    mes TEXT,
+    mes_xml TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS facturas_fecha ON facturas (fecha);
+DROP INDEX IF EXISTS facturas_metodo_pago;
+
+CREATE TABLE IF NOT EXISTS relaciones (
+    complemento_uuid BLOB NOT NULL,
+    related_uuid BLOB NOT NULL,
+    PRIMARY KEY (complemento_uuid, related_uuid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS relaciones_related ON relaciones (related_uuid);
+
+CREATE TABLE IF NOT EXISTS archivos (
+    hash TEXT PRIMARY KEY,
+    nombre TEXT,
+    filas INTEGER,
+    importado TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor INTEGER
+);
+INSERT OR IGNORE INTO meta (clave, valor) VALUES ('version', 0);
+"""
+
+
+def _a_objetos(serie):
+    return serie.astype(object).where(serie.notna(), None)
+
+
+# Condición SQL para las facturas de las particiones indicadas ('AAAA-MM' o SIN_FECHA)
+def _condicion_meses(meses):
+    condiciones, parametros = [], []
+    for mes in sorted(meses):
+        if mes == SIN_FECHA:
+            condiciones.append("fecha IS NULL")
+            continue
+        inicio = np.datetime64(mes, 'M')
+        condiciones.append("(fecha >= ? AND fecha < ?)")
+        parametros += [int(inicio.astype('datetime64[us]').astype(np.int64)),
+                       int((inicio + 1).astype('datetime64[us]').astype(np.int64))]
+    return " OR ".join(condiciones), parametros
+
+
+class AlmacenFacturas:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with self._conectar() as con:
+            con.executescript(ESQUEMA_SQL)
+        self.particiones = DatasetMensual(f"{os.path.splitext(ruta)[0]}.meses")
+
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=60)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def version(self):
+        with self._conectar() as con:
+            return con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()[0]
+
+    def filas(self):
+        with self._conectar() as con:
+            return con.execute("SELECT COUNT(*) FROM facturas").fetchone()[0]
+
+    def archivo_importado(self, hash_archivo):
+        with self._conectar() as con:
+            return con.execute("SELECT 1 FROM archivos WHERE hash = ?", (hash_archivo,)).fetchone() is not None
+
+    # Integrar una tabla normalizada; las facturas existentes se actualizan por UUID.
+    # Las filas sin UUID válido no se pueden identificar y no se guardan.
+    def upsert(self, df, hash_archivo=None, nombre=None):
+        if 'UUID' not in df.columns:
+            raise ValueError("La tabla no tiene columna 'UUID'")
+        # Las relaciones y los meses se guardan: se derivan aquí si la tabla no los trae
+        df = con_derivadas(df)
+        df = df[df['UUID'].notna().to_numpy(dtype=bool)]
+
+        valores = {'uuid': arreglo_arrow(df['UUID']).to_pylist()}
+        for col, sql in COLUMNAS.items():
+            if col == 'UUID':
+                continue
+            if col not in df.columns:
+                valores[sql] = [None] * len(df)
+            elif col == 'Fecha':
+                fechas = df[col].to_numpy(dtype='datetime64[us]')
+                enteros = fechas.astype(np.int64).astype(object)
+                enteros[np.isnat(fechas)] = None
+                valores[sql] = enteros.tolist()
+            else:
+                valores[sql] = _a_objetos(df[col]).tolist()
+
+        extras = [c for c in df.columns if c not in COLUMNAS and c not in DERIVADAS]
+        if extras:
+            lineas = df[extras].to_json(orient='records', lines=True, date_format='iso', force_ascii=False)
+            valores['extra'] = lineas.splitlines()
+        else:
+            valores['extra'] = [None] * len(df)
+
+        columnas_sql = list(valores)
+        filas = list(zip(*valores.values()))
+        insertar = (
+            f"INSERT INTO facturas ({', '.join(columnas_sql)}) "
+            f"VALUES ({', '.join('?' * len(columnas_sql))}) "
+            f"ON CONFLICT(uuid) DO UPDATE SET "
+            + ', '.join(f"{c} = excluded.{c}" for c in columnas_sql if c != 'uuid')
+        )
+
+        relaciones = []
+        if 'UUIDs_Relacionados' in df.columns:
+            listas = arreglo_arrow(df['UUIDs_Relacionados'])
+            padres = pc.list_parent_indices(listas).to_numpy()
+            relacionados = pc.list_flatten(listas).to_pylist()
+            relaciones = [(valores['uuid'][p], r) for p, r in zip(padres, relacionados)]
+
+        with self._lock:
+            particiones_al_dia = self.particiones.version() == self._version_particiones()
+            with self._conectar() as con:
+                con.execute("CREATE TEMP TABLE IF NOT EXISTS actualizados (uuid BLOB PRIMARY KEY)")
+                con.execute("DELETE FROM actualizados")
+                con.executemany("INSERT OR IGNORE INTO actualizados VALUES (?)", ((u,) for u in valores['uuid']))
+                # Meses a reescribir: los de las filas nuevas y los que tenían las que cambian
+                anteriores = pd.read_sql_query(
+                    "SELECT fecha FROM facturas WHERE uuid IN (SELECT uuid FROM actualizados)", con
+                )['fecha']
+                meses = set(particion_de(pd.to_datetime(anteriores, unit='us')))
+                meses |= set(particion_de(df['Fecha'])) if 'Fecha' in df.columns else {SIN_FECHA}
+
+                con.executemany(insertar, filas)
+                # Las relaciones de los complementos actualizados se reemplazan completas
+                con.execute("DELETE FROM relaciones WHERE complemento_uuid IN (SELECT uuid FROM actualizados)")
+                con.executemany("INSERT OR IGNORE INTO relaciones VALUES (?, ?)", relaciones)
+                if hash_archivo is not None:
+                    con.execute(
+                        "INSERT OR REPLACE INTO archivos VALUES (?, ?, ?, ?)",
+                        (hash_archivo, nombre, len(filas), time.strftime('%Y-%m-%d %H:%M:%S'))
+                    )
+                con.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'version'")
+
+            if particiones_al_dia:
+                condicion, parametros = _condicion_meses(meses)
+                filas_meses = self._leer(condicion, parametros) if meses else df.iloc[:0]
+                self.particiones.escribir(filas_meses, self._version_particiones(), meses)
+            else:
+                self._reconstruir_particiones()
+        return len(filas)
+
+    # Clave de la tabla del periodo (meses 'AAAA-MM'; None = sin límite) en la
+    # versión actual del almacén
+    def clave(self, desde=None, hasta=None):
+        periodo = f"-{desde or ''}-{hasta or ''}" if desde or hasta else ""
+        return f"almacen-{hash_contenido(os.path.abspath(self.ruta).encode())[:16]}-{self.version()}-v{VERSION_NORMALIZACION}{periodo}"
+
+    # Meses con facturas ('AAAA-MM', en orden)
+    def meses(self):
+        self._asegurar_particiones()
+        return self.particiones.meses()
+
+    # Primera y última fecha guardadas entre los meses desde y hasta (None si no
+    # hay ninguna); solo se lee la columna Fecha de los meses de los extremos
+    def rango_fechas(self, desde=None, hasta=None):
+        meses = [
+            mes for mes in self.meses()
+            if (desde is None or mes >= desde) and (hasta is None or mes <= hasta)
+        ]
+        if not meses:
+            return None
+        primero = self.particiones.leer(meses[0], meses[0], ['Fecha'])['Fecha']
+        ultimo = self.particiones.leer(meses[-1], meses[-1], ['Fecha'])['Fecha']
+        return primero.iloc[0], ultimo.iloc[-1]
+
+    # Tabla del periodo en el esquema normalizado, ordenada por fecha; solo se
+    # abren los meses del periodo. Sin periodo, la tabla completa.
+    def cargar(self, desde=None, hasta=None):
+        self._asegurar_particiones()
+        return self.particiones.leer(desde, hasta), self.clave(desde, hasta)
+
+    # Facturas guardadas con fecha entre los instantes desde y hasta (inclusivos),
+    # solo con las columnas indicadas; se abren solo los meses del rango
+    def instantanea(self, desde, hasta, columnas=None):
+        self._asegurar_particiones()
+        desde, hasta = pd.Timestamp(desde), pd.Timestamp(hasta)
+        df = self.particiones.leer(desde.strftime('%Y-%m'), hasta.strftime('%Y-%m'), columnas)
+        if df.empty:
+            return df
+        # Los meses se leen en orden: el rango exacto es un corte contiguo
+        inicio = df['Fecha'].searchsorted(desde, 'left')
+        fin = df['Fecha'].searchsorted(hasta, 'right')
+        return df.iloc[inicio:fin].reset_index(drop=True)
+
+    def _version_particiones(self):
+        return {"almacen": self.version(), "normalizacion": VERSION_NORMALIZACION}
+
+    def _asegurar_particiones(self):
+        with self._lock:
+            if self.particiones.version() != self._version_particiones():
+                self._reconstruir_particiones()
+
+    # Escribir todas las particiones desde SQLite (se llama con el lock tomado)
+    def _reconstruir_particiones(self):
+        self.particiones.escribir(self._leer(), self._version_particiones())
+
+    # Facturas que cumplen la condición SQL sobre la tabla facturas (todas sin condición)
+    def _leer(self, condicion=None, parametros=()):
+        donde = f"WHERE {condicion}" if condicion else ""
+        with self._conectar() as con:
+            datos = pd.read_sql_query(
+                f"SELECT {', '.join(COLUMNAS.values())}, extra FROM facturas {donde} ORDER BY fecha, rowid",
+                con, params=parametros
+            )
+            relaciones = pd.read_sql_query(
+                "SELECT complemento_uuid, related_uuid FROM relaciones"
+                + (f" WHERE complemento_uuid IN (SELECT uuid FROM facturas {donde})" if condicion else ""),
+                con, params=parametros
+            )
+
+        df = pd.DataFrame(index=datos.index)
+        df['UUID'] = serie_arrow(pa.array(datos['uuid'].tolist(), type=TIPO_UUID))
+        df['Fecha'] = pd.to_datetime(datos['fecha'], unit='us')
+        for col, sql in COLUMNAS.items():
+            if col in ('UUID', 'Fecha'):
+                continue
+            df[col] = datos[sql]
+        for col in COLUMNAS_CATEGORICAS:
+            df[col] = df[col].astype('category')
+        df['Total'] = pd.to_numeric(df['Total'], errors='coerce')
+
+        if datos['extra'].notna().any():
+            extras = pd.read_json(StringIO('\n'.join(datos['extra'].fillna('{}'))), lines=True, dtype=False)
+            for col in extras.columns:
+                df[col] = extras[col].to_numpy()
+
+        df['UUIDs_Relacionados'] = self._listas_relacionadas(df['UUID'], relaciones)
+        return ordenar_por_fecha(df)
+
+    # Reconstruir la lista de UUID relacionados de cada fila a partir de la tabla de relaciones
+    @staticmethod
+    def _listas_relacionadas(uuids, relaciones):
+        posiciones = pd.Series(np.arange(len(uuids)), index=arreglo_arrow(uuids).to_pylist())
+        filas = posiciones.reindex(relaciones['complemento_uuid'].tolist()).to_numpy(dtype=np.int64)
+        orden = np.argsort(filas, kind='stable')
+        valores = pa.array(relaciones['related_uuid'].to_numpy()[orden].tolist(), type=TIPO_UUID)
+        return serie_arrow(lista_de_uuids(filas[orden], valores, len(uuids)), index=uuids.index)
+
+    # Complementos guardados (de cualquier mes) que citan alguno de los UUID, por
+    # la tabla de relaciones indexada: una fila por par complemento-factura con
+    # 'Relacionado' (la factura citada), 'UUID', 'Fecha', 'Total' y 'Estatus'
+    def complementos_de(self, uuids):
+        if isinstance(uuids, (pa.Array, pa.ChunkedArray)):
+            uuids = uuids.to_pylist()
+        claves = [u if isinstance(u, bytes) else uuid_a_bytes(u) for u in uuids]
+        with self._conectar() as con:
+            con.execute("CREATE TEMP TABLE IF NOT EXISTS buscados (uuid BLOB PRIMARY KEY)")
+            con.execute("DELETE FROM buscados")
+            con.executemany("INSERT OR IGNORE INTO buscados VALUES (?)", ((c,) for c in claves if c is not None))
+            datos = pd.read_sql_query(
+                "SELECT r.related_uuid, f.uuid, f.fecha, f.total, f.estatus FROM buscados b "
+                "JOIN relaciones r ON r.related_uuid = b.uuid "
+                "JOIN facturas f ON f.uuid = r.complemento_uuid ORDER BY f.fecha, f.rowid",
+                con
+            )
+        return pd.DataFrame({
+            'Relacionado': serie_arrow(pa.array(datos['related_uuid'].tolist(), type=TIPO_UUID)),
+            'UUID': serie_arrow(pa.array(datos['uuid'].tolist(), type=TIPO_UUID)),
+            'Fecha': pd.to_datetime(datos['fecha'], unit='us'),
+            'Total': pd.to_numeric(datos['total'], errors='coerce'),
+            'Estatus': datos['estatus'],
+        })
+
+
+# Nombre normalizado del historial (sin espacios a los lados, en mayúsculas)
+def normalizar_nombre(nombre):
+    return str(nombre or '').strip().upper()
+
+
+# Base del historial: nombre legible más un hash, para que dos nombres que se
+# escriben igual en disco no compartan archivo
+def ruta_historial(nombre):
+    nombre = normalizar_nombre(nombre)
+    if not nombre:
+        raise ValueError("El historial necesita un nombre")
+    legible = re.sub(r'[^A-Z0-9_-]', '_', nombre)[:64]
+    return os.path.join(DIRECTORIO_HISTORIALES, f"{legible}-{hash_contenido(nombre.encode())[:12]}.sqlite3")
+
+
+_almacenes = {}  # ruta -> AlmacenFacturas
+_lock_almacen = threading.Lock()
+
+
+# Almacén del historial con ese nombre, compartido por las sesiones que lo abren
+def obtener_almacen(nombre):
+    ruta = ruta_historial(nombre)
+    with _lock_almacen:
+        if ruta not in _almacenes:
+            _almacenes[ruta] = AlmacenFacturas(ruta)
+        return _almacenes[ruta]
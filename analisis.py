@@ -0,0 +1,81 @@
+import pandas as pd
+
+from agregados import CuboAgregados
+from conciliacion import conciliar_ppd
+from esquema import contiene, para_mostrar
+from filtros import MotorFiltros, contiene_texto, mascara, no_nulo
+from indices import IndiceRelaciones
+from ingesta import con_derivadas
+
+# Análisis de PPD/PUE y resúmenes sin dependencia de Streamlit. Las páginas de
+# la aplicación y el modo por lotes (cli.py) usan las mismas funciones; las
+# consultas devuelven posiciones de fila del MotorFiltros, no copias de la tabla.
+
+COLUMNAS_FACTURA = ['UUID', 'Fecha', 'Método de Pago', 'Forma de Pago', 'Estatus', 'Total']
+
+
+def con_complemento(indice):
+    return mascara(
+        'con_complemento', id(indice),
+        lambda df: indice.tiene_complemento(df['UUID']).to_numpy(dtype=bool)
+    )
+
+
+def sin_complemento(indice):
+    return mascara(
+        'sin_complemento', id(indice),
+        lambda df: ~indice.tiene_complemento(df['UUID']).to_numpy(dtype=bool)
+    )
+
+
+def ppd_sin_complemento(motor, indice, filtros=()):
+    return motor.filas(list(filtros) + [contiene_texto('Método de Pago', 'PPD'), sin_complemento(indice)])
+
+
+def pue_con_complementos(motor, indice, filtros=()):
+    return motor.filas(list(filtros) + [contiene_texto('Método de Pago', 'PUE'), con_complemento(indice)])
+
+
+def complementos(motor, filtros=()):
+    motor.asegurar(['UUIDs_Relacionados'])
+    return motor.filas(list(filtros) + [no_nulo('UUIDs_Relacionados')])
+
+
+# Facturas, estatus, método de pago y monto por mes, a partir del cubo de agregados
+def resumen_mensual(cubo):
+    if 'Mes' not in cubo.columns:
+        return pd.DataFrame()
+    cantidad = cubo['Cantidad']
+    columnas = {'Facturas': cantidad}
+    for nombre, columna, texto in [
+        ('Vigentes', 'Estatus', 'Vigente'),
+        ('Canceladas', 'Estatus', 'Cancelado'),
+        ('PPD', 'Método de Pago', 'PPD'),
+        ('PUE', 'Método de Pago', 'PUE'),
+    ]:
+        if columna in cubo.columns:
+            columnas[nombre] = cantidad.where(contiene(cubo[columna], texto).to_numpy(dtype=bool), 0)
+    if 'Total' in cubo.columns:
+        columnas['Total'] = cubo['Total']
+    return pd.DataFrame(columnas).groupby(cubo['Mes'].astype(str), sort=True).sum()
+
+
+# Todos los reportes de una tabla cargada, listos para escribir: nombre -> DataFrame
+def reportes(df):
+    # Todos los reportes usan las columnas derivadas: se calculan una vez aquí
+    df = con_derivadas(df)
+    motor = MotorFiltros(df)
+    columnas = [c for c in COLUMNAS_FACTURA if c in df.columns]
+    resultado = {'Resumen mensual': resumen_mensual(CuboAgregados(df).cubo).reset_index()}
+
+    if 'UUID' in df.columns and 'UUIDs_Relacionados' in df.columns:
+        indice = IndiceRelaciones(df)
+        if 'Método de Pago' in df.columns:
+            resultado['PPD sin complemento'] = motor.tomar(ppd_sin_complemento(motor, indice), columnas)
+            resultado['PUE con complementos'] = motor.tomar(pue_con_complementos(motor, indice), columnas)
+            resultado['Conciliación PPD'] = conciliar_ppd(df)
+        resultado['Complementos'] = motor.tomar(
+            complementos(motor), columnas + ['UUIDs_Relacionados']
+        )
+
+    return {nombre: para_mostrar(tabla, separador='|') for nombre, tabla in resultado.items()}
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agregados import CuboAgregados, cantidad, cantidad_con, por  # noqa: E402
+from almacen import AlmacenFacturas  # noqa: E402
+from analisis import ppd_sin_complemento  # noqa: E402
+from cambios import COLUMNAS_INSTANTANEA, comparar, periodo_del_exporte  # noqa: E402
+from cache_datos import CacheDatos, hash_contenido  # noqa: E402
+from esquema import binario_a_uuids  # noqa: E402
+from filtros import MotorFiltros, en, entre_fechas  # noqa: E402
+from generador import agregar_opciones, generar_exportes, parametros_de  # noqa: E402
+from indices import IndiceBusqueda, IndiceRelaciones, uuids_en_texto  # noqa: E402
+from ingesta import (  # noqa: E402
+    VERSION_NORMALIZACION,
+    cargar_en_paralelo,
+    cargar_por_lotes,
+    combinar_sin_duplicados,
+    con_derivadas,
+)
+
+# Escalamiento de la aplicación con exportes sintéticos: tiempo y memoria pico
+# de cada etapa (carga, historial local, filtros de la barra lateral, Resumen
+# General, PPD sin complemento y búsqueda de UUID) a varios tamaños. Los
+# resultados se guardan en JSON para comparar entre versiones.
+#
+#   python benchmarks/bench_app.py [--filas 10000 100000 1000000] [--formato xls|xlsx|csv] [--comparar anterior.json]
+#                                  [--proporcion-ppd 0.5 --proporcion-complementos 0.2 ...]
+#
+# Los exportes se generan una vez en benchmarks/datos/ y se reutilizan.
+
+TAMANOS = [10_000, 100_000, 1_000_000]
+REPETICIONES = 3
+DIRECTORIO_DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos')
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados')
+
+
+# Pico de memoria del bloque sobre la de inicio: tracemalloc ve las
+# asignaciones de Python y NumPy, y un hilo muestrea el pool de Arrow, que
+# tracemalloc no ve. No cuenta la memoria de los procesos hijos de la carga en
+# paralelo. Se mide en una ejecución aparte porque tracemalloc hace más lento
+# el código.
+class MedidorMemoria:
+    INTERVALO = 0.002
+
+    def __enter__(self):
+        self._arrow_inicio = self._arrow_pico = pa.total_allocated_bytes()
+        self._activo = True
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        tracemalloc.start()
+        self._hilo.start()
+        return self
+
+    def _muestrear(self):
+        while self._activo:
+            self._arrow_pico = max(self._arrow_pico, pa.total_allocated_bytes())
+            time.sleep(self.INTERVALO)
+
+    def __exit__(self, *error):
+        self._activo = False
+        self._hilo.join()
+        self._arrow_pico = max(self._arrow_pico, pa.total_allocated_bytes())
+        _, self._python_pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    @property
+    def megabytes(self):
+        return round((self._python_pico + self._arrow_pico - self._arrow_inicio) / (1024 * 1024), 1)
+
+
+# Mide la etapa: una ejecución con el medidor de memoria y luego las
+# repeticiones cronometradas. Devuelve (resultado, medición).
+def medir(funcion, repeticiones=REPETICIONES, preparar=None):
+    with MedidorMemoria() as medidor:
+        resultado = funcion(preparar()) if preparar is not None else funcion()
+    del resultado
+    tiempos = []
+    for _ in range(repeticiones):
+        argumento = preparar() if preparar is not None else None
+        inicio = time.perf_counter()
+        resultado = funcion(argumento) if preparar is not None else funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, {
+        'segundos': round(min(tiempos), 6),
+        'segundos_mediana': round(float(np.median(tiempos)), 6),
+        'memoria_pico_mb': medidor.megabytes,
+        'repeticiones': repeticiones,
+    }
+
+
+# Igual que obtener_tablas/cargar_datos de index.py sin caché: un archivo se
+# procesa en el proceso actual y varios en paralelo. Devuelve la tabla
+# combinada y la de cada archivo.
+def cargar_sin_cache(contenidos):
+    if len(contenidos) == 1:
+        tablas = [cargar_por_lotes(contenidos[0])]
+    else:
+        tablas = [None] * len(contenidos)
+        for j, df, _ in cargar_en_paralelo(contenidos):
+            tablas[j] = df
+    return combinar_sin_duplicados(tablas), tablas
+
+
+def cargar_desde_cache(directorio, claves):
+    # Instancia nueva: lectura desde Parquet, como tras reiniciar la aplicación
+    cache = CacheDatos(directorio=directorio)
+    return combinar_sin_duplicados([cache.obtener(clave) for clave in claves])
+
+
+def etapas(filas, datos, repeticiones, formato='xls', parametros=None):
+    resultados = {}
+    rutas = generar_exportes(filas, os.path.join(datos, f"{filas}-{formato}"), formato=formato, **(parametros or {}))
+    contenidos = []
+    for ruta in rutas:
+        with open(ruta, 'rb') as archivo:
+            contenidos.append(archivo.read())
+    megabytes = sum(len(c) for c in contenidos) / (1024 * 1024)
+
+    # La carga completa se mide una vez con 1M filas: tarda minutos
+    (df, tablas), resultados['carga'] = medir(lambda: cargar_sin_cache(contenidos), 1 if filas >= 1_000_000 else repeticiones)
+    resultados['carga'].update(archivos=len(rutas), megabytes=round(megabytes, 1), filas_salida=len(df))
+
+    with tempfile.TemporaryDirectory() as directorio:
+        claves = [f"{hash_contenido(c)}-v{VERSION_NORMALIZACION}" for c in contenidos]
+        guardar = CacheDatos(directorio=directorio)
+        for clave, tabla in zip(claves, tablas):
+            guardar.guardar(clave, tabla)
+        del tablas
+        _, resultados['carga_cache'] = medir(lambda: cargar_desde_cache(directorio, claves), repeticiones)
+
+    # Historial local: abrir todos los meses contra abrir solo el último
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenFacturas(os.path.join(directorio, 'facturas.sqlite3'))
+        almacen.upsert(df)
+        ultimo = almacen.meses()[-1]
+        historial, resultados['historial_completo'] = medir(lambda: almacen.cargar()[0], repeticiones)
+        resultados['historial_completo'].update(filas_salida=len(historial))
+        mes, resultados['historial_1_mes'] = medir(lambda: almacen.cargar(ultimo, ultimo)[0], repeticiones)
+        resultados['historial_1_mes'].update(filas_salida=len(mes))
+
+        # Cambios al volver a subir el mismo exporte: instantánea de sus meses + huellas
+        def cambios():
+            return comparar(almacen.instantanea(*periodo_del_exporte(df), COLUMNAS_INSTANTANEA), df, almacen.complementos_de)
+        delta, resultados['cambios_exporte'] = medir(cambios, repeticiones)
+        resultados['cambios_exporte'].update(filas_entrada=delta.comparadas + len(df), filas_salida=len(delta.modificadas))
+        del historial, mes, almacen, delta
+
+    # Filtros de la barra lateral: estatus + rango de fechas
+    desde, hasta = df['Fecha'].min(), df['Fecha'].max()
+    medio = desde + (hasta - desde) / 2
+    base = [en('Estatus', ['Vigente']), entre_fechas('Fecha', desde, medio)]
+    filas_filtradas, resultados['filtros_frio'] = medir(lambda motor: motor.filas(base), repeticiones, lambda: MotorFiltros(df))
+    resultados['filtros_frio'].update(filas_entrada=len(df), filas_salida=len(filas_filtradas))
+
+    motor = MotorFiltros(df)
+    motor.filas(base)
+    rangos = iter([(desde, hasta), (desde, medio)] * repeticiones)
+
+    # Se olvidan las combinaciones memorizadas para medir el recálculo del rango
+    def cambiar_rango():
+        motor._combinaciones.clear()
+        inicio, fin = next(rangos)
+        return motor.filas([en('Estatus', ['Vigente']), entre_fechas('Fecha', inicio, fin)])
+    filas_filtradas, resultados['filtros_cambio_fecha'] = medir(cambiar_rango, repeticiones)
+
+    # Resumen General: el cubo se arma al cargar y las tarjetas leen el cubo filtrado
+    cubo, resultados['resumen_cubo'] = medir(lambda: CuboAgregados(df), repeticiones)
+    resultados['resumen_cubo'].update(filas_entrada=len(df), filas_salida=len(cubo))
+
+    def tarjetas():
+        filtrado = cubo.filtrar(estatus=['Vigente', 'Cancelado'], desde=desde, hasta=hasta)
+        return (
+            cantidad(filtrado),
+            cantidad_con(filtrado, 'Estatus', 'Vigente'),
+            cantidad_con(filtrado, 'Estatus', 'Cancelado'),
+            cantidad_con(filtrado, 'Método de Pago', 'PPD'),
+            por(filtrado, 'Método de Pago'),
+            por(filtrado, 'Mes', ordenar=True),
+        )
+    _, resultados['resumen_tarjetas'] = medir(tarjetas, repeticiones)
+
+    # Columnas derivadas (mes, mes del XML, listas de UUID): se calculan la
+    # primera vez que una página las pide, no en la carga
+    base_df = df
+    df, resultados['columnas_derivadas'] = medir(lambda: con_derivadas(base_df), repeticiones)
+
+    # PPD sin complemento: índice de relaciones + máscaras sobre un motor nuevo
+    indice, resultados['indice_relaciones'] = medir(lambda: IndiceRelaciones(df), repeticiones)
+    resultados['indice_relaciones'].update(filas_salida=len(indice))
+
+    def detectar(motor):
+        return ppd_sin_complemento(motor, indice, base)
+    ppd, resultados['ppd_sin_complemento'] = medir(detectar, repeticiones, lambda: MotorFiltros(df))
+    resultados['ppd_sin_complemento'].update(filas_entrada=len(df), filas_salida=len(ppd))
+
+    # Búsqueda de UUID como en la página PPD/PUE: texto pegado -> filas de complementos
+    rng = np.random.default_rng(0)
+    citados = binario_a_uuids(pa.array(list(indice.uuids_relacionados)[:100_000], type=pa.binary(16)))
+    for cantidad_uuids in [1, 100]:
+        texto = ', '.join(rng.choice(citados, cantidad_uuids))
+
+        def buscar():
+            encontrados = indice.complementos_de_varios(uuids_en_texto(texto))
+            return [df.loc[filas] for filas in encontrados.values()]
+        encontrados, resultados[f'busqueda_{cantidad_uuids}_uuid'] = medir(buscar, repeticiones * 3)
+        resultados[f'busqueda_{cantidad_uuids}_uuid'].update(filas_salida=sum(len(t) for t in encontrados))
+
+    # Búsqueda por los primeros 8 caracteres de un UUID (lo que se tiene del CFDI impreso)
+    busqueda, resultados['indice_busqueda'] = medir(lambda: IndiceBusqueda(df), repeticiones)
+    resultados['indice_busqueda'].update(filas_salida=len(busqueda))
+    prefijos = [uuid[:8] for uuid in rng.choice(citados, 100)]
+
+    def buscar_prefijos():
+        return [busqueda.buscar(prefijo) for prefijo in prefijos]
+    coincidencias, resultados['busqueda_prefijo_x100'] = medir(buscar_prefijos, repeticiones)
+    resultados['busqueda_prefijo_x100'].update(filas_salida=sum(len(c) for c in coincidencias))
+    return resultados
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _entorno():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _imprimir(filas, resultados, anterior=None):
+    print(f"\n{filas:,} filas")
+    encabezado = f"  {'etapa':<24} {'segundos':>10} {'MB pico':>9} {'filas salida':>13}"
+    print(encabezado + (f" {'vs anterior':>12}" if anterior else ''))
+    for etapa, medicion in resultados.items():
+        linea = (
+            f"  {etapa:<24} {medicion['segundos']:>10.4f} "
+            f"{medicion['memoria_pico_mb']:>9} {medicion.get('filas_salida', ''):>13}"
+        )
+        previa = (anterior or {}).get(etapa)
+        if previa and previa['segundos']:
+            linea += f" {medicion['segundos'] / previa['segundos']:>11.2f}x"
+        print(linea)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo y memoria de cada etapa de la aplicación a varios tamaños.")
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS)
+    parser.add_argument('--repeticiones', type=int, default=REPETICIONES)
+    parser.add_argument('--formato', choices=['xls', 'xlsx', 'csv'], default='xls', help="Formato de los exportes sintéticos")
+    parser.add_argument('--datos', default=DIRECTORIO_DATOS, help="Carpeta de los exportes sintéticos")
+    parser.add_argument('--salida', default=DIRECTORIO_RESULTADOS, help="Carpeta de los resultados JSON")
+    parser.add_argument('--comparar', help="JSON de una corrida anterior para comparar tiempos")
+    agregar_opciones(parser)
+    args = parser.parse_args(argv)
+    parametros = parametros_de(args)
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            anterior = json.load(archivo)['resultados']
+
+    commit = _commit()
+    corrida = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'version_normalizacion': VERSION_NORMALIZACION,
+        'formato': args.formato,
+        'parametros': parametros,
+        'entorno': _entorno(),
+        'resultados': {},
+    }
+    for filas in args.filas:
+        corrida['resultados'][str(filas)] = etapas(filas, args.datos, args.repeticiones, args.formato, parametros)
+        _imprimir(filas, corrida['resultados'][str(filas)], anterior.get(str(filas)))
+
+    # Memoria residente máxima del proceso y de los procesos de carga (KB en Linux)
+    corrida['memoria_maxima_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    corrida['memoria_maxima_procesos_carga_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    os.makedirs(args.salida, exist_ok=True)
+    nombre = f"{datetime.now():%Y%m%d-%H%M%S}{'-' + commit if commit else ''}.json"
+    ruta = os.path.join(args.salida, nombre)
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(corrida, archivo, indent=2, ensure_ascii=False)
+    print(f"\nResultados en {ruta}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filtros import MotorFiltros, en, entre_fechas  # noqa: E402
+
+# Latencia de los filtros de la barra lateral: método anterior (copia + máscaras
+# encadenadas) contra el motor incremental.
+#
+#   python benchmarks/bench_filtros.py [filas ...]
+
+TAMANOS = [10_000, 100_000, 1_000_000]
+REPETICIONES = 5
+
+
+def tabla_sintetica(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        'Fecha': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 5 * 365, n), unit='D'),
+        'Estatus': pd.Categorical(rng.choice(['Vigente', 'Cancelado'], n, p=[0.9, 0.1])),
+        'Método de Pago': pd.Categorical(rng.choice(['PPD', 'PUE', ''], n)),
+        'Forma de Pago': pd.Categorical(rng.choice(['01', '03', '04', '28', '99'], n)),
+        'Total': rng.uniform(10, 100_000, n).round(2),
+    }).sort_values('Fecha', ignore_index=True)  # como la deja el cargador
+
+
+def cronometrar(funcion):
+    tiempos = []
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos) * 1000
+
+
+def filtrado_anterior(df, estatus, rango, metodo):
+    df_filtrado = df.copy()
+    df_filtrado = df_filtrado[df_filtrado['Estatus'].isin(estatus)]
+    df_filtrado = df_filtrado[
+        (df_filtrado['Fecha'] >= pd.to_datetime(rango[0])) &
+        (df_filtrado['Fecha'] <= pd.to_datetime(rango[1]))
+    ]
+    return df_filtrado[df_filtrado['Método de Pago'].isin(metodo)]
+
+
+def main():
+    tamanos = [int(x) for x in sys.argv[1:]] or TAMANOS
+    rango = ('2021-01-01', '2023-06-30')
+    print(f"{'filas':>10} {'anterior':>10} {'motor frío':>11} {'1 cambio':>10} {'sin cambio':>11}  (ms)")
+    for n in tamanos:
+        df = tabla_sintetica(n)
+
+        anterior = cronometrar(lambda: filtrado_anterior(df, ['Vigente'], rango, ['PPD']))
+
+        def frio():
+            MotorFiltros(df).filas([en('Estatus', ['Vigente']), entre_fechas('Fecha', *rango), en('Método de Pago', ['PPD'])])
+        motor_frio = cronometrar(frio)
+
+        motor = MotorFiltros(df)
+        base = [en('Estatus', ['Vigente']), entre_fechas('Fecha', *rango)]
+        motor.filas(base + [en('Método de Pago', ['PPD'])])
+        alternar = iter(['PUE', 'PPD'] * REPETICIONES)
+
+        # Se olvidan las combinaciones memorizadas para medir el recálculo de una sola máscara
+        def recalcular_una():
+            motor._combinaciones.clear()
+            motor.filas(base + [en('Método de Pago', [next(alternar)])])
+        un_cambio = cronometrar(recalcular_una)
+        sin_cambio = cronometrar(lambda: motor.filas(base + [en('Método de Pago', ['PPD'])]))
+
+        print(f"{n:>10,} {anterior:>10.2f} {motor_frio:>11.2f} {un_cambio:>10.2f} {sin_cambio:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
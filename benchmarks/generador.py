@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+# Generador determinista de exportes sintéticos con el formato del SAT: las
+# mismas columnas y tipos de celda que los .xls reales (texto salvo 'Total').
+# Con la misma semilla y parámetros produce los mismos archivos.
+#
+#   python benchmarks/generador.py FILAS CARPETA [semilla] [xls|xlsx|csv] [--proporcion-ppd 0.3 ...]
+#
+# Cada entrada de PARAMETROS es también una opción de línea de comandos
+# (proporcion_ppd -> --proporcion-ppd), aquí y en bench_app.py.
+#
+# Un .xls admite 65 536 filas por hoja, así que los volúmenes grandes se
+# reparten en varios archivos, como cuando se suben varios exportes a la vez;
+# .xlsx y .csv van en un solo archivo. Escribir .xls requiere xlwt, que está en
+# requirements-dev.txt (solo para los benchmarks).
+
+COLUMNAS = ['UUID', 'Fecha', 'Método de Pago', 'Forma de Pago', 'Estatus', 'Total', 'XML', 'Relacionados']
+FILAS_POR_ARCHIVO = 60_000
+
+PPD = 'PPD Pago en parcialidades o diferido'
+PUE = 'PUE Pago en una sola exhibición'
+FORMAS_DE_PAGO = ['01', '02', '03', '04', '28', '99']
+
+PARAMETROS = {
+    'proporcion_ppd': 0.5,            # facturas PPD entre las que no son complementos
+    'proporcion_complementos': 0.2,   # filas que son complementos de pago
+    'proporcion_canceladas': 0.08,    # filas con estatus Cancelado
+    'proporcion_pue_citadas': 0.05,   # relaciones que apuntan a una factura PUE
+    'proporcion_huerfanas': 0.02,     # relaciones a UUID que no están en el exporte
+    'max_relacionados': 3,            # documentos citados por complemento
+    'desde': '2020-01-01',
+    'anios': 5,
+}
+
+
+def _uuids(rng, n):
+    texto = rng.integers(0, 256, n * 16, dtype=np.uint8).tobytes().hex().upper()
+    return np.array([
+        f"{texto[i:i + 8]}-{texto[i + 8:i + 12]}-{texto[i + 12:i + 16]}-{texto[i + 16:i + 20]}-{texto[i + 20:i + 32]}"
+        for i in range(0, n * 32, 32)
+    ], dtype=object)
+
+
+# Columnas del exporte (nombre -> arreglo), en el orden de las filas
+def generar_tabla(filas, semilla=0, **parametros):
+    p = {**PARAMETROS, **parametros}
+    rng = np.random.default_rng(semilla)
+
+    uuids = _uuids(rng, filas)
+    segundos = rng.integers(0, p['anios'] * 365 * 86400, filas)
+    fechas = np.datetime_as_string(np.datetime64(p['desde'], 's') + segundos, unit='s')
+    fechas = np.array([f"{f[:10]} {f[11:]}" for f in fechas], dtype=object)
+
+    es_complemento = rng.random(filas) < p['proporcion_complementos']
+    es_ppd = ~es_complemento & (rng.random(filas) < p['proporcion_ppd'])
+    metodo = np.where(es_complemento, '', np.where(es_ppd, PPD, PUE)).astype(object)
+    forma = np.where(es_complemento, '03', rng.choice(FORMAS_DE_PAGO, filas)).astype(object)
+    estatus = np.where(rng.random(filas) < p['proporcion_canceladas'], 'Cancelado', 'Vigente').astype(object)
+    total = rng.lognormal(8, 1.2, filas).round(2)
+
+    # Relaciones de cada complemento: facturas PPD, algunas PUE y algunos UUID ajenos
+    relacionados = np.full(filas, '', dtype=object)
+    complementos = np.flatnonzero(es_complemento)
+    ppd, pue = np.flatnonzero(es_ppd), np.flatnonzero(~es_complemento & ~es_ppd)
+    if len(complementos) and len(ppd):
+        citas = rng.integers(1, p['max_relacionados'] + 1, len(complementos))
+        origen = np.repeat(np.arange(len(complementos)), citas)
+        sorteo = rng.random(len(origen))
+        huerfana = sorteo < p['proporcion_huerfanas']
+        a_pue = ~huerfana & (sorteo < p['proporcion_huerfanas'] + p['proporcion_pue_citadas'])
+        destino = ppd[rng.integers(0, len(ppd), len(origen))]
+        if len(pue):
+            destino[a_pue] = pue[rng.integers(0, len(pue), int(a_pue.sum()))]
+        citados = uuids[destino]
+        citados[huerfana] = _uuids(rng, int(huerfana.sum()))
+
+        # Cada complemento paga una parte de lo que cita
+        pagado = np.bincount(origen, weights=np.where(huerfana, 0, total[destino]), minlength=len(complementos))
+        total[complementos] = (pagado * rng.uniform(0.3, 1.0, len(complementos))).round(2)
+        relacionados[complementos] = [', '.join(grupo) for grupo in np.split(citados, np.cumsum(citas)[:-1])]
+
+    xml = np.array([f"{f[:4]}{f[5:7]}_{u}.xml" for f, u in zip(fechas, uuids)], dtype=object)
+
+    return {
+        'UUID': uuids,
+        'Fecha': fechas,
+        'Método de Pago': metodo,
+        'Forma de Pago': forma,
+        'Estatus': estatus,
+        'Total': total,
+        'XML': xml,
+        'Relacionados': relacionados,
+    }
+
+
+def escribir_xls(ruta, tabla, inicio, fin):
+    import xlwt
+
+    libro = xlwt.Workbook(encoding='utf-8')
+    hoja = libro.add_sheet('Facturas')
+    for j, nombre in enumerate(COLUMNAS):
+        hoja.write(0, j, nombre)
+    for j, nombre in enumerate(COLUMNAS):
+        valores = tabla[nombre]
+        convertir = float if nombre == 'Total' else str
+        for i in range(inicio, fin):
+            # Celdas vacías como en los exportes reales (sin relaciones -> celda en blanco)
+            if valores[i] != '':
+                hoja.write(i - inicio + 1, j, convertir(valores[i]))
+    libro.save(ruta)
+
+
+def escribir_xlsx(ruta, tabla, inicio, fin):
+    import xlsxwriter
+
+    libro = xlsxwriter.Workbook(ruta, {'constant_memory': True, 'strings_to_urls': False})
+    hoja = libro.add_worksheet('Facturas')
+    hoja.write_row(0, 0, COLUMNAS)
+    for i in range(inicio, fin):
+        for j, nombre in enumerate(COLUMNAS):
+            valor = tabla[nombre][i]
+            if nombre == 'Total':
+                hoja.write_number(i - inicio + 1, j, float(valor))
+            elif valor != '':
+                hoja.write_string(i - inicio + 1, j, valor)
+    libro.close()
+
+
+def escribir_csv(ruta, tabla, inicio, fin):
+    import pandas as pd
+
+    pd.DataFrame({nombre: valores[inicio:fin] for nombre, valores in tabla.items()}).to_csv(ruta, index=False)
+
+
+ESCRITORES = {'xls': escribir_xls, 'xlsx': escribir_xlsx, 'csv': escribir_csv}
+
+
+# Escribe los exportes en la carpeta y devuelve sus rutas. Si la carpeta ya
+# tiene los archivos de los mismos parámetros, se reutilizan.
+def generar_exportes(filas, carpeta, semilla=0, formato='xls', **parametros):
+    descripcion = {'filas': filas, 'semilla': semilla, 'formato': formato, 'parametros': {**PARAMETROS, **parametros}}
+    manifiesto = os.path.join(carpeta, 'manifiesto.json')
+    if os.path.exists(manifiesto):
+        with open(manifiesto, encoding='utf-8') as archivo:
+            guardado = json.load(archivo)
+        if guardado['descripcion'] == descripcion and all(
+            os.path.exists(os.path.join(carpeta, nombre)) for nombre in guardado['archivos']
+        ):
+            return [os.path.join(carpeta, nombre) for nombre in guardado['archivos']]
+
+    os.makedirs(carpeta, exist_ok=True)
+    tabla = generar_tabla(filas, semilla, **parametros)
+    nombres = []
+    por_archivo = FILAS_POR_ARCHIVO if formato == 'xls' else max(filas, 1)
+    for parte, inicio in enumerate(range(0, filas, por_archivo), start=1):
+        nombre = f"exporte_{parte:03d}.{formato}"
+        ESCRITORES[formato](os.path.join(carpeta, nombre), tabla, inicio, min(inicio + por_archivo, filas))
+        nombres.append(nombre)
+    with open(manifiesto, 'w', encoding='utf-8') as archivo:
+        json.dump({'descripcion': descripcion, 'archivos': nombres}, archivo, indent=2)
+    return [os.path.join(carpeta, nombre) for nombre in nombres]
+
+
+# Una opción por cada entrada de PARAMETROS, con el mismo valor por omisión
+def agregar_opciones(parser):
+    for nombre, valor in PARAMETROS.items():
+        parser.add_argument(
+            f"--{nombre.replace('_', '-')}", dest=nombre, type=type(valor), default=valor,
+            help=f"(por omisión: {valor})"
+        )
+
+
+def parametros_de(args):
+    return {nombre: getattr(args, nombre) for nombre in PARAMETROS}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exportes sintéticos del SAT, deterministas por semilla.")
+    parser.add_argument('filas', type=int)
+    parser.add_argument('carpeta')
+    parser.add_argument('semilla', type=int, nargs='?', default=0)
+    parser.add_argument('formato', nargs='?', choices=list(ESCRITORES), default='xls')
+    agregar_opciones(parser)
+    args = parser.parse_args()
+    rutas = generar_exportes(args.filas, args.carpeta, args.semilla, args.formato, **parametros_de(args))
+    print("\n".join(rutas))
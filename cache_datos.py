@@ -0,0 +1,191 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Caché de archivos ya procesados, indexada por el hash del contenido subido.
+# Vive en un módulo aparte porque Streamlit vuelve a ejecutar index.py en cada
+# interacción; un módulo importado se conserva entre reruns y entre sesiones.
+
+DIRECTORIO_CACHE = os.environ.get(
+    "FACTURADOR_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "facturador_cache")
+)
+MAX_BYTES_MEMORIA = int(os.environ.get("FACTURADOR_CACHE_MEMORIA_MB", "512")) * 1024 * 1024
+MAX_BYTES_DISCO = int(os.environ.get("FACTURADOR_CACHE_DISCO_MB", "2048")) * 1024 * 1024
+
+
+def hash_contenido(contenido):
+    return hashlib.sha256(contenido).hexdigest()
+
+
+# Las columnas Arrow (UUID binarios y listas) se restauran como ArrowDtype;
+# los metadatos de pandas no saben reconstruir esos tipos por sí solos
+def tipo_pandas(tipo):
+    if pa.types.is_fixed_size_binary(tipo) or pa.types.is_list(tipo):
+        return pd.ArrowDtype(tipo)
+    return None
+
+
+# Archivo temporal junto a la ruta, único por proceso e hilo: el CLI y el
+# servidor pueden escribir a la vez en el mismo directorio
+def _temporal(ruta):
+    return f"{ruta}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def tamano_df(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class CacheDatos:
+    def __init__(self, directorio=DIRECTORIO_CACHE, max_bytes_memoria=MAX_BYTES_MEMORIA,
+                 max_bytes_disco=MAX_BYTES_DISCO):
+        self.directorio = directorio
+        self.max_bytes_memoria = max_bytes_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self._memoria = OrderedDict()  # clave -> (df, bytes)
+        self._bytes_memoria = 0
+        self._lock = threading.Lock()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.desalojos_memoria = 0
+        self.desalojos_disco = 0
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.parquet")
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return entrada[0]
+
+        df = self._leer_disco(clave)
+        with self._lock:
+            if df is None:
+                self.fallos += 1
+                return None
+            self.aciertos_disco += 1
+            self._guardar_memoria(clave, df)
+        return df
+
+    def guardar(self, clave, df):
+        with self._lock:
+            self._guardar_memoria(clave, df)
+        self._escribir_disco(clave, df)
+
+    def limpiar(self):
+        with self._lock:
+            self._memoria.clear()
+            self._bytes_memoria = 0
+        if os.path.isdir(self.directorio):
+            for nombre in os.listdir(self.directorio):
+                if nombre.endswith(".parquet"):
+                    os.remove(os.path.join(self.directorio, nombre))
+
+    def estadisticas(self):
+        bytes_disco = sum(tamano for _, tamano, _ in self._archivos_disco())
+        with self._lock:
+            consultas = self.aciertos_memoria + self.aciertos_disco + self.fallos
+            return {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "tasa_aciertos": (consultas - self.fallos) / consultas if consultas else 0.0,
+                "entradas_memoria": len(self._memoria),
+                "bytes_memoria": self._bytes_memoria,
+                "bytes_disco": bytes_disco,
+                "desalojos_memoria": self.desalojos_memoria,
+                "desalojos_disco": self.desalojos_disco,
+            }
+
+    # Nivel en memoria: LRU acotado por bytes (se llama con el lock tomado)
+    def _guardar_memoria(self, clave, df):
+        anterior = self._memoria.pop(clave, None)
+        if anterior is not None:
+            self._bytes_memoria -= anterior[1]
+
+        tamano = tamano_df(df)
+        if tamano > self.max_bytes_memoria:
+            return
+        self._memoria[clave] = (df, tamano)
+        self._bytes_memoria += tamano
+
+        while self._bytes_memoria > self.max_bytes_memoria:
+            _, (_, liberado) = self._memoria.popitem(last=False)
+            self._bytes_memoria -= liberado
+            self.desalojos_memoria += 1
+
+    # Nivel en disco: Parquet, acotado por bytes, desaloja por fecha de acceso
+    def _leer_disco(self, clave):
+        ruta = self._ruta(clave)
+        if not os.path.exists(ruta):
+            return None
+        try:
+            df = pq.read_table(ruta).to_pandas(ignore_metadata=True, types_mapper=tipo_pandas)
+            os.utime(ruta)
+            return df
+        except Exception:
+            # Archivo corrupto o incompleto: se descarta y se vuelve a procesar
+            self._borrar(ruta)
+            return None
+
+    def _escribir_disco(self, clave, df):
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = self._ruta(clave)
+            temporal = _temporal(ruta)
+            df.to_parquet(temporal, index=False)
+            os.replace(temporal, ruta)
+        except Exception:
+            # Columnas con tipos mezclados u otros problemas de escritura:
+            # el nivel en memoria sigue funcionando
+            self._borrar(_temporal(self._ruta(clave)))
+            return
+        self._recortar_disco()
+
+    # (fecha de acceso, bytes, ruta) de cada archivo del nivel en disco
+    def _archivos_disco(self):
+        archivos = []
+        if not os.path.isdir(self.directorio):
+            return archivos
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(".parquet"):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                info = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((info.st_mtime, info.st_size, ruta))
+        return archivos
+
+    def _recortar_disco(self):
+        archivos = self._archivos_disco()
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.max_bytes_disco:
+                break
+            self._borrar(ruta)
+            total -= tamano
+            with self._lock:
+                self.desalojos_disco += 1
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+# Instancia compartida por todas las sesiones del servidor
+cache = CacheDatos()
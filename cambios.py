@@ -0,0 +1,173 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from diagnostico import etapa
+from esquema import TIPO_UUID, arreglo_arrow, contiene, serie_arrow
+from ingesta import con_derivadas
+
+# Cambios entre un exporte nuevo y la instantánea guardada de los mismos meses.
+# Cada fila se resume en una huella de 64 bits de sus columnas relevantes; el
+# cruce por UUID es un hash join de Arrow, así que el costo es lineal en filas
+# y solo se comparan columnas de las facturas cuya huella cambió.
+
+COLUMNAS_HUELLA = ['Fecha', 'Estatus', 'Método de Pago', 'Forma de Pago', 'Total', 'Relacionados']
+COLUMNAS_REPORTE = ['UUID', 'Fecha', 'Total', 'Estatus']
+# Columnas que hay que leer de la instantánea para comparar
+COLUMNAS_INSTANTANEA = ['UUID', 'Fecha', 'Total', 'Estatus', 'Método de Pago', 'Forma de Pago',
+                        'Relacionados', 'UUIDs_Relacionados']
+
+CANCELADO = 'Cancelado'
+
+Cambios = namedtuple('Cambios', [
+    'comparadas',  # facturas de la instantánea en los meses del exporte
+    'nuevas',  # facturas del exporte que no estaban guardadas
+    'eliminadas',  # guardadas en esos meses que ya no vienen en el exporte
+    'estatus',  # facturas cuyo estatus cambió (con el estatus anterior)
+    'modificadas',  # otros cambios en las columnas de la huella, mismo estatus
+    'complementos_cancelados',  # complementos que citan facturas recién canceladas
+])
+
+
+# Valores de la columna comparables entre tablas de distinto origen (xls, csv,
+# historial): fechas en ns, montos como float y texto sin distinguir nulo de ''
+def _hash_columna(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie.dtype):
+        return pd.util.hash_array(serie.to_numpy(dtype='datetime64[ns]').view(np.int64))
+    if serie.name == 'Total':
+        return pd.util.hash_array(pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan))
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Un hash por categoría y luego por código
+        categorias = np.append(serie.cat.categories.astype(str).to_numpy(dtype=object), '')
+        return pd.util.hash_array(categorias)[serie.cat.codes.to_numpy()]
+    return pd.util.hash_array(serie.fillna('').astype(str).to_numpy(dtype=object))
+
+
+# Huella de cada fila: combinación de los hashes de las columnas indicadas
+def huellas(df, columnas=COLUMNAS_HUELLA):
+    huella = np.zeros(len(df), dtype=np.uint64)
+    for col in columnas:
+        if col in df.columns:
+            huella = (huella * np.uint64(1000003)) ^ _hash_columna(df[col])
+    return huella
+
+
+# Periodo del exporte en meses completos: del primer día de su primer mes al
+# último instante del último (None sin fechas). Un exporte cubre meses enteros
+# aunque sus facturas no lleguen al día 1 o al fin de mes; lo guardado en esos
+# días y ausente del exporte también cuenta como eliminado.
+def periodo_del_exporte(df):
+    fechas = df['Fecha'].dropna() if 'Fecha' in df.columns else None
+    if fechas is None or fechas.empty:
+        return None
+    return fechas.min().to_period('M').start_time, fechas.max().to_period('M').end_time
+
+
+def _reporte(df, filas):
+    return df[[c for c in COLUMNAS_REPORTE if c in df.columns]].take(filas).reset_index(drop=True)
+
+
+# Comparar el exporte nuevo contra la instantánea anterior del mismo periodo.
+# complementos_guardados(facturas) busca en todo el historial los complementos
+# que citan esas facturas (AlmacenFacturas.complementos_de); sin él solo se
+# buscan en la instantánea, que no ve los complementos de meses posteriores.
+def comparar(anterior, nueva, complementos_guardados=None):
+    with etapa('cambios', filas_entrada=len(anterior) + len(nueva)) as medicion:
+        uuids_anteriores = arreglo_arrow(anterior['UUID'])
+        uuids_nuevos = arreglo_arrow(nueva['UUID'])
+        # Posición de cada factura nueva en la instantánea (-1 si no estaba)
+        en_anterior = pc.index_in(
+            uuids_nuevos, options=pc.SetLookupOptions(uuids_anteriores, skip_nulls=True)
+        ).fill_null(-1).to_numpy()
+        validas = uuids_nuevos.is_valid().to_numpy(zero_copy_only=False)
+        nuevas = np.flatnonzero((en_anterior < 0) & validas)
+        eliminadas = np.flatnonzero(~pc.is_in(
+            uuids_anteriores, options=pc.SetLookupOptions(uuids_nuevos, skip_nulls=True)
+        ).to_numpy(zero_copy_only=False) & uuids_anteriores.is_valid().to_numpy(zero_copy_only=False))
+
+        # Una huella por fila en cada tabla (sobre las columnas que ambas tienen);
+        # solo se miran las columnas de las parejas cuya huella cambió
+        columnas = [c for c in COLUMNAS_HUELLA if c in nueva.columns and c in anterior.columns]
+        filas = np.flatnonzero(en_anterior >= 0)
+        pares = en_anterior[filas]
+        distintas = huellas(nueva, columnas)[filas] != huellas(anterior, columnas)[pares]
+        filas, pares = filas[distintas], pares[distintas]
+
+        if 'Estatus' in nueva.columns and 'Estatus' in anterior.columns:
+            estatus_nuevo = nueva['Estatus'].take(filas).astype(str).to_numpy()
+            estatus_anterior = anterior['Estatus'].take(pares).astype(str).to_numpy()
+            cambio = estatus_nuevo != estatus_anterior
+        else:
+            estatus_anterior = np.array([], dtype=object)
+            cambio = np.zeros(len(filas), dtype=bool)
+        estatus = _reporte(nueva, filas[cambio])
+        if len(estatus):
+            estatus.insert(len(estatus.columns) - 1, 'Estatus anterior', estatus_anterior[cambio])
+
+        # Recién canceladas: cambiaron a cancelado o llegan nuevas ya canceladas
+        canceladas = np.concatenate([filas[cambio], nuevas])
+        if 'Estatus' in nueva.columns:
+            canceladas = canceladas[contiene(nueva['Estatus'].take(canceladas), CANCELADO).to_numpy(dtype=bool)]
+        complementos = _complementos_de(anterior, nueva, uuids_nuevos.take(pa.array(canceladas)), complementos_guardados)
+
+        cambios = Cambios(
+            comparadas=len(anterior),
+            nuevas=_reporte(nueva, nuevas),
+            eliminadas=_reporte(anterior, eliminadas),
+            estatus=estatus,
+            modificadas=_reporte(nueva, filas[~cambio]),
+            complementos_cancelados=complementos,
+        )
+        medicion.salida(len(nuevas) + len(eliminadas) + len(filas))
+    return cambios
+
+
+# Complementos (del exporte nuevo o, si no vienen en él, los guardados) que
+# citan alguna de las facturas: una fila por par complemento-factura
+def _complementos_de(anterior, nueva, facturas, complementos_guardados=None):
+    columnas = ['Complemento', 'Fecha', 'Total', 'Factura cancelada']
+    if len(facturas) == 0:
+        return pd.DataFrame(columns=columnas)
+
+    partes = [_citas_a(nueva, facturas)]
+    if complementos_guardados is not None:
+        guardados = complementos_guardados(facturas)
+        guardados = guardados[~_en(guardados['UUID'], nueva)]
+        partes.append(pd.DataFrame({
+            'Complemento': guardados['UUID'].array,
+            'Fecha': guardados['Fecha'].to_numpy(),
+            'Total': guardados['Total'].to_numpy(),
+            'Factura cancelada': guardados['Relacionado'].array,
+        }))
+    else:
+        # En la instantánea solo cuentan los complementos que el exporte no trae
+        partes.append(_citas_a(anterior.take(np.flatnonzero(~_en(anterior['UUID'], nueva))), facturas))
+    partes = [parte for parte in partes if parte is not None and len(parte)]
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=columnas)
+
+
+# Filas cuyo UUID viene en la tabla
+def _en(uuids, df):
+    return pc.is_in(
+        arreglo_arrow(uuids), options=pc.SetLookupOptions(arreglo_arrow(df['UUID']), skip_nulls=True)
+    ).to_numpy(zero_copy_only=False)
+
+
+# Pares complemento-factura de la tabla para las facturas indicadas
+def _citas_a(df, facturas):
+    df = con_derivadas(df, ['UUIDs_Relacionados'])
+    if 'UUIDs_Relacionados' not in df.columns:
+        return None
+    listas = arreglo_arrow(df['UUIDs_Relacionados'])
+    citados = pc.list_flatten(listas).cast(TIPO_UUID)
+    coincide = pc.is_in(citados, value_set=facturas).to_numpy(zero_copy_only=False)
+    padres = pc.list_parent_indices(listas).to_numpy()[coincide]
+    return pd.DataFrame({
+        'Complemento': serie_arrow(arreglo_arrow(df['UUID']).take(pa.array(padres))),
+        'Fecha': df['Fecha'].take(padres).to_numpy() if 'Fecha' in df.columns else pd.NaT,
+        'Total': df['Total'].take(padres).to_numpy() if 'Total' in df.columns else np.nan,
+        'Factura cancelada': serie_arrow(citados.filter(pa.array(coincide))),
+    })
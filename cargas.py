@@ -0,0 +1,129 @@
+import threading
+import time
+
+from diagnostico import iniciar
+
+# Carga de archivos en segundo plano. El script de Streamlit no espera a que la
+# carga termine: la arranca en un hilo (un Trabajo), dibuja su avance y lo
+# vuelve a consultar en cada rerun. Tocar un widget mientras tanto solo vuelve
+# a dibujar el avance, no reinicia el parseo; un conjunto de archivos distinto
+# reemplaza al trabajo anterior, que se detiene en su siguiente punto de
+# control (después de cada lote de filas, de cada archivo o de cada etapa).
+#
+# El parseo en sí sigue en ingesta: por lotes en el hilo del trabajo si hay un
+# solo archivo nuevo, en procesos si hay varios.
+
+# Etapa -> descripción para la barra de avance, en el orden en que ocurren
+ETAPAS = {
+    'lectura': 'Leyendo y limpiando filas',
+    'unificacion': 'Unificando facturas por UUID',
+    'relaciones': 'Extrayendo relaciones entre facturas',
+    'indices': 'Construyendo índices',
+}
+
+
+class CargaCancelada(Exception):
+    pass
+
+
+class Trabajo:
+    # funcion(trabajo) hace la carga y reporta su avance con trabajo.fase() y
+    # trabajo.progreso(); lo que devuelve queda en trabajo.resultado
+    def __init__(self, clave, funcion):
+        self.clave = clave
+        self.resultado = None
+        self.error = None
+        self.inicio = time.monotonic()
+        self.fin = None
+        self._etapa = None
+        self._avance = None  # fracción de la etapa actual; None si no se conoce
+        self._detalle = ''
+        self._mediciones = None  # registro de diagnóstico del hilo
+        self._cancelado = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = threading.Thread(target=self._ejecutar, args=(funcion,), name=f"carga-{clave}", daemon=True)
+        self._hilo.start()
+
+    def _ejecutar(self, funcion):
+        # Las etapas del hilo se miden siempre (son pocas y largas): así el
+        # panel de diagnóstico las muestra aunque se encienda después de cargar
+        self._mediciones = iniciar(True)
+        try:
+            self.resultado = funcion(self)
+        except CargaCancelada:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.fin = time.monotonic()
+
+    @property
+    def terminado(self):
+        return self.fin is not None
+
+    @property
+    def cancelado(self):
+        return self._cancelado.is_set()
+
+    @property
+    def segundos(self):
+        return (self.fin or time.monotonic()) - self.inicio
+
+    # Registro de mediciones de la carga terminada; se entrega una sola vez
+    # para no repetir las etapas de carga en cada rerun
+    def tomar_mediciones(self):
+        if not self.terminado:
+            return None
+        mediciones, self._mediciones = self._mediciones, None
+        return mediciones
+
+    # Pedir que se detenga; el hilo termina en su siguiente punto de control
+    def cancelar(self):
+        self._cancelado.set()
+
+    # Puntos de control (se llaman desde el hilo del trabajo)
+    def fase(self, etapa):
+        self._revisar()
+        with self._lock:
+            self._etapa, self._avance, self._detalle = etapa, None, ''
+
+    def progreso(self, listos, total, unidad="filas procesadas"):
+        self._revisar()
+        with self._lock:
+            self._avance = min(listos / total, 1.0) if total else None
+            self._detalle = f"{listos:,} de {total:,} {unidad}"
+
+    def _revisar(self):
+        if self.cancelado:
+            raise CargaCancelada()
+
+    # (avance total entre 0 y 1, texto) para la barra; cada etapa pesa lo mismo
+    def estado(self):
+        with self._lock:
+            etapa, avance, detalle = self._etapa, self._avance, self._detalle
+        if etapa is None:
+            return 0.0, "Preparando la carga"
+        posicion = list(ETAPAS).index(etapa)
+        texto = f"{posicion + 1}/{len(ETAPAS)} · {ETAPAS[etapa]}"
+        return (posicion + (avance or 0.0)) / len(ETAPAS), f"{texto} ({detalle})" if detalle else texto
+
+
+# Trabajo de carga de la sesión para la clave. Si la sesión ya tiene uno con la
+# misma clave (en curso, terminado o cancelado) se reutiliza; si tiene otro, se
+# cancela y se arranca uno nuevo con funcion.
+def trabajo_de_sesion(estado_sesion, clave, funcion):
+    actual = estado_sesion.get('trabajo_carga')
+    if actual is not None and actual.clave == clave:
+        return actual
+    if actual is not None:
+        actual.cancelar()
+    estado_sesion['trabajo_carga'] = Trabajo(clave, funcion)
+    return estado_sesion['trabajo_carga']
+
+
+# Cancelar y olvidar el trabajo de carga de la sesión (los archivos se quitaron
+# y no hay historial elegido): el hilo deja de leer y no escribe en el historial
+def cancelar_trabajo_de_sesion(estado_sesion):
+    actual = estado_sesion.pop('trabajo_carga', None)
+    if actual is not None:
+        actual.cancelar()
@@ -0,0 +1,159 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from analisis import reportes
+from cache_datos import cache, hash_contenido
+from ingesta import VERSION_NORMALIZACION, cargar_por_lotes, combinar_sin_duplicados
+from lectores import EXTENSIONES as FORMATOS
+
+# Modo por lotes, sin interfaz: procesa una carpeta de exportes y escribe los
+# reportes de cada cliente (resumen mensual, PPD sin complemento, PUE con
+# complementos, conciliación PPD y complementos).
+#
+#   python cli.py CARPETA [--salida reportes] [--formato xlsx|csv] [--procesos N] [--sin-cache]
+#
+# Cada subcarpeta de CARPETA es un cliente y sus archivos se combinan por UUID;
+# cada archivo suelto (.xls, .xlsx o .csv) en CARPETA es un cliente por sí solo. Los clientes se
+# reparten entre procesos.
+
+EXTENSIONES = tuple(f'.{formato}' for formato in FORMATOS)
+MAX_FILAS_HOJA = 1_048_575  # límite de Excel sin contar el encabezado
+
+
+# Cliente -> rutas de sus archivos, en orden de nombre (el último gana en UUID repetidos)
+def clientes_en(carpeta):
+    clientes = {}
+    for nombre in sorted(os.listdir(carpeta)):
+        ruta = os.path.join(carpeta, nombre)
+        if os.path.isdir(ruta):
+            archivos = [
+                os.path.join(ruta, a) for a in sorted(os.listdir(ruta))
+                if a.lower().endswith(EXTENSIONES)
+            ]
+            if archivos:
+                clientes[nombre] = archivos
+        elif nombre.lower().endswith(EXTENSIONES):
+            clientes[os.path.splitext(nombre)[0]] = [ruta]
+    return clientes
+
+
+def _leer(ruta, usar_cache):
+    inicio = time.perf_counter()
+    with open(ruta, 'rb') as archivo:
+        contenido = archivo.read()
+    clave = f"{hash_contenido(contenido)}-v{VERSION_NORMALIZACION}"
+    df = cache.obtener(clave) if usar_cache else None
+    origen = "Caché"
+    if df is None:
+        df = cargar_por_lotes(contenido)
+        origen = "Procesado"
+        if usar_cache:
+            cache.guardar(clave, df)
+    return df, len(contenido), time.perf_counter() - inicio, origen
+
+
+def escribir_reportes(tablas, carpeta, formato):
+    os.makedirs(carpeta, exist_ok=True)
+    if formato == 'csv':
+        for nombre, tabla in tablas.items():
+            tabla.to_csv(os.path.join(carpeta, f"{nombre}.csv"), index=False)
+        return
+
+    with pd.ExcelWriter(os.path.join(carpeta, "reportes.xlsx"), engine='xlsxwriter') as libro:
+        for nombre, tabla in tablas.items():
+            # Las tablas que no caben en una hoja se reparten en varias
+            for parte, inicio in enumerate(range(0, max(len(tabla), 1), MAX_FILAS_HOJA)):
+                hoja = nombre if parte == 0 else f"{nombre} ({parte + 1})"
+                tabla.iloc[inicio:inicio + MAX_FILAS_HOJA].to_excel(libro, sheet_name=hoja[:31], index=False)
+
+
+# Cargar, analizar y escribir los reportes de un cliente (se ejecuta en un proceso del pool)
+def procesar_cliente(nombre, rutas, salida, formato, usar_cache):
+    resultado = {"cliente": nombre, "archivos": [], "filas": 0, "error": None}
+    try:
+        tablas = []
+        for ruta in rutas:
+            df, tamano, segundos, origen = _leer(ruta, usar_cache)
+            tablas.append(df)
+            resultado["archivos"].append((os.path.basename(ruta), len(df), tamano, segundos, origen))
+        df = combinar_sin_duplicados(tablas)
+        resultado["filas"] = len(df)
+
+        inicio = time.perf_counter()
+        tablas_reporte = reportes(df)
+        resultado["segundos_analisis"] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        escribir_reportes(tablas_reporte, os.path.join(salida, nombre), formato)
+        resultado["segundos_escritura"] = time.perf_counter() - inicio
+        resultado["reportes"] = {reporte: len(tabla) for reporte, tabla in tablas_reporte.items()}
+    except Exception as e:
+        resultado["error"] = f"{type(e).__name__}: {e}"
+    return resultado
+
+
+def _imprimir(resultado):
+    cliente = resultado["cliente"]
+    for archivo, filas, tamano, segundos, origen in resultado["archivos"]:
+        velocidad = filas / segundos if segundos else 0
+        print(f"  {cliente:<24} {archivo:<36} {filas:>10,} filas {segundos:>8.2f} s {velocidad:>10,.0f} filas/s  {origen}")
+    if resultado["error"]:
+        print(f"✗ {cliente}: {resultado['error']}")
+        return
+    reportes_escritos = ", ".join(f"{nombre} {filas:,}" for nombre, filas in resultado["reportes"].items())
+    print(
+        f"✓ {cliente}: {resultado['filas']:,} facturas · análisis {resultado['segundos_analisis']:.2f} s · "
+        f"escritura {resultado['segundos_escritura']:.2f} s · {reportes_escritos}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reportes de facturas por cliente, sin interfaz.")
+    parser.add_argument("carpeta", help="Carpeta con los exportes .xls, .xlsx o .csv (una subcarpeta por cliente)")
+    parser.add_argument("--salida", default="reportes", help="Carpeta donde se escriben los reportes")
+    parser.add_argument("--formato", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sin-cache", action="store_true", help="No leer ni guardar la caché de archivos procesados")
+    args = parser.parse_args(argv)
+
+    clientes = clientes_en(args.carpeta)
+    if not clientes:
+        print(f"No se encontraron archivos {', '.join(EXTENSIONES)} en {args.carpeta}")
+        return 1
+
+    inicio = time.perf_counter()
+    resultados = []
+    procesos = max(1, min(args.procesos, len(clientes)))
+    # "spawn", igual que la ingesta en paralelo de la aplicación
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        futuros = [
+            pool.submit(procesar_cliente, nombre, rutas, args.salida, args.formato, not args.sin_cache)
+            for nombre, rutas in clientes.items()
+        ]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            resultados.append(resultado)
+            _imprimir(resultado)
+    segundos = time.perf_counter() - inicio
+
+    archivos = [a for r in resultados for a in r["archivos"]]
+    filas = sum(a[1] for a in archivos)
+    megabytes = sum(a[2] for a in archivos) / (1024 * 1024)
+    errores = [r for r in resultados if r["error"]]
+    print(
+        f"\n{len(resultados)} clientes, {len(archivos)} archivos, {filas:,} filas en {segundos:.2f} s "
+        f"({len(archivos) / segundos:.2f} archivos/s, {filas / segundos:,.0f} filas/s, {megabytes / segundos:.1f} MB/s) "
+        f"con {procesos} procesos; {len(errores)} con error"
+    )
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
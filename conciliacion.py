@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+from esquema import TIPO_UUID, arreglo_arrow, contiene
+
+# Conciliación de facturas PPD contra sus complementos de pago. Las relaciones
+# (complemento -> factura) se unen con las facturas PPD por UUID en Arrow y los
+# montos se acumulan por factura con bincount: no hay ciclos por factura.
+#
+# El exporte no trae el importe pagado por documento relacionado; cuando un
+# complemento cita varios documentos, su monto se reparte en proporción al
+# 'Total' de cada uno, sean o no PPD, y a las facturas PPD solo les toca su
+# parte. Si cita algún UUID que no está en el exporte (sin total conocido), el
+# monto se reparte en partes iguales. Los complementos cancelados no cuentan
+# como pago.
+
+COLUMNA_MONTO = 'Total'
+TOLERANCIA = 0.01  # diferencia en pesos que se considera saldada
+
+PAGADA = 'Pagada'
+PARCIAL = 'Pago parcial'
+SIN_PAGO = 'Sin pago'
+SOBREPAGADA = 'Sobrepagada'
+ESTADOS = [SIN_PAGO, PARCIAL, PAGADA, SOBREPAGADA]
+
+COLUMNAS = ['UUID', 'Fecha', 'Estatus', 'Total', 'Pagado', 'Saldo', 'Parcialidades', 'Último Pago', 'Estado']
+
+
+# Tabla de conciliación de todas las facturas PPD, indexada por la posición de
+# la factura en df (la misma que usa MotorFiltros)
+def conciliar_ppd(df, columna_monto=COLUMNA_MONTO, tolerancia=TOLERANCIA):
+    if 'Método de Pago' not in df.columns or 'UUID' not in df.columns:
+        return pd.DataFrame(columns=COLUMNAS)
+
+    posiciones = np.flatnonzero(contiene(df['Método de Pago'], 'PPD').to_numpy(dtype=bool))
+    totales_df = _montos(df, 'Total')
+    totales = totales_df[posiciones]
+    pagado = np.zeros(len(posiciones))
+    parcialidades = np.zeros(len(posiciones), dtype=np.int64)
+    ultimo = np.full(len(posiciones), np.iinfo(np.int64).min)  # NaT
+
+    if 'UUIDs_Relacionados' in df.columns and len(posiciones):
+        complemento, citado = _citas(df)
+
+        # Reparto del monto del complemento entre todos los documentos que cita
+        conocido = citado >= 0
+        peso = np.where(conocido, totales_df[np.where(conocido, citado, 0)], 0.0)
+        suma_pesos = np.bincount(complemento, weights=peso, minlength=len(df))[complemento]
+        citas = np.bincount(complemento, minlength=len(df))[complemento]
+        desconocidos = np.bincount(complemento, weights=~conocido, minlength=len(df))[complemento]
+        por_peso = (suma_pesos > 0) & (desconocidos == 0)
+        proporcion = np.where(por_peso, peso / np.where(por_peso, suma_pesos, 1), 1 / citas)
+
+        # Solo las citas a facturas PPD se acumulan como pago
+        posicion_ppd = np.full(len(df), -1)
+        posicion_ppd[posiciones] = np.arange(len(posiciones))
+        factura = np.where(conocido, posicion_ppd[np.where(conocido, citado, 0)], -1)
+        ppd = factura >= 0
+        complemento, factura, proporcion = complemento[ppd], factura[ppd], proporcion[ppd]
+
+        montos = _montos(df, columna_monto)
+        pagado = np.bincount(factura, weights=montos[complemento] * proporcion, minlength=len(posiciones))
+        parcialidades = np.bincount(factura, minlength=len(posiciones))
+        if 'Fecha' in df.columns:
+            fechas = df['Fecha'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            np.maximum.at(ultimo, factura, fechas[complemento])
+
+    saldo = totales - pagado
+    estado = np.select(
+        [pagado <= tolerancia, saldo > tolerancia, saldo < -tolerancia],
+        [SIN_PAGO, PARCIAL, SOBREPAGADA],
+        default=PAGADA
+    )
+
+    tabla = pd.DataFrame({'UUID': df['UUID'].iloc[posiciones].array}, index=posiciones)
+    for col in ['Fecha', 'Estatus']:
+        if col in df.columns:
+            tabla[col] = df[col].iloc[posiciones].array
+    tabla['Total'] = totales
+    tabla['Pagado'] = pagado.round(2)
+    tabla['Saldo'] = saldo.round(2)
+    tabla['Parcialidades'] = parcialidades
+    tabla['Último Pago'] = ultimo.view('datetime64[ns]')
+    tabla['Estado'] = pd.Categorical(estado, categories=ESTADOS)
+    return tabla
+
+
+def _montos(df, columna):
+    if columna not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[columna], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+# Pares (fila del complemento, fila del documento citado o -1 si no está en
+# df) de los complementos vigentes; un documento citado dos veces por el mismo
+# complemento cuenta una vez
+def _citas(df):
+    listas = arreglo_arrow(df['UUIDs_Relacionados'])
+    complemento = pc.list_parent_indices(listas).to_numpy()
+    # Un código por UUID citado distinto: se buscan en df una sola vez cada uno
+    citados = pc.dictionary_encode(pc.list_flatten(listas).cast(TIPO_UUID))
+    codigo = pc.fill_null(citados.indices, -1).to_numpy()
+
+    validas = codigo >= 0
+    if 'Estatus' in df.columns:
+        vigentes = ~contiene(df['Estatus'], 'Cancelado').to_numpy(dtype=bool)
+        validas &= vigentes[complemento]
+    complemento, codigo = complemento[validas], codigo[validas]
+
+    distintos = max(len(citados.dictionary), 1)
+    pares = np.unique(complemento * distintos + codigo)
+    fila = pc.fill_null(pc.index_in(citados.dictionary, value_set=arreglo_arrow(df['UUID'])), -1).to_numpy()
+    return pares // distintos, fila[pares % distintos]
+
+
+# Conteo de facturas y saldo por estado
+def resumen(tabla):
+    return tabla.groupby('Estado', observed=False).agg(
+        Facturas=('Total', 'size'),
+        Total=('Total', 'sum'),
+        Pagado=('Pagado', 'sum'),
+        Saldo=('Saldo', 'sum'),
+    )
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+# Instrumentación por etapas: tiempo, filas de entrada y salida y cambio de
+# memoria residente de cada etapa marcada con
+#
+#   with etapa('filtros', filas_entrada=len(df)) as medicion:
+#       filas = ...
+#       medicion.salida(len(filas))
+#
+# Las mediciones se acumulan en el registro del hilo actual (cada sesión de
+# Streamlit ejecuta su script en su propio hilo), que se abre con iniciar() al
+# principio de cada ejecución; los hilos de carga abren el suyo y el script lo
+# suma al propio con agregar() cuando la carga termina. Sin registro abierto, etapa() devuelve un objeto
+# vacío compartido y no mide nada: el costo es una búsqueda en un threading.local.
+#
+# Cada medición se emite además como una línea JSON en el logger
+# "facturador.diagnostico". Con FACTURADOR_DIAGNOSTICO=1 se mide siempre, el
+# logger escribe a stderr y también se miden, solo en el log, las etapas fuera
+# de un registro (por ejemplo, en los procesos de la carga en paralelo).
+
+ACTIVO_SIEMPRE = os.environ.get("FACTURADOR_DIAGNOSTICO", "").lower() in ("1", "true", "si", "sí")
+
+logger = logging.getLogger("facturador.diagnostico")
+if ACTIVO_SIEMPRE and not logger.handlers:
+    _salida = logging.StreamHandler()
+    _salida.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_salida)
+    logger.setLevel(logging.INFO)
+
+_hilo = threading.local()
+
+
+try:
+    _TAMANO_PAGINA = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _TAMANO_PAGINA = 4096
+
+
+# Memoria residente del proceso en bytes (Linux); None si no se puede leer.
+# Es la del proceso completo: incluye lo que hagan otras sesiones a la vez.
+def _memoria_residente():
+    try:
+        with open("/proc/self/statm") as archivo:
+            return int(archivo.read().split()[1]) * _TAMANO_PAGINA
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _SinMedicion:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+    def salida(self, filas):
+        pass
+
+
+_SIN_MEDICION = _SinMedicion()
+
+
+class Medicion:
+    def __init__(self, registro, nombre, filas_entrada):
+        self.registro = registro
+        self.nombre = nombre
+        self.filas_entrada = filas_entrada
+        self.filas_salida = None
+        self.segundos = None
+        self.memoria_mb = None
+        self.nivel = 0
+
+    def salida(self, filas):
+        self.filas_salida = filas
+
+    def __enter__(self):
+        if self.registro is not None:
+            self.nivel = self.registro.nivel
+            self.registro.nivel += 1
+        self._memoria = _memoria_residente()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *error):
+        self.segundos = time.perf_counter() - self._inicio
+        memoria = _memoria_residente()
+        if memoria is not None and self._memoria is not None:
+            self.memoria_mb = (memoria - self._memoria) / (1024 * 1024)
+        if self.registro is not None:
+            self.registro.nivel -= 1
+            self.registro.mediciones.append(self)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(self.como_dict(), ensure_ascii=False))
+        return False
+
+    def como_dict(self):
+        return {
+            "etapa": self.nombre,
+            "segundos": round(self.segundos, 6),
+            "filas_entrada": self.filas_entrada,
+            "filas_salida": self.filas_salida,
+            "memoria_mb": round(self.memoria_mb, 2) if self.memoria_mb is not None else None,
+            "nivel": self.nivel,
+        }
+
+
+# Mediciones de una ejecución del script
+class RegistroMediciones:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.mediciones = []
+        self.nivel = 0
+
+    def segundos(self):
+        return time.perf_counter() - self.inicio
+
+    # Sumar las mediciones de otro registro (por ejemplo, el del hilo de una
+    # carga en segundo plano); se ordenan con las propias por hora de inicio
+    def agregar(self, otro):
+        if otro is not None:
+            self.mediciones.extend(otro.mediciones)
+
+    # Tabla por etapa, en orden de primera aparición: llamadas y totales
+    def tabla(self):
+        if not self.mediciones:
+            return pd.DataFrame(columns=["Etapa", "Llamadas", "Segundos", "Filas entrada", "Filas salida", "Memoria MB"])
+        # Las mediciones se agregan al terminar; las anidadas quedan antes que la que las contiene
+        ordenadas = sorted(self.mediciones, key=lambda m: m._inicio)
+        tabla = pd.DataFrame({
+            "Etapa": ["· " * m.nivel + m.nombre for m in ordenadas],
+            "Llamadas": 1,
+            "Segundos": [m.segundos for m in ordenadas],
+            "Filas entrada": pd.array([m.filas_entrada for m in ordenadas], dtype="Int64"),
+            "Filas salida": pd.array([m.filas_salida for m in ordenadas], dtype="Int64"),
+            "Memoria MB": [m.memoria_mb for m in ordenadas],
+        })
+        return tabla.groupby("Etapa", sort=False).sum(min_count=1).reset_index()
+
+
+# Abre el registro del hilo para una ejecución del script; None si está apagado
+def iniciar(activo=False):
+    _hilo.registro = RegistroMediciones() if activo or ACTIVO_SIEMPRE else None
+    return _hilo.registro
+
+
+def etapa(nombre, filas_entrada=None):
+    registro = getattr(_hilo, "registro", None)
+    if registro is None and not ACTIVO_SIEMPRE:
+        return _SIN_MEDICION
+    return Medicion(registro, nombre, filas_entrada)
@@ -0,0 +1,219 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas.api.types import union_categoricals
+
+from diagnostico import etapa
+
+# Representación compacta y columnar de la tabla de facturas:
+# - columnas de baja cardinalidad como categóricas (filtros por código)
+# - 'Total' numérico
+# - UUID como valores binarios de 16 bytes (Arrow fixed_size_binary)
+# - 'UUIDs_Relacionados' como lista Arrow (offsets + valores de 16 bytes)
+
+PATRON_UUID = r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}'
+
+COLUMNAS_CATEGORICAS = ['Estatus', 'Método de Pago', 'Forma de Pago', 'Mes', 'Mes_XML']
+COLUMNAS_NUMERICAS = ['Total']
+COLUMNAS_UUID = ['UUID']
+COLUMNAS_LISTA_UUID = ['UUIDs_Relacionados']
+
+TIPO_UUID = pa.binary(16)
+# Los valores de la lista son de 16 bytes; se guardan como binary variable
+# porque pandas no sabe convertir listas de fixed_size_binary a objetos
+TIPO_LISTA_UUID = pa.list_(pa.binary())
+
+_HEXADECIMAL = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_VALOR_HEXADECIMAL = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _VALOR_HEXADECIMAL[_c] = _i
+    _VALOR_HEXADECIMAL[ord(chr(_c).upper())] = _i
+_POSICIONES_GUION = [8, 13, 18, 23]
+_POSICIONES_HEXADECIMAL = [i for i in range(36) if i not in _POSICIONES_GUION]
+_UUID_VACIO = '00000000-0000-0000-0000-000000000000'
+# Un UUID o el separador de filas (el carácter nulo, que no aparece en los textos de Excel)
+_SEPARADOR_FILAS = '\x00'
+_REGEX_UUID_O_FILA = re.compile(b'\\x00|' + PATRON_UUID.encode())
+
+
+# Matriz (n, 36) de caracteres ASCII de UUID válidos -> arreglo de 16 bytes.
+# Mayúsculas y minúsculas dan los mismos bytes: la forma binaria ya está normalizada.
+def _decodificar_hexadecimal(crudo):
+    digitos = _VALOR_HEXADECIMAL[crudo[:, _POSICIONES_HEXADECIMAL]]
+    datos = (digitos[:, 0::2] << 4) | digitos[:, 1::2]
+    return pa.FixedSizeBinaryArray.from_buffers(TIPO_UUID, len(crudo), [None, pa.py_buffer(datos.tobytes())])
+
+
+# Texto -> 16 bytes. Los valores que no son UUID válidos quedan como nulos.
+def uuids_a_binario(textos):
+    textos = pd.Series(textos, dtype=object).astype(str).str.strip()
+    validos = textos.str.fullmatch(PATRON_UUID).fillna(False).to_numpy(dtype=bool)
+    n = len(textos)
+    if n == 0:
+        return pa.array([], type=TIPO_UUID)
+
+    crudo = textos.where(validos, _UUID_VACIO).to_numpy().astype('S36')
+    arreglo = _decodificar_hexadecimal(crudo.view(np.uint8).reshape(n, 36))
+    if validos.all():
+        return arreglo
+    return pc.if_else(pa.array(validos), arreglo, pa.scalar(None, TIPO_UUID))
+
+
+def uuid_a_bytes(texto):
+    try:
+        datos = bytes.fromhex(str(texto).strip().replace('-', ''))
+    except ValueError:
+        return None
+    return datos if len(datos) == 16 else None
+
+
+# 16 bytes -> texto canónico (minúsculas con guiones); los nulos quedan como None
+def binario_a_uuids(valores):
+    if isinstance(valores, pd.Series):
+        arreglo = arreglo_arrow(valores)
+    elif isinstance(valores, pa.ChunkedArray):
+        arreglo = valores.combine_chunks()
+    else:
+        arreglo = valores
+    if not pa.types.is_fixed_size_binary(arreglo.type):
+        arreglo = arreglo.cast(TIPO_UUID)
+
+    n = len(arreglo)
+    resultado = np.empty(n, dtype=object)
+    if n == 0:
+        return resultado
+
+    datos = np.frombuffer(arreglo.buffers()[1], dtype=np.uint8,
+                          count=n * 16, offset=arreglo.offset * 16).reshape(n, 16)
+    texto = np.empty((n, 36), dtype=np.uint8)
+    texto[:, _POSICIONES_GUION] = ord('-')
+    texto[:, _POSICIONES_HEXADECIMAL[0::2]] = _HEXADECIMAL[datos >> 4]
+    texto[:, _POSICIONES_HEXADECIMAL[1::2]] = _HEXADECIMAL[datos & 15]
+    resultado[:] = texto.view('S36').ravel().astype(str)
+
+    nulos = arreglo.is_null().to_numpy(zero_copy_only=False)
+    resultado[nulos] = None
+    return resultado
+
+
+def serie_arrow(arreglo, index=None):
+    return pd.Series(pd.arrays.ArrowExtensionArray(arreglo), index=index)
+
+
+def arreglo_arrow(serie):
+    return pa.chunked_array(serie.array.__arrow_array__()).combine_chunks()
+
+
+# Todos los UUID que aparecen en cada texto, como arreglos planos (fila, uuid).
+# Los textos se unen en un solo buffer y la expresión regular lo recorre una
+# vez; cada separador que encuentra marca el paso a la fila siguiente. Los UUID
+# se decodifican desde los bytes de las coincidencias, sin listas ni cadenas
+# intermedias por fila.
+def extraer_uuids(textos):
+    textos = list(map(str, textos))
+    buffer = _SEPARADOR_FILAS.join(textos).encode('utf-8')
+    if buffer.count(_SEPARADOR_FILAS.encode()) != max(len(textos) - 1, 0):
+        # Algún texto trae el separador: se quita para no desfasar las filas
+        buffer = _SEPARADOR_FILAS.join(t.replace(_SEPARADOR_FILAS, '') for t in textos).encode('utf-8')
+    piezas = np.array(_REGEX_UUID_O_FILA.findall(buffer), dtype='S36')
+    saltos = piezas == _SEPARADOR_FILAS.encode()
+    filas = np.cumsum(saltos)[~saltos]
+    crudo = piezas[~saltos].view(np.uint8).reshape(-1, 36)
+    return filas, _decodificar_hexadecimal(crudo)
+
+
+# Listas de UUID por fila a partir de los arreglos planos (fila, uuid), con las
+# filas en orden ascendente. Las filas sin relaciones quedan nulas.
+def lista_de_uuids(filas, valores, total_filas):
+    cantidades = np.bincount(filas, minlength=total_filas) if len(filas) else np.zeros(total_filas, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(cantidades)])
+    return pa.ListArray.from_arrays(
+        pa.array(offsets, type=pa.int32()),
+        valores.cast(pa.binary()),
+        type=TIPO_LISTA_UUID,
+        mask=pa.array(cantidades == 0)
+    )
+
+
+# Aplicar el esquema compacto a un lote ya limpio
+def normalizar_esquema(df):
+    for col in COLUMNAS_CATEGORICAS:
+        if col in df.columns:
+            serie = df[col]
+            df[col] = serie.astype(str).where(serie.notna()).astype('category')
+
+    for col in COLUMNAS_NUMERICAS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    for col in COLUMNAS_UUID:
+        if col in df.columns and not es_columna_uuid(df[col]):
+            df[col] = serie_arrow(uuids_a_binario(df[col].to_numpy()), index=df.index)
+
+    return df
+
+
+def es_columna_uuid(serie):
+    return isinstance(serie.dtype, pd.ArrowDtype) and pa.types.is_fixed_size_binary(serie.dtype.pyarrow_dtype)
+
+
+def es_columna_lista_uuid(serie):
+    return isinstance(serie.dtype, pd.ArrowDtype) and pa.types.is_list(serie.dtype.pyarrow_dtype)
+
+
+# Concatenar tablas normalizadas conservando las categóricas
+# (pd.concat las convierte a object si las categorías no coinciden)
+def concatenar(tablas):
+    tablas = [df for df in tablas if df is not None and not df.empty]
+    if not tablas:
+        return pd.DataFrame()
+    if len(tablas) == 1:
+        return tablas[0].reset_index(drop=True)
+
+    categoricas = {}
+    for col in tablas[0].columns:
+        if all(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in tablas):
+            categoricas[col] = union_categoricals([df[col] for df in tablas], sort_categories=True)
+
+    df = pd.concat(
+        [t.drop(columns=list(categoricas)) for t in tablas],
+        ignore_index=True
+    )
+    for col, valores in categoricas.items():
+        df[col] = valores
+    return df[[col for col in tablas[0].columns if col in df.columns] +
+              [col for col in df.columns if col not in tablas[0].columns]]
+
+
+# Máscara "la columna contiene el texto", evaluada sobre las categorías y no fila por fila
+def contiene(serie, texto):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = serie.cat.categories.astype(str)
+        codigos = np.flatnonzero(categorias.str.contains(texto, case=False, regex=False))
+        return pd.Series(np.isin(serie.cat.codes.to_numpy(), codigos), index=serie.index)
+    return serie.astype(str).str.contains(texto, case=False, regex=False)
+
+
+# Copia para mostrar o exportar: UUID binarios -> texto, listas -> listas de texto
+# (o texto unido con `separador`, como en los CSV exportados)
+def para_mostrar(df, separador=None):
+    with etapa('para_mostrar', filas_entrada=len(df)):
+        df = df.copy()
+        for col in df.columns:
+            if es_columna_uuid(df[col]):
+                df[col] = binario_a_uuids(df[col])
+            elif es_columna_lista_uuid(df[col]):
+                arreglo = arreglo_arrow(df[col])
+                offsets = arreglo.offsets.to_numpy()
+                textos = binario_a_uuids(arreglo.values.slice(offsets[0], offsets[-1] - offsets[0]))
+                offsets = offsets - offsets[0]
+                nulos = arreglo.is_null().to_numpy(zero_copy_only=False)
+                df[col] = [
+                    None if nulo else
+                    (separador.join(textos[inicio:fin]) if separador else list(textos[inicio:fin]))
+                    for inicio, fin, nulo in zip(offsets[:-1], offsets[1:], nulos)
+                ]
+        return df
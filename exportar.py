@@ -0,0 +1,172 @@
+import io
+import os
+import threading
+from collections import defaultdict
+
+import xlsxwriter
+
+from analisis import COLUMNAS_FACTURA, complementos, ppd_sin_complemento, pue_con_complementos
+from cache_datos import DIRECTORIO_CACHE, hash_contenido
+from esquema import para_mostrar
+from filtros import MotorFiltros
+from ingesta import con_derivadas
+
+# Exportación por bloques de la vista filtrada. Las filas se toman del motor de
+# filtros en bloques de TAMANO_BLOQUE, se convierten a texto para mostrar y se
+# escriben directo al archivo: CSV con to_csv en modo anexar y XLSX con el modo
+# constant_memory de xlsxwriter, que vuelca cada fila al disco al terminarla.
+# La memoria depende del tamaño del bloque, no del tamaño del exporte.
+#
+# Los archivos se guardan en disco por estado de filtros; pedir de nuevo la
+# misma vista devuelve el archivo ya escrito.
+
+TAMANO_BLOQUE = 50_000
+MAX_FILAS_HOJA = 1_048_575  # límite de Excel sin contar el encabezado
+MAX_EXPORTES = 20
+DIRECTORIO_EXPORTES = os.path.join(DIRECTORIO_CACHE, "exportes")
+
+
+def bloques(df, filas, columnas=None, tamano=TAMANO_BLOQUE):
+    tabla = df if columnas is None else df[columnas]
+    for inicio in range(0, len(filas), tamano):
+        yield para_mostrar(tabla.iloc[filas[inicio:inicio + tamano]], separador='|')
+
+
+def escribir_csv(ruta, df, filas, columnas=None):
+    tabla = df if columnas is None else df[columnas]
+    with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+        tabla.iloc[:0].to_csv(archivo, index=False)
+        for bloque in bloques(df, filas, columnas):
+            bloque.to_csv(archivo, index=False, header=False)
+
+
+# hojas: lista de (nombre, df, filas, columnas). Las hojas que pasan el límite
+# de filas de Excel continúan en "Nombre (2)", "Nombre (3)", ...
+def escribir_xlsx(ruta, hojas):
+    libro = xlsxwriter.Workbook(ruta, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy hh:mm',
+        'strings_to_urls': False,
+    })
+    negrita = libro.add_format({'bold': True})
+    try:
+        for nombre, df, filas, columnas in hojas:
+            encabezado = list(df.columns if columnas is None else columnas)
+            hoja, fila_hoja, parte = None, MAX_FILAS_HOJA + 1, 0
+            for bloque in bloques(df, filas, columnas):
+                # Celdas vacías en lugar de NaN/NaT
+                valores = bloque.astype(object).where(bloque.notna(), None).to_numpy().tolist()
+                for registro in valores:
+                    if fila_hoja > MAX_FILAS_HOJA:
+                        parte += 1
+                        hoja = libro.add_worksheet((nombre if parte == 1 else f"{nombre} ({parte})")[:31])
+                        hoja.write_row(0, 0, encabezado, negrita)
+                        fila_hoja = 1
+                    hoja.write_row(fila_hoja, 0, registro)
+                    fila_hoja += 1
+            if hoja is None:
+                libro.add_worksheet(nombre[:31]).write_row(0, 0, encabezado, negrita)
+    finally:
+        libro.close()
+
+
+# Hojas de la vista filtrada: facturas y, si hay relaciones, complementos, PPD
+# sin complemento y PUE con complementos. Usa su propio MotorFiltros porque el
+# exporte se escribe fuera del hilo de la sesión.
+def hojas_vista(df, indice, predicados):
+    # El exporte lleva todas las columnas, incluidas las derivadas
+    df = con_derivadas(df)
+    motor = MotorFiltros(df)
+    hojas = [('Facturas', df, motor.filas(predicados), None)]
+    if indice is None or 'UUIDs_Relacionados' not in df.columns:
+        return hojas
+    columnas = [c for c in COLUMNAS_FACTURA if c in df.columns]
+    hojas.append(('Complementos', df, complementos(motor, predicados), columnas + ['UUIDs_Relacionados']))
+    if 'Método de Pago' in df.columns:
+        hojas.append(('PPD sin complemento', df, ppd_sin_complemento(motor, indice, predicados), columnas))
+        hojas.append(('PUE con complementos', df, pue_con_complementos(motor, indice, predicados), columnas))
+    return hojas
+
+
+# CSV: solo las facturas de la vista; XLSX: todas las hojas de la vista
+def escribir_vista(ruta, formato, df, indice, predicados):
+    if formato == 'csv':
+        _, tabla, filas, columnas = hojas_vista(df, None, predicados)[0]
+        escribir_csv(ruta, tabla, filas, columnas)
+    else:
+        escribir_xlsx(ruta, hojas_vista(df, indice, predicados))
+
+
+# Clave del estado de filtros: conjunto de datos + (ranura, valor) de cada predicado
+def clave_exporte(clave_conjunto, predicados, formato):
+    estado = []
+    for predicado in predicados:
+        valor = predicado.valor
+        if isinstance(valor, (set, frozenset)):
+            valor = tuple(sorted(valor))
+        estado.append((predicado.ranura, valor))
+    return hash_contenido(repr((clave_conjunto, estado, formato)).encode())
+
+
+_lock = threading.Lock()
+_locks_por_clave = defaultdict(threading.Lock)
+
+
+# Archivo del exporte de la clave, abierto para lectura; se escribe con
+# escribir(ruta) solo si no está en disco. Dos sesiones que piden la misma
+# vista esperan a la misma escritura. Se devuelve el archivo y no su contenido:
+# download_button lo lee una sola vez al pulsarse, sin una copia intermedia
+# en bytes.
+def exporte_en_disco(clave, extension, escribir):
+    os.makedirs(DIRECTORIO_EXPORTES, exist_ok=True)
+    ruta = os.path.join(DIRECTORIO_EXPORTES, f"{clave}.{extension}")
+    with _lock:
+        lock_clave = _locks_por_clave[clave]
+    with lock_clave:
+        if os.path.exists(ruta):
+            os.utime(ruta)
+            return _abrir(ruta)
+        temporal = f"{ruta}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            escribir(temporal)
+            os.replace(temporal, ruta)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        # Abrir antes de recortar: si este exporte sale del directorio, el
+        # archivo abierto sigue siendo legible
+        archivo = _abrir(ruta)
+        _recortar()
+        return archivo
+
+
+# download_button no cierra el archivo que recibe: se cierra solo al leerse completo
+class _ArchivoExporte(io.BufferedReader):
+    def read(self, tamano=-1):
+        datos = super().read(tamano)
+        if tamano is None or tamano < 0:
+            self.close()
+        return datos
+
+
+def _abrir(ruta):
+    return _ArchivoExporte(io.FileIO(ruta, 'rb'))
+
+
+# Conservar solo los exportes usados más recientemente
+def _recortar():
+    archivos = []
+    for nombre in os.listdir(DIRECTORIO_EXPORTES):
+        ruta = os.path.join(DIRECTORIO_EXPORTES, nombre)
+        if nombre.endswith('.tmp'):
+            continue
+        try:
+            archivos.append((os.path.getmtime(ruta), ruta))
+        except FileNotFoundError:
+            continue
+    for _, ruta in sorted(archivos)[:-MAX_EXPORTES]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
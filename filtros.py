@@ -0,0 +1,172 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from diagnostico import etapa
+from esquema import contiene
+from indices import IndiceFechas
+from ingesta import COLUMNAS_DERIVADAS, con_derivadas
+
+# Motor de filtros incremental. Cada predicado ocupa una "ranura" (por ejemplo
+# el filtro de Estatus) y su máscara booleana se guarda junto con el valor que
+# la produjo; al cambiar un solo widget solo se recalcula esa máscara. El
+# resultado es un arreglo de posiciones de fila, no una copia del DataFrame.
+# Las columnas derivadas se agregan a la tabla del motor cuando se piden.
+
+# ranura: identifica el filtro; valor: lo que se eligió; calcular(df) -> máscara numpy.
+# columna_orden: si la tabla está ordenada por esa columna, el valor (inicio, fin)
+# se resuelve como un corte con búsqueda binaria en lugar de una máscara.
+Predicado = namedtuple('Predicado', ['ranura', 'valor', 'calcular', 'columna_orden'], defaults=[None])
+
+MAX_COMBINACIONES = 16
+
+
+# La columna toma alguno de los valores (comparando códigos si es categórica)
+def en(columna, valores):
+    valores = frozenset(str(v) for v in valores)
+
+    def calcular(df):
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Tabla de búsqueda por código; el código -1 (nulo) cae en el último False
+            seleccion = np.append(serie.cat.categories.astype(str).isin(valores), False)
+            return seleccion[serie.cat.codes.to_numpy()]
+        return serie.astype(str).isin(valores).to_numpy(dtype=bool)
+
+    return Predicado(('en', columna), valores, calcular)
+
+
+# Fecha dentro del rango, ambos extremos incluidos
+def entre_fechas(columna, inicio, fin):
+    inicio, fin = pd.Timestamp(inicio), pd.Timestamp(fin)
+
+    def calcular(df):
+        fechas = df[columna].to_numpy()
+        return (fechas >= inicio.to_datetime64()) & (fechas <= fin.to_datetime64())
+
+    return Predicado(('entre_fechas', columna), (inicio, fin), calcular, columna)
+
+
+def contiene_texto(columna, texto):
+    return Predicado(
+        ('contiene', columna, texto), texto,
+        lambda df: contiene(df[columna], texto).to_numpy(dtype=bool)
+    )
+
+
+def no_nulo(columna):
+    return Predicado(
+        ('no_nulo', columna), True,
+        lambda df: df[columna].notna().to_numpy(dtype=bool)
+    )
+
+
+# Predicado con una máscara calculada por fuera (por ejemplo, a partir de un índice)
+def mascara(nombre, valor, calcular):
+    return Predicado(('mascara', nombre), valor, calcular)
+
+
+class MotorFiltros:
+    # derivar(nombre) -> serie de una columna derivada (por ejemplo Conjunto.columna,
+    # compartida entre sesiones); sin él se calculan sobre la tabla del motor
+    def __init__(self, df, derivar=None):
+        self.df = df
+        self._derivar = derivar
+        self._mascaras = {}  # ranura -> (valor, máscara)
+        self._combinaciones = OrderedDict()  # valores de todos los predicados -> filas
+        self._indices_fechas = {}
+        self._orden = None  # (filas, columna, descendente, filas ordenadas)
+        self.calculos = 0
+
+    # Agregar a la tabla las columnas derivadas que falten; las filas no cambian,
+    # así que las máscaras y combinaciones guardadas siguen siendo válidas
+    def asegurar(self, columnas):
+        self.df = con_derivadas(self.df, columnas, derivar=self._derivar)
+        return self.df
+
+    def indice_fechas(self, columna):
+        if columna not in self._indices_fechas:
+            self._indices_fechas[columna] = IndiceFechas(self.df[columna].to_numpy())
+        return self._indices_fechas[columna]
+
+    def _mascara(self, predicado):
+        guardada = self._mascaras.get(predicado.ranura)
+        if guardada is None or guardada[0] != predicado.valor:
+            guardada = (predicado.valor, predicado.calcular(self.df))
+            self._mascaras[predicado.ranura] = guardada
+            self.calculos += 1
+        return guardada[1]
+
+    # Posiciones de las filas que cumplen todos los predicados, en el orden de
+    # la tabla (por fecha ascendente); filas[::-1] da el orden descendente
+    def filas(self, predicados):
+        clave = tuple((p.ranura, p.valor) for p in predicados)
+        if clave in self._combinaciones:
+            self._combinaciones.move_to_end(clave)
+            return self._combinaciones[clave]
+
+        with etapa('filtros', filas_entrada=len(self.df)) as medicion:
+            filas = self._calcular_filas(predicados)
+            medicion.salida(len(filas))
+
+        self._combinaciones[clave] = filas
+        if len(self._combinaciones) > MAX_COMBINACIONES:
+            self._combinaciones.popitem(last=False)
+        return filas
+
+    # Los rangos sobre columnas ordenadas acotan un corte [inicio, fin);
+    # las demás máscaras solo se combinan dentro de ese corte
+    def _calcular_filas(self, predicados):
+        inicio, fin = 0, len(self.df)
+        mascaras = []
+        for predicado in predicados:
+            if predicado.columna_orden is not None and self.indice_fechas(predicado.columna_orden).ordenado:
+                corte = self.indice_fechas(predicado.columna_orden).rango(*predicado.valor)
+                inicio, fin = max(inicio, corte.start), min(fin, corte.stop)
+            else:
+                mascaras.append(self._mascara(predicado))
+        fin = max(inicio, fin)
+
+        if not mascaras:
+            return np.arange(inicio, fin)
+        resultado = mascaras[0][inicio:fin].copy()
+        for m in mascaras[1:]:
+            np.logical_and(resultado, m[inicio:fin], out=resultado)
+        return np.flatnonzero(resultado) + inicio
+
+    # Filas reordenadas por cualquier columna. La fecha no necesita ordenarse
+    # (la tabla ya lo está); para las demás se memoriza el último orden pedido.
+    def ordenar(self, filas, columna, descendente=False):
+        self.asegurar([columna])
+        if pd.api.types.is_datetime64_any_dtype(self.df[columna]) and self.indice_fechas(columna).ordenado:
+            return filas[::-1] if descendente else filas
+
+        if self._orden is not None:
+            previas, col, desc, ordenadas = self._orden
+            if previas is filas and col == columna and desc == descendente:
+                return ordenadas
+
+        valores = pd.Series(self.df[columna].iloc[filas].array, index=filas)
+        ordenadas = valores.sort_values(
+            ascending=not descendente, kind='stable', na_position='last'
+        ).index.to_numpy()
+        self._orden = (filas, columna, descendente, ordenadas)
+        return ordenadas
+
+    # Filas seleccionadas de las columnas indicadas (solo copia lo que se va a
+    # usar); sin columnas, todas, incluidas las derivadas
+    def tomar(self, filas, columnas=None):
+        df = self.asegurar(COLUMNAS_DERIVADAS if columnas is None else columnas)
+        df = df if columnas is None else df[columnas]
+        return df.iloc[filas]
+
+
+# Ventana de filas de una página (numero empieza en 1)
+def pagina(filas, tamano, numero):
+    inicio = (numero - 1) * tamano
+    return filas[inicio:inicio + tamano]
+
+
+def numero_de_paginas(filas, tamano):
+    return max(1, -(-len(filas) // tamano))
@@ -0,0 +1,183 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+
+from cache_datos import hash_contenido
+from diagnostico import etapa
+
+# Gráficas de la aplicación. Cada figura se construye a partir de un agregado
+# pequeño (conteo por categoría o por periodo) y se guarda en una caché LRU
+# compartida por las sesiones, con clave (tipo de gráfica, huella del agregado):
+# si el agregado no cambió entre reruns, la figura con todo su estilo se
+# reutiliza sin volver a pasar por plotly.express.
+#
+# Los ejes por mes pasan a trimestres, y luego a años, cuando hay más de
+# MAX_CATEGORIAS periodos: la figura y lo que se envía al navegador no crecen
+# con los años de datos cargados.
+
+MAX_FIGURAS = 64
+MAX_CATEGORIAS = 36
+
+# Grano -> (frecuencia de pandas, formato de la etiqueta)
+GRANOS = {
+    'Trimestre': ('Q', '%Y-T%q'),
+    'Año': ('Y', '%Y'),
+}
+
+
+# Huella del agregado: valores, índice y nombres de columna
+def huella(datos):
+    contenido = pd.util.hash_pandas_object(datos, index=True).to_numpy().tobytes()
+    return hash_contenido(contenido + repr(list(datos.columns)).encode())
+
+
+class CacheFiguras:
+    def __init__(self, maximo=MAX_FIGURAS):
+        self.maximo = maximo
+        self._figuras = OrderedDict()  # (tipo, huella) -> figura
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    # Figura del tipo para los datos; construir(datos) se llama solo si no está.
+    # Las figuras guardadas se comparten: quien las recibe no debe modificarlas.
+    def obtener(self, tipo, datos, construir):
+        clave = (tipo, huella(datos))
+        with self._lock:
+            figura = self._figuras.get(clave)
+            if figura is not None:
+                self._figuras.move_to_end(clave)
+                self.aciertos += 1
+                return figura
+            self.fallos += 1
+
+        with etapa(f'figura {tipo[0]}', filas_entrada=len(datos)):
+            figura = construir(datos)
+        with self._lock:
+            self._figuras[clave] = figura
+            while len(self._figuras) > self.maximo:
+                self._figuras.popitem(last=False)
+        return figura
+
+
+# Conteo por mes (índice de texto con el formato indicado) agrupado al grano
+# más fino que no pasa de max_categorias periodos. Devuelve (conteo, grano).
+# Al agrupar, los meses que no se pueden leer como fecha se descartan.
+def agrupar_periodos(conteo, formato='%Y-%m', max_categorias=MAX_CATEGORIAS):
+    if len(conteo) <= max_categorias:
+        return conteo, 'Mes'
+    fechas = pd.to_datetime(conteo.index.astype(str), format=formato, errors='coerce')
+    validos = conteo[~fechas.isna()]
+    fechas = fechas[~fechas.isna()]
+    for grano, (frecuencia, etiqueta) in GRANOS.items():
+        periodos = fechas.to_period(frecuencia)
+        agrupado = validos.groupby(periodos.strftime(etiqueta).to_numpy(), sort=True).sum()
+        if len(agrupado) <= max_categorias:
+            break
+    return agrupado, grano
+
+
+def _pastel(datos):
+    fig = px.pie(
+        datos,
+        values='Cantidad',
+        names='Método',
+        color_discrete_sequence=px.colors.qualitative.Pastel,
+        hole=0.3
+    )
+    fig.update_traces(
+        textposition='inside',
+        textinfo='percent+label',
+        marker=dict(line=dict(color='#ffffff', width=1))
+    )
+    fig.update_layout(
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        )
+    )
+    return fig
+
+
+def _barras(datos, grano, titulo_y, escala):
+    fig = px.bar(
+        datos,
+        x='Periodo',
+        y='Cantidad',
+        color='Cantidad',
+        color_continuous_scale=escala,
+        text='Cantidad'
+    )
+    fig.update_layout(
+        xaxis_title=grano,
+        yaxis_title=titulo_y,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)'
+    )
+    fig.update_traces(
+        marker_line_color='rgb(8,48,107)',
+        marker_line_width=1,
+        opacity=0.8
+    )
+    return fig
+
+
+def _linea(datos, grano, titulo, titulo_y):
+    fig = px.line(
+        datos,
+        x='Periodo',
+        y='Cantidad',
+        markers=True,
+        title=f"{titulo} por {grano.lower()}",
+        line_shape='spline'
+    )
+    fig.update_layout(
+        xaxis_title=grano,
+        yaxis_title=titulo_y,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)'
+    )
+    fig.update_traces(
+        line=dict(width=3, color='#4361ee'),
+        marker=dict(size=8, color='#f72585')
+    )
+    return fig
+
+
+def _por_periodo(conteo, formato):
+    conteo, grano = agrupar_periodos(conteo, formato)
+    datos = pd.DataFrame({'Periodo': conteo.index.astype(str), 'Cantidad': conteo.to_numpy()})
+    return datos, grano
+
+
+# Conteo por método de pago (Serie método -> cantidad)
+def pastel_metodo_pago(conteo):
+    datos = pd.DataFrame({'Método': conteo.index.astype(str), 'Cantidad': conteo.to_numpy()})
+    return figuras.obtener(('metodo_pago',), datos, _pastel)
+
+
+# Conteo por mes (Serie mes -> cantidad, en orden cronológico)
+def barras_por_mes(conteo, titulo_y, escala, formato='%Y-%m'):
+    datos, grano = _por_periodo(conteo, formato)
+    return figuras.obtener(
+        ('barras', grano, titulo_y, escala), datos,
+        lambda datos: _barras(datos, grano, titulo_y, escala)
+    )
+
+
+def linea_por_mes(conteo, titulo, titulo_y, formato='%Y-%m'):
+    datos, grano = _por_periodo(conteo, formato)
+    return figuras.obtener(
+        ('linea', grano, titulo, titulo_y), datos,
+        lambda datos: _linea(datos, grano, titulo, titulo_y)
+    )
+
+
+# Instancia compartida por todas las sesiones del servidor
+figuras = CacheFiguras()
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from esquema import TIPO_UUID, arreglo_arrow, binario_a_uuids, contiene, uuid_a_bytes
+
+# Grafo de relaciones entre documentos: una arista va de cada complemento a cada
+# UUID que cita en 'UUIDs_Relacionados'. Los nodos 0..n-1 son las filas de la
+# tabla; los UUID citados que no están en la tabla (referencias huérfanas) son
+# nodos extra a partir de n. Las adyacencias se guardan como arreglos CSR
+# (offsets + vecinos) en ambos sentidos, así que cada consulta recorre solo los
+# vecinos del nodo.
+
+
+class GrafoRelaciones:
+    def __init__(self, df):
+        self.filas = len(df)
+        uuids = arreglo_arrow(df['UUID']) if 'UUID' in df.columns else pa.array([None] * len(df), type=TIPO_UUID)
+        self._uuids = uuids
+        self._posiciones = None
+        self._componentes = None
+        self._vigentes = (
+            ~contiene(df['Estatus'], 'Cancelado').to_numpy(dtype=bool)
+            if 'Estatus' in df.columns else np.ones(len(df), dtype=bool)
+        )
+        self._canceladas = (
+            contiene(df['Estatus'], 'Cancelado').to_numpy(dtype=bool)
+            if 'Estatus' in df.columns else np.zeros(len(df), dtype=bool)
+        )
+
+        if 'UUIDs_Relacionados' in df.columns:
+            listas = arreglo_arrow(df['UUIDs_Relacionados'])
+            origen = pc.list_parent_indices(listas).to_numpy().astype(np.int64)
+            relacionados = pc.list_flatten(listas).cast(TIPO_UUID)
+        else:
+            origen = np.empty(0, dtype=np.int64)
+            relacionados = pa.array([], type=TIPO_UUID)
+
+        # UUID citado -> fila de la tabla, o nodo huérfano si no está
+        destino = pc.index_in(relacionados, value_set=uuids)
+        faltantes = destino.is_null().to_numpy(zero_copy_only=False)
+        destino = pc.fill_null(destino, -1).to_numpy().astype(np.int64)
+        huerfanas = pc.dictionary_encode(relacionados.filter(pa.array(faltantes)))
+        self.huerfanas = huerfanas.dictionary if len(huerfanas) else pa.array([], type=TIPO_UUID)
+        destino[faltantes] = self.filas + huerfanas.indices.to_numpy(zero_copy_only=False)
+
+        self.nodos = self.filas + len(self.huerfanas)
+        self.origen, self.destino = origen, destino
+        # Salientes (complemento -> documentos): las aristas ya vienen ordenadas por origen
+        self._offsets_salida = self._offsets(origen)
+        self._vecinos_salida = destino
+        # Entrantes (documento -> complementos): las mismas aristas ordenadas por destino
+        orden = np.argsort(destino, kind='stable')
+        self._offsets_entrada = self._offsets(destino[orden])
+        self._vecinos_entrada = origen[orden]
+
+    def _offsets(self, nodos_ordenados):
+        return np.concatenate([[0], np.cumsum(np.bincount(nodos_ordenados, minlength=self.nodos))])
+
+    def __len__(self):
+        return len(self.origen)
+
+    # Nodo de un UUID en texto (fila, nodo huérfano o None). El mapa se arma en la primera consulta.
+    def nodo(self, uuid):
+        if self._posiciones is None:
+            claves = self._uuids.to_pylist() + self.huerfanas.to_pylist()
+            # Recorrido inverso: si un UUID se repite, gana su primera fila
+            self._posiciones = dict(zip(reversed(claves), range(len(claves) - 1, -1, -1)))
+            self._posiciones.pop(None, None)
+        return self._posiciones.get(uuid_a_bytes(uuid))
+
+    def es_huerfano(self, nodo):
+        return nodo >= self.filas
+
+    def uuid_de(self, nodo):
+        if self.es_huerfano(nodo):
+            return binario_a_uuids(self.huerfanas.slice(nodo - self.filas, 1))[0]
+        return binario_a_uuids(self._uuids.slice(nodo, 1))[0]
+
+    # Filas de los complementos que citan al UUID
+    def complementos_de(self, uuid):
+        nodo = self.nodo(uuid)
+        if nodo is None:
+            return np.empty(0, dtype=np.int64)
+        return self._vecinos_entrada[self._offsets_entrada[nodo]:self._offsets_entrada[nodo + 1]]
+
+    # Nodos de los documentos que cita un complemento (los >= filas son huérfanos)
+    def facturas_de(self, uuid):
+        nodo = self.nodo(uuid)
+        if nodo is None or self.es_huerfano(nodo):
+            return np.empty(0, dtype=np.int64)
+        return self._vecinos_salida[self._offsets_salida[nodo]:self._offsets_salida[nodo + 1]]
+
+    # UUID citados que no están en la tabla y cuántos complementos los citan
+    def referencias_huerfanas(self):
+        citas = np.diff(self._offsets_entrada)[self.filas:]
+        tabla = pd.DataFrame({
+            'UUID Relacionado': binario_a_uuids(self.huerfanas),
+            'Complementos': citas,
+        })
+        return tabla.sort_values('Complementos', ascending=False, kind='stable', ignore_index=True)
+
+    # Filas de facturas canceladas que siguen citadas por algún complemento vigente
+    def canceladas_con_complementos_activos(self):
+        activas = self._vigentes[self.origen]
+        citas = np.bincount(self.destino[activas], minlength=self.nodos)[:self.filas]
+        return np.flatnonzero(self._canceladas & (citas > 0))
+
+    # Componente conexa de cada nodo, ignorando el sentido de las aristas.
+    # Unión de conjuntos vectorizada: en cada ronda la raíz mayor de cada arista
+    # se cuelga de la menor y luego se comprimen los caminos hasta las raíces.
+    # Cada ronda es lineal en el número de aristas y hacen falta pocas rondas.
+    def componentes(self):
+        if self._componentes is None:
+            padre = np.arange(self.nodos)
+            while True:
+                raiz_origen, raiz_destino = padre[self.origen], padre[self.destino]
+                distintas = raiz_origen != raiz_destino
+                if not distintas.any():
+                    break
+                menor = np.minimum(raiz_origen[distintas], raiz_destino[distintas])
+                mayor = np.maximum(raiz_origen[distintas], raiz_destino[distintas])
+                # Con raíces repetidas gana cualquiera de las asignaciones: todas apuntan a un nodo menor
+                padre[mayor] = menor
+                while True:
+                    abuelo = padre[padre]
+                    if np.array_equal(abuelo, padre):
+                        break
+                    padre = abuelo
+            self._componentes = np.unique(padre, return_inverse=True)[1]
+        return self._componentes
+
+    # Tamaño de las componentes con más de un nodo, de mayor a menor
+    def tamanos_componentes(self):
+        tamanos = np.bincount(self.componentes())
+        return np.sort(tamanos[tamanos > 1])[::-1]
+
+    # Filas que forman parte de un ciclo (o dependen de uno) siguiendo el sentido
+    # complemento -> documento: se retiran por rondas los nodos sin aristas
+    # entrantes y los que nunca se pueden retirar están en un ciclo.
+    def en_ciclos(self):
+        entrantes = np.bincount(self.destino, minlength=self.nodos)
+        vivos = np.ones(self.nodos, dtype=bool)
+        aristas = np.ones(len(self.origen), dtype=bool)
+        while True:
+            retirar = vivos & (entrantes == 0)
+            if not retirar.any():
+                break
+            vivos &= ~retirar
+            salen = aristas & retirar[self.origen]
+            aristas &= ~salen
+            entrantes -= np.bincount(self.destino[salen], minlength=self.nodos)
+        return np.flatnonzero(vivos[:self.filas])
+
@@ -1,8 +1,42 @@
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
-import plotly.express as px
 from datetime import datetime
-import hashlib
+from functools import partial
+import time
+
+from almacen import normalizar_nombre, obtener_almacen
+from cache_datos import cache, hash_contenido
+from cambios import COLUMNAS_INSTANTANEA, comparar, periodo_del_exporte
+from cargas import cancelar_trabajo_de_sesion, trabajo_de_sesion
+from registro import registro
+from ingesta import (
+    COLUMNAS_DERIVADAS,
+    VERSION_NORMALIZACION,
+    cargar_en_paralelo,
+    cargar_por_lotes,
+    combinar_sin_duplicados,
+    disponible,
+)
+from agregados import CuboAgregados, cantidad, cantidad_con, por
+from analisis import COLUMNAS_FACTURA, complementos, ppd_sin_complemento, pue_con_complementos
+from conciliacion import ESTADOS, PAGADA, PARCIAL, SIN_PAGO, SOBREPAGADA, conciliar_ppd, resumen
+from diagnostico import etapa, iniciar as iniciar_diagnostico
+from esquema import para_mostrar
+from exportar import clave_exporte, escribir_csv, escribir_vista, exporte_en_disco
+from filtros import (
+    MotorFiltros,
+    contiene_texto,
+    en,
+    entre_fechas,
+    numero_de_paginas,
+    pagina,
+)
+from grafo import GrafoRelaciones
+from graficas import barras_por_mes, linea_por_mes, pastel_metodo_pago
+from indices import IndiceBusqueda, IndiceRelaciones, LIMITE_RESULTADOS, MIN_PREFIJO, uuids_en_texto
+from lectores import EXTENSIONES
 
 # Configuración de la página con tema personalizado
 st.set_page_config(
@@ -12,6 +46,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Mediciones por etapa de esta ejecución (None si el diagnóstico está apagado)
+mediciones = iniciar_diagnostico(st.session_state.get("diagnostico", False))
+
 # Estilos CSS personalizados con diseño moderno
 st.markdown("""
     <style>
@@ -226,33 +263,238 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Función para convertir listas en strings para el hashing
-def convert_lists_to_strings(df):
-    for col in df.columns:
-        if df[col].apply(lambda x: isinstance(x, list)).any():
-            df[col] = df[col].apply(lambda x: '|'.join(map(str, x)) if isinstance(x, list) else x)
-    return df
-
-# Cargar archivo XLS con mejor manejo de errores
-def cargar_datos(archivo):
-    try:
-        df = pd.read_excel(archivo, engine="xlrd")
-        # Limpieza básica de datos
-        df = df.dropna(how='all')
-        df = df.fillna('')
-        
-        # Procesar relaciones si existe la columna
-        if 'Relacionados' in df.columns:
-            df['UUIDs_Relacionados'] = df['Relacionados'].str.findall(
-                r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}'
-            )
-            # Convertir listas vacías a None
-            df['UUIDs_Relacionados'] = df['UUIDs_Relacionados'].apply(lambda x: x if x else None)
-        
-        return convert_lists_to_strings(df)
-    except Exception as e:
-        st.error(f"❌ Error cargando archivo: {e}")
+# Tablas normalizadas de los archivos indicados por posición. Cada archivo se
+# busca en la caché por el hash de su contenido; los que faltan se procesan en
+# paralelo. Actualiza el detalle de carga de cada archivo.
+def obtener_tablas(contenidos, claves, tiempos, posiciones, progreso=None):
+    if not posiciones:
+        return {}
+    with etapa('cache'):
+        tablas = {i: cache.obtener(claves[i]) for i in posiciones}
+    for i, df in tablas.items():
+        if df is not None:
+            tiempos[i].update(Filas=len(df), Origen="Caché")
+
+    pendientes = [i for i in posiciones if tablas[i] is None]
+    if len(pendientes) == 1:
+        # Un solo archivo: se procesa aquí para reportar el avance por filas
+        i = pendientes[0]
+        inicio = time.perf_counter()
+        with etapa('procesar archivo') as medicion:
+            tablas[i] = cargar_por_lotes(contenidos[i], progreso=progreso)
+            medicion.salida(len(tablas[i]))
+        tiempos[i].update(Segundos=time.perf_counter() - inicio)
+    elif pendientes:
+        listos = 0
+        # Las etapas internas de cada archivo corren en otros procesos y no se miden
+        with etapa('procesar en paralelo') as medicion:
+            for j, df, segundos in cargar_en_paralelo([contenidos[i] for i in pendientes]):
+                tablas[pendientes[j]] = df
+                tiempos[pendientes[j]].update(Segundos=segundos)
+                listos += 1
+                if progreso is not None:
+                    progreso(listos, len(pendientes), "archivos procesados")
+            medicion.salida(sum(len(tablas[i]) for i in pendientes))
+
+    with etapa('guardar cache'):
+        for i in pendientes:
+            cache.guardar(claves[i], tablas[i])
+            tiempos[i].update(Filas=len(tablas[i]), Origen="Procesado")
+    return tablas
+
+# Identificador de la sesión de Streamlit y si sigue abierta (para el registro compartido)
+def sesion_actual():
+    contexto = get_script_run_ctx()
+    return contexto.session_id if contexto is not None else "local"
+
+def sesion_abierta(sesion):
+    return not runtime.exists() or runtime.get_instance().is_active_session(sesion)
+
+# Cargar uno o varios archivos XLS. El conjunto de archivos se identifica por
+# el hash de sus contenidos y se comparte entre sesiones a través del registro:
+# solo la primera sesión que lo abre lee y combina las tablas. Con un almacén,
+# los archivos nuevos se integran al historial local por UUID y el conjunto es
+# el historial del periodo indicado (meses 'AAAA-MM'; completo por omisión).
+# fase(etapa) se llama al pasar de la lectura a la
+# unificación (ver cargas.ETAPAS). Devuelve el conjunto compartido, el detalle
+# de carga por archivo y, con almacén, los cambios de cada archivo nuevo
+# respecto al historial (nombre -> cambios.Cambios o None).
+def cargar_datos(archivos, progreso=None, almacen=None, fase=None, sesion=None, periodo=(None, None)):
+    fase = fase or (lambda etapa: None)
+    fase('lectura')
+    contenidos = [archivo.getvalue() for archivo in archivos]
+    claves = [f"{hash_contenido(c)}-v{VERSION_NORMALIZACION}" for c in contenidos]
+    tiempos = [
+        {"Archivo": archivo.name, "Filas": None, "Segundos": 0.0, "Origen": "Compartido"}
+        for archivo in archivos
+    ]
+    # Un mismo archivo subido dos veces solo se procesa una vez
+    unicos = [i for i, clave in enumerate(claves) if clave not in claves[:i]]
+    for i in set(range(len(claves))) - set(unicos):
+        tiempos[i].update(Origen="Repetido")
+    cambios = {}
+
+    if almacen is not None:
+        nuevos = [i for i in unicos if not almacen.archivo_importado(claves[i])]
+        for i in set(unicos) - set(nuevos):
+            tiempos[i].update(Origen="Historial")
+        tablas = obtener_tablas(contenidos, claves, tiempos, nuevos, progreso)
+        fase('unificacion')
+        for n, i in enumerate(nuevos):
+            # Punto de control antes de escribir: una carga cancelada no toca el historial
+            if progreso is not None:
+                progreso(n, len(nuevos), "archivos integrados al historial")
+            # Lo que cambia el exporte respecto al historial se calcula antes de integrarlo
+            cambios[archivos[i].name] = cambios_contra_historial(almacen, tablas[i])
+            inicio = time.perf_counter()
+            with etapa('historial', filas_entrada=len(tablas[i])):
+                almacen.upsert(tablas[i], hash_archivo=claves[i], nombre=archivos[i].name)
+            tiempos[i].update(Segundos=tiempos[i]["Segundos"] + time.perf_counter() - inicio)
+            tiempos[i].update(Origen=f"{tiempos[i]['Origen']} + historial")
+        clave_conjunto = almacen.clave(*periodo)
+
+        def cargar():
+            return almacen.cargar(*periodo)[0]
+    else:
+        # Clave del conjunto de archivos (el orden importa: el último archivo gana)
+        clave_conjunto = hash_contenido("|".join(claves).encode())
+
+        def cargar():
+            tablas = obtener_tablas(contenidos, claves, tiempos, unicos, progreso)
+            fase('unificacion')
+            return combinar_sin_duplicados([tablas[claves.index(clave)] for clave in claves])
+
+    conjunto = registro.adquirir(clave_conjunto, sesion or sesion_actual(), cargar, sesion_activa=sesion_abierta)
+    return conjunto, tiempos, cambios
+
+# Cambios de un exporte respecto a lo guardado en el historial para los meses
+# que cubre (None si el historial no tiene facturas en esos meses)
+def cambios_contra_historial(almacen, df):
+    periodo = periodo_del_exporte(df)
+    if periodo is None or 'UUID' not in df.columns:
+        return None
+    anterior = almacen.instantanea(*periodo, COLUMNAS_INSTANTANEA)
+    if anterior.empty:
         return None
+    # Los complementos de facturas recién canceladas se buscan en todo el historial
+    return comparar(anterior, df, almacen.complementos_de)
+
+# Carga completa para un trabajo en segundo plano: además de la tabla deja
+# construidos la columna de relaciones, los índices y el cubo del resumen, para
+# que la primera visita a cada página no los construya. La sesión se recibe
+# porque el hilo del trabajo no tiene contexto de Streamlit.
+def preparar_conjunto(archivos, almacen, sesion, periodo):
+    def cargar(trabajo):
+        conjunto, tiempos, cambios = cargar_datos(archivos, trabajo.progreso, almacen, trabajo.fase, sesion, periodo)
+        if conjunto is None:
+            return None, tiempos, cambios
+        if disponible(conjunto.df, 'UUIDs_Relacionados'):
+            trabajo.fase('relaciones')
+            conjunto.columna('UUIDs_Relacionados')
+            trabajo.fase('indices')
+            indice_de(conjunto)
+            indice_busqueda_de(conjunto)
+        else:
+            trabajo.fase('indices')
+        conjunto.derivado('cubo', CuboAgregados)
+        return conjunto, tiempos, cambios
+    return cargar
+
+# Barra de avance del trabajo de carga; el fragmento se vuelve a ejecutar solo
+# y, al terminar el trabajo, pide un rerun de toda la página
+@st.fragment(run_every=0.5)
+def mostrar_avance(trabajo):
+    if trabajo.terminado or trabajo.cancelado:
+        st.rerun()
+    avance, texto = trabajo.estado()
+    st.progress(avance, text=f"🔍 {texto} · {trabajo.segundos:.0f} s")
+    if st.button("Cancelar carga", key="cancelar_carga"):
+        trabajo.cancelar()
+        st.rerun()
+
+# Diagnóstico de rendimiento: mediciones por etapa de esta ejecución. Se dibuja
+# al final de la página para incluir todas las etapas, o antes de detener el
+# script mientras hay una carga en curso; apagado no mide nada.
+def mostrar_diagnostico():
+    with st.sidebar:
+        st.toggle(
+            "Diagnóstico de rendimiento",
+            key="diagnostico",
+            help="Tiempo, filas y memoria de cada etapa (carga, filtros, páginas, gráficas y tablas)."
+        )
+        if st.session_state.get("diagnostico") and mediciones is not None:
+            st.caption(f"⏱️ Ejecución: {mediciones.segundos():.3f} s · {len(mediciones.mediciones)} mediciones")
+            st.dataframe(
+                mediciones.tabla(),
+                column_config={
+                    "Segundos": st.column_config.NumberColumn("Segundos", format="%.4f"),
+                    "Memoria MB": st.column_config.NumberColumn("Memoria MB", format="%.1f", help="Cambio de memoria residente del proceso"),
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+            # Caché de archivos procesados, compartida por las sesiones del servidor
+            uso = cache.estadisticas()
+            st.caption(
+                f"🗃️ Caché: {uso['aciertos_memoria']:,} aciertos en memoria, {uso['aciertos_disco']:,} en disco, "
+                f"{uso['fallos']:,} fallos ({uso['tasa_aciertos']:.0%} de aciertos) · "
+                f"{uso['bytes_memoria'] / 2**20:,.1f} MB en memoria ({uso['entradas_memoria']} archivos), "
+                f"{uso['bytes_disco'] / 2**20:,.1f} MB en disco · "
+                f"{uso['desalojos_memoria'] + uso['desalojos_disco']:,} desalojos"
+            )
+            # Registro de conjuntos compartidos entre sesiones
+            compartidos = registro.estadisticas()
+            st.caption(
+                f"🗂️ Registro: {compartidos['conjuntos']} conjuntos en memoria para "
+                f"{compartidos['sesiones']} sesiones · {compartidos['desalojos']} desalojados por inactividad"
+            )
+
+# Motor de filtros de la sesión; conserva las máscaras entre reruns mientras
+# no cambie el conjunto de archivos. Las columnas derivadas que pide se
+# calculan una vez en el conjunto compartido.
+def obtener_motor_filtros(conjunto):
+    if st.session_state.get('motor_filtros_clave') != conjunto.clave:
+        st.session_state['motor_filtros'] = MotorFiltros(conjunto.df, derivar=conjunto.columna)
+        st.session_state['motor_filtros_clave'] = conjunto.clave
+    return st.session_state['motor_filtros']
+
+# Índice de relaciones del conjunto, construido la primera vez que una página lo usa
+def indice_de(conjunto):
+    return conjunto.derivado('indice_relaciones', IndiceRelaciones, ['UUIDs_Relacionados'])
+
+# Índice de búsqueda por prefijo de UUID (facturas y UUID relacionados)
+def indice_busqueda_de(conjunto):
+    return conjunto.derivado('indice_busqueda', IndiceBusqueda, ['UUIDs_Relacionados'])
+
+# Exporte de la vista: las columnas derivadas y el índice se piden al conjunto
+# solo cuando se pulsa el botón
+def escribir_vista_del_conjunto(ruta, formato, conjunto, predicados):
+    indice = indice_de(conjunto) if formato == 'xlsx' else None
+    escribir_vista(ruta, formato, conjunto.tabla(*COLUMNAS_DERIVADAS), indice, predicados)
+
+# Exporte de la conciliación: las facturas de la página (posiciones en df) en
+# el mismo orden, escritas por bloques
+def escribir_conciliacion(ruta, conciliacion, posiciones):
+    escribir_csv(ruta, conciliacion, conciliacion.index.get_indexer(posiciones))
+
+# Rango de fechas del historial elegido en la barra lateral (fechas inclusivas),
+# dentro de los límites del periodo abierto. Se aplica antes de cargar para leer
+# solo sus meses del disco. Se guarda aparte del widget porque mientras la carga
+# avanza la barra lateral no se dibuja y Streamlit descarta su estado; si los
+# límites cambian (otro periodo o facturas nuevas), vuelve al rango completo.
+def rango_fechas_historial(limites):
+    guardado = st.session_state.get('rango_historial')
+    if guardado is None or guardado[0] != limites:
+        rango = limites
+        st.session_state['fecha_range_historial'] = limites
+    else:
+        rango = tuple(st.session_state.get('fecha_range_historial', guardado[1]))
+        if len(rango) != 2:
+            # Rango a medio elegir: se sigue con el anterior
+            rango = guardado[1]
+    st.session_state['rango_historial'] = (limites, rango)
+    return rango
+
 
 # Función segura para crear multiselect con estilo mejorado
 def create_safe_multiselect(label, options, default_values=None):
@@ -276,30 +518,156 @@ def create_safe_multiselect(label, options, default_values=None):
         help=f"Seleccione uno o más {label.lower()}"
     )
 
+# Tablas y gráficas con la medición de su serialización para el navegador
+def mostrar_tabla(datos, **opciones):
+    with etapa('mostrar tabla', filas_entrada=len(datos)):
+        st.dataframe(datos, **opciones)
+
+def mostrar_grafica(fig):
+    with etapa('mostrar grafica'):
+        st.plotly_chart(fig, use_container_width=True)
+
 # Diseño del uploader mejorado
 with st.container():
-    st.markdown("### 📤 Carga tu archivo de facturas")
+    st.markdown("### 📤 Carga tus archivos de facturas")
     with st.container():
-        archivo = st.file_uploader(
-            "Arrastra o selecciona tu archivo Excel (.xls)",
-            type=["xls"],
-            help="El archivo debe contener columnas como UUID, Fecha, Método de Pago, etc.",
+        archivos = st.file_uploader(
+            "Arrastra o selecciona tus exportes (.xls, .xlsx o .csv)",
+            type=list(EXTENSIONES),
+            accept_multiple_files=True,
+            help="Puedes cargar varios exportes (por ejemplo, uno por mes). Las facturas repetidas se unifican por UUID.",
             key="file_uploader"
         )
+        usar_historial = st.toggle(
+            "Guardar en un historial local",
+            value=False,
+            help="Las facturas se integran por UUID a un historial en disco; basta con subir el exporte del mes nuevo.",
+            key="usar_historial"
+        )
+        # Solo se abre el historial que la sesión nombra: uno por cliente
+        almacen = None
+        if usar_historial:
+            nombre_historial = st.text_input(
+                "Historial del cliente (RFC o nombre)",
+                placeholder="Ej: XAXX010101000",
+                help="Cada cliente tiene su propio historial; escriba el mismo nombre para volver a abrirlo.",
+                key="nombre_historial"
+            )
+            if normalizar_nombre(nombre_historial):
+                almacen = obtener_almacen(nombre_historial)
+            else:
+                st.caption("Escriba el RFC o nombre del cliente para usar su historial")
+        facturas_historial = almacen.filas() if almacen is not None else 0
+        if facturas_historial:
+            st.caption(f"🗄️ Historial de {normalizar_nombre(nombre_historial)}: {facturas_historial:,} facturas guardadas")
+        # Periodo del historial a abrir (meses 'AAAA-MM'); (None, None) es el historial completo
+        periodo = (None, None)
+        meses_historial = almacen.meses() if facturas_historial else []
+        if len(meses_historial) > 1:
+            # Sin key: si el historial gana meses, el control vuelve al periodo completo
+            desde, hasta = st.select_slider(
+                "Periodo del historial a abrir",
+                options=meses_historial,
+                value=(meses_historial[0], meses_historial[-1]),
+                help="Solo se leen del disco los meses elegidos. Las facturas sin fecha se incluyen al abrir el historial completo."
+            )
+            if (desde, hasta) != (meses_historial[0], meses_historial[-1]):
+                periodo = (desde, hasta)
+        # El rango de fechas de la barra lateral acota además los meses que se leen
+        limites_historial = None
+        if meses_historial:
+            primera, ultima = almacen.rango_fechas(*periodo)
+            limites_historial = (primera.date(), ultima.date())
+            inicio, fin = rango_fechas_historial(limites_historial)
+            meses_rango = (inicio.strftime('%Y-%m'), fin.strftime('%Y-%m'))
+            if meses_rango != (meses_historial[0], meses_historial[-1]):
+                periodo = meses_rango
 
-if archivo:
-    with st.spinner('🔍 Procesando archivo... Por favor espera'):
-        df = cargar_datos(archivo)
+if archivos or facturas_historial:
+    # Los mismos archivos (con el mismo uso del historial y periodo) siguen con el
+    # trabajo en curso; otros archivos lo reemplazan
+    clave_carga = (tuple(archivo.file_id for archivo in archivos or []), almacen.ruta if almacen is not None else None, periodo)
+    carga_anterior = st.session_state.get('trabajo_carga')
+    if carga_anterior is not None and carga_anterior.clave != clave_carga:
+        # Los archivos cambiaron: la sesión suelta el conjunto anterior antes de
+        # que la nueva carga adquiera el suyo
+        registro.liberar(sesion_actual())
+    trabajo = trabajo_de_sesion(
+        st.session_state, clave_carga, preparar_conjunto(archivos or [], almacen, sesion_actual(), periodo)
+    )
+    if trabajo.cancelado:
+        st.markdown('<div class="warning-box">⏹️ Carga cancelada</div>', unsafe_allow_html=True)
+        if st.button("Reintentar", key="reintentar_carga"):
+            del st.session_state['trabajo_carga']
+            st.rerun()
+        mostrar_diagnostico()
+        st.stop()
+    if not trabajo.terminado:
+        mostrar_avance(trabajo)
+        mostrar_diagnostico()
+        st.stop()
+    if mediciones is not None:
+        # Etapas medidas en el hilo de la carga (lectura, historial, índices...)
+        mediciones.agregar(trabajo.tomar_mediciones())
     
-    if df is not None:
-        # Procesamiento inicial de datos
-        if 'Fecha' in df.columns:
-            df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-            df['Mes'] = df['Fecha'].dt.to_period('M').astype(str)
-        
-        if 'XML' in df.columns:
-            df['Mes_XML'] = df['XML'].str.extract(r'(\d{6})')
+    conjunto, tiempos_carga, cambios_carga = trabajo.resultado or (None, [], {})
+    if trabajo.error is not None:
+        st.error(f"❌ Error cargando archivo: {trabajo.error}")
+    elif conjunto is not None:
+        if almacen is not None and conjunto.clave != almacen.clave(*periodo):
+            # Otra sesión agregó facturas al historial: se vuelve a cargar
+            del st.session_state['trabajo_carga']
+            st.rerun()
+        # Mantener viva la referencia de la sesión en el registro (y volver a
+        # registrar la tabla si se desalojó por inactividad)
+        conjunto = registro.adquirir(conjunto.clave, sesion_actual(), lambda: conjunto.df, sesion_activa=sesion_abierta)
+    
+    if conjunto is not None:
+        # Tabla y derivados compartidos con las demás sesiones que abren los mismos archivos
+        df = conjunto.df
+        clave_conjunto = conjunto.clave
         
+        if len(tiempos_carga) > 1 or any("Procesado" in t["Origen"] for t in tiempos_carga):
+            with st.expander("⏱️ Detalle de carga por archivo", expanded=False):
+                filas_cargadas = sum(t["Filas"] or 0 for t in tiempos_carga)
+                if almacen is not None and periodo != (None, None):
+                    st.caption(f"{filas_cargadas:,} filas leídas, {len(df):,} facturas del historial local de {periodo[0]} a {periodo[1]} · carga en {trabajo.segundos:.1f} s")
+                elif almacen is not None:
+                    st.caption(f"{filas_cargadas:,} filas leídas, {len(df):,} facturas en el historial local · carga en {trabajo.segundos:.1f} s")
+                else:
+                    st.caption(f"{filas_cargadas:,} filas leídas, {len(df):,} facturas únicas tras unificar por UUID · carga en {trabajo.segundos:.1f} s")
+                mostrar_tabla(
+                    pd.DataFrame(tiempos_carga),
+                    column_config={
+                        "Segundos": st.column_config.NumberColumn("Segundos", format="%.2f")
+                    },
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+        # Cambios de cada exporte nuevo respecto a lo que el historial tenía de su periodo
+        for nombre_archivo, cambios_archivo in cambios_carga.items():
+            if cambios_archivo is None:
+                continue
+            alertas = len(cambios_archivo.estatus) + len(cambios_archivo.complementos_cancelados)
+            with st.expander(f"🔄 Cambios de {nombre_archivo} respecto al historial", expanded=alertas > 0):
+                st.caption(f"Comparado contra {cambios_archivo.comparadas:,} facturas guardadas de los mismos meses")
+                secciones = [
+                    ("Nuevas", cambios_archivo.nuevas),
+                    ("Ya no vienen en el exporte", cambios_archivo.eliminadas),
+                    ("Cambio de estatus", cambios_archivo.estatus),
+                    ("Otros cambios", cambios_archivo.modificadas),
+                    ("Complementos de facturas recién canceladas", cambios_archivo.complementos_cancelados),
+                ]
+                for col, (titulo, tabla) in zip(st.columns(len(secciones)), secciones):
+                    with col:
+                        st.markdown(f'<div class="metric-label">{titulo}</div>', unsafe_allow_html=True)
+                        st.markdown(f'<div class="metric-value">{len(tabla):,}</div>', unsafe_allow_html=True)
+                for titulo, tabla in secciones[1:]:
+                    if not tabla.empty:
+                        st.markdown(f"**{titulo}**")
+                        mostrar_tabla(para_mostrar(tabla), use_container_width=True, hide_index=True)
+
         # Sidebar con menú y filtros
         with st.sidebar:
             st.markdown("""
@@ -316,7 +684,8 @@ if archivo:
                 "Resumen General",
                 "Facturas Emitidas",
                 "Complementos de Pago", 
-                "Gestión PPD/PUE"
+                "Gestión PPD/PUE",
+                "Conciliación PPD"
             ], index=0, label_visibility="collapsed")
             
             st.markdown("""
@@ -342,7 +711,18 @@ if archivo:
             if 'Fecha' in df.columns:
                 min_date = df['Fecha'].min()
                 max_date = df['Fecha'].max()
-                if pd.notna(min_date) and pd.notna(max_date):
+                if limites_historial is not None:
+                    # Límites del periodo abierto, no de la tabla cargada (que
+                    # ya es solo el rango elegido)
+                    st.markdown("**Rango de fechas**")
+                    fecha_range = st.date_input(
+                        "",
+                        min_value=limites_historial[0],
+                        max_value=limites_historial[1],
+                        key="fecha_range_historial",
+                        label_visibility="collapsed"
+                    )
+                elif pd.notna(min_date) and pd.notna(max_date):
                     min_date = min_date.to_pydatetime()
                     max_date = max_date.to_pydatetime()
                     st.markdown("**Rango de fechas**")
@@ -365,58 +745,73 @@ if archivo:
                 </div>
             """, unsafe_allow_html=True)
             
-            if st.button("Exportar a CSV", key="export_btn"):
-                @st.cache_data
-                def convert_df_to_csv(df):
-                    return df.to_csv(index=False).encode('utf-8')
-                
-                csv = convert_df_to_csv(df)
-                st.download_button(
-                    "Descargar CSV",
-                    data=csv,
-                    file_name="facturas_filtradas.csv",
-                    mime="text/csv",
-                    key="download_btn"
-                )
+            formato_exporte = st.radio(
+                "Formato", ["CSV", "XLSX"], horizontal=True, key="formato_exporte"
+            )
 
-        # Aplicar filtros básicos
-        df_filtrado = df.copy()
+        # Aplicar filtros básicos (cada página agrega los suyos a esta lista)
+        motor = obtener_motor_filtros(conjunto)
+        filtros_base = []
         if 'Estatus' in df.columns and 'estatus_filtro' in locals():
-            df_filtrado = df_filtrado[df_filtrado['Estatus'].isin(estatus_filtro)]
+            filtros_base.append(en('Estatus', estatus_filtro))
         if 'Fecha' in df.columns and 'fecha_range' in locals() and len(fecha_range) == 2:
-            df_filtrado = df_filtrado[
-                (df_filtrado['Fecha'] >= pd.to_datetime(fecha_range[0])) & 
-                (df_filtrado['Fecha'] <= pd.to_datetime(fecha_range[1]))
-            ]
+            # El día final se incluye completo, igual que en el cubo de agregados
+            fin_del_dia = pd.Timestamp(fecha_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+            filtros_base.append(entre_fechas('Fecha', fecha_range[0], fin_del_dia))
+
+        # El archivo se escribe por bloques al pulsar el botón y queda en disco
+        # para el mismo estado de filtros
+        with st.sidebar:
+            extension = formato_exporte.lower()
+            st.download_button(
+                f"Descargar vista filtrada ({formato_exporte})",
+                data=partial(
+                    exporte_en_disco,
+                    clave_exporte(clave_conjunto, filtros_base, extension),
+                    extension,
+                    partial(escribir_vista_del_conjunto, formato=extension, conjunto=conjunto, predicados=list(filtros_base))
+                ),
+                file_name=f"facturas_filtradas.{extension}",
+                mime="text/csv" if extension == "csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="download_btn"
+            )
 
         # Página de Resumen General
         if menu == "Resumen General":
             st.markdown("## 📊 Resumen General")
             
+            # Todas las cifras salen del cubo de agregados con los filtros de la barra lateral
+            with etapa('resumen cubo_filtrado'):
+                cubo = conjunto.derivado('cubo', CuboAgregados).filtrar(
+                    estatus=estatus_filtro if 'estatus_filtro' in locals() else None,
+                    desde=fecha_range[0] if 'fecha_range' in locals() and len(fecha_range) == 2 else None,
+                    hasta=fecha_range[1] if 'fecha_range' in locals() and len(fecha_range) == 2 else None
+                )
+            
             # Métricas clave en tarjetas estilizadas
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.markdown('<div class="metric-label">Total Facturas</div>', unsafe_allow_html=True)
-                st.markdown(f'<div class="metric-value">{len(df)}</div>', unsafe_allow_html=True)
-                st.markdown('<div style="text-align:center;color:#6c757d;">Registros cargados</div>', unsafe_allow_html=True)
+                st.markdown(f'<div class="metric-value">{cantidad(cubo)}</div>', unsafe_allow_html=True)
+                st.markdown(f'<div style="text-align:center;color:#6c757d;">De {len(df)} registros cargados</div>', unsafe_allow_html=True)
             
             with col2:
                 if 'Estatus' in df.columns:
-                    vigentes = len(df[df['Estatus'].astype(str).str.contains('Vigente', case=False)])
+                    vigentes = cantidad_con(cubo, 'Estatus', 'Vigente')
                     st.markdown('<div class="metric-label">Facturas Vigentes</div>', unsafe_allow_html=True)
                     st.markdown(f'<div class="metric-value" style="color:#28a745;">{vigentes}</div>', unsafe_allow_html=True)
                     st.markdown('<div style="text-align:center;color:#6c757d;">Activas en el sistema</div>', unsafe_allow_html=True)
             
             with col3:
                 if 'Estatus' in df.columns:
-                    canceladas = len(df[df['Estatus'].astype(str).str.contains('Cancelado', case=False)])
+                    canceladas = cantidad_con(cubo, 'Estatus', 'Cancelado')
                     st.markdown('<div class="metric-label">Facturas Canceladas</div>', unsafe_allow_html=True)
                     st.markdown(f'<div class="metric-value" style="color:#dc3545;">{canceladas}</div>', unsafe_allow_html=True)
                     st.markdown('<div style="text-align:center;color:#6c757d;">Registros anulados</div>', unsafe_allow_html=True)
             
             with col4:
                 if 'Método de Pago' in df.columns:
-                    ppd_count = len(df[df['Método de Pago'].astype(str).str.contains('PPD', case=False)])
+                    ppd_count = cantidad_con(cubo, 'Método de Pago', 'PPD')
                     st.markdown('<div class="metric-label">Facturas PPD</div>', unsafe_allow_html=True)
                     st.markdown(f'<div class="metric-value" style="color:#fd7e14;">{ppd_count}</div>', unsafe_allow_html=True)
                     st.markdown('<div style="text-align:center;color:#6c757d;">Pago en parcialidades</div>', unsafe_allow_html=True)
@@ -426,64 +821,22 @@ if archivo:
             # Gráficos interactivos con Plotly
             if 'Método de Pago' in df.columns:
                 st.markdown("### 📈 Distribución por Método de Pago")
-                metodo_counts = df['Método de Pago'].value_counts().reset_index()
-                metodo_counts.columns = ['Método', 'Cantidad']
-                
-                fig = px.pie(
-                    metodo_counts,
-                    values='Cantidad',
-                    names='Método',
-                    color_discrete_sequence=px.colors.qualitative.Pastel,
-                    hole=0.3
-                )
-                fig.update_traces(
-                    textposition='inside', 
-                    textinfo='percent+label',
-                    marker=dict(line=dict(color='#ffffff', width=1))
-                )
-                fig.update_layout(
-                    showlegend=True,
-                    legend=dict(
-                        orientation="h",
-                        yanchor="bottom",
-                        y=-0.2,
-                        xanchor="center",
-                        x=0.5
-                    )
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                with etapa('grafica metodo_pago'):
+                    fig = pastel_metodo_pago(por(cubo, 'Método de Pago').sort_values(ascending=False))
+                mostrar_grafica(fig)
             
-            if 'Mes' in df.columns:
+            if 'Mes' in cubo.columns:
                 st.markdown("### 📅 Evolución Mensual")
-                mes_counts = df['Mes'].value_counts().sort_index().reset_index()
-                mes_counts.columns = ['Mes', 'Cantidad']
-                
-                fig = px.bar(
-                    mes_counts,
-                    x='Mes',
-                    y='Cantidad',
-                    color='Cantidad',
-                    color_continuous_scale='Blues',
-                    text='Cantidad'
-                )
-                fig.update_layout(
-                    xaxis_title="Mes",
-                    yaxis_title="Número de Facturas",
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)'
-                )
-                fig.update_traces(
-                    marker_line_color='rgb(8,48,107)',
-                    marker_line_width=1,
-                    opacity=0.8
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                with etapa('grafica evolucion_mensual'):
+                    fig = barras_por_mes(por(cubo, 'Mes', ordenar=True), "Número de Facturas", 'Blues')
+                mostrar_grafica(fig)
 
         # Página de Facturas Emitidas
         elif menu == "Facturas Emitidas":
             st.markdown("## 📄 Facturas Emitidas")
             
             # Filtros adicionales en columnas
+            filtros_pagina = list(filtros_base)
             col1, col2 = st.columns(2)
             with col1:
                 if 'Método de Pago' in df.columns:
@@ -494,7 +847,7 @@ if archivo:
                         key="metodo_pago_filter"
                     )
                     if metodo_pago:
-                        df_filtrado = df_filtrado[df_filtrado['Método de Pago'].isin(metodo_pago)]
+                        filtros_pagina.append(en('Método de Pago', metodo_pago))
             
             with col2:
                 if 'Forma de Pago' in df.columns:
@@ -505,18 +858,52 @@ if archivo:
                         key="forma_pago_filter"
                     )
                     if forma_pago:
-                        df_filtrado = df_filtrado[df_filtrado['Forma de Pago'].isin(forma_pago)]
+                        filtros_pagina.append(en('Forma de Pago', forma_pago))
             
             # Mostrar resultados en tabla estilizada
             columnas = ['UUID', 'Fecha', 'Método de Pago', 'Forma de Pago', 'Estatus', 'Total']
-            if 'Mes' in df.columns:
+            if disponible(df, 'Mes'):
                 columnas.append('Mes')
             
-            st.markdown(f"**📋 Mostrando {len(df_filtrado)} de {len(df)} facturas**")
+            filas = motor.filas(filtros_pagina)
+            
+            # Paginación y orden del lado del servidor: solo se envía la página visible
+            col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+            with col1:
+                columna_orden = st.selectbox(
+                    "Ordenar por",
+                    [c for c in columnas if disponible(df, c)],
+                    index=columnas.index('Fecha') if 'Fecha' in df.columns else 0,
+                    key="orden_facturas"
+                )
+            with col2:
+                descendente = st.toggle("Descendente", value=True, key="orden_desc_facturas")
+            with col3:
+                tamano_pagina = st.selectbox("Filas por página", [25, 50, 100, 250, 500], index=2, key="tamano_pagina_facturas")
+            
+            total_paginas = numero_de_paginas(filas, tamano_pagina)
+            if st.session_state.get("pagina_facturas", 1) > total_paginas:
+                st.session_state["pagina_facturas"] = 1
+            with col4:
+                numero_pagina = st.number_input(
+                    f"Página (de {total_paginas})",
+                    min_value=1,
+                    max_value=total_paginas,
+                    step=1,
+                    key="pagina_facturas"
+                )
+            
+            with etapa('facturas ordenar', filas_entrada=len(filas)):
+                filas_pagina = pagina(motor.ordenar(filas, columna_orden, descendente), tamano_pagina, numero_pagina)
+            primera = (numero_pagina - 1) * tamano_pagina
+            st.markdown(
+                f"**📋 Mostrando {primera + 1 if len(filas_pagina) else 0}–{primera + len(filas_pagina)} "
+                f"de {len(filas)} facturas filtradas ({len(df)} cargadas)**"
+            )
             
             # Usar st.data_editor para mejor interactividad
-            st.dataframe(
-                df_filtrado[columnas].sort_values('Fecha', ascending=False),
+            mostrar_tabla(
+                para_mostrar(motor.tomar(filas_pagina, columnas)),
                 height=600,
                 column_config={
                     "Fecha": st.column_config.DateColumn(
@@ -542,55 +929,99 @@ if archivo:
         elif menu == "Complementos de Pago":
             st.markdown("## 💳 Complementos de Pago")
             
-            if 'UUIDs_Relacionados' in df.columns:
+            if disponible(df, 'UUIDs_Relacionados'):
                 # Filtrar solo complementos de pago (que tienen relaciones)
-                df_complementos = df_filtrado[df_filtrado['UUIDs_Relacionados'].notna()]
+                with etapa('complementos tabla'):
+                    filas_complementos = complementos(motor, filtros_base)
+                    df_complementos = motor.tomar(filas_complementos, ['UUID', 'Fecha', 'UUIDs_Relacionados', 'Total', 'Estatus'])
                 
                 if not df_complementos.empty:
                     st.markdown("### Relación de Complementos")
                     
-                    # Mostrar tabla de relaciones con pestañas
-                    tab1, tab2 = st.tabs(["📋 Tabla de Datos", "📈 Visualización"])
+                    # Pestañas con ejecución diferida: solo corre el contenido de la pestaña abierta
+                    tab1, tab2, tab3 = st.tabs(
+                        ["📋 Tabla de Datos", "📈 Visualización", "🕸️ Red de Relaciones"],
+                        key="pestanas_complementos",
+                        on_change="rerun"
+                    )
                     
                     with tab1:
-                        st.dataframe(
-                            df_complementos[[
-                                'UUID', 'Fecha', 'UUIDs_Relacionados', 'Total', 'Estatus'
-                            ]].rename(columns={
-                                'UUID': 'Complemento UUID',
-                                'UUIDs_Relacionados': 'Facturas Relacionadas'
-                            }),
-                            height=500,
-                            use_container_width=True,
-                            column_config={
-                                "Facturas Relacionadas": st.column_config.ListColumn(
-                                    "Facturas Relacionadas",
-                                    help="UUIDs de las facturas asociadas a este complemento"
-                                )
-                            }
-                        )
+                        if tab1.open:
+                            mostrar_tabla(
+                                para_mostrar(df_complementos).rename(columns={
+                                    'UUID': 'Complemento UUID',
+                                    'UUIDs_Relacionados': 'Facturas Relacionadas'
+                                }),
+                                height=500,
+                                use_container_width=True,
+                                column_config={
+                                    "Facturas Relacionadas": st.column_config.ListColumn(
+                                        "Facturas Relacionadas",
+                                        help="UUIDs de las facturas asociadas a este complemento"
+                                    )
+                                }
+                            )
                     
                     with tab2:
-                        if 'Mes_XML' in df_complementos.columns:
-                            st.markdown("#### Complementos por Mes")
-                            complementos_por_mes = df_complementos['Mes_XML'].value_counts().sort_index().reset_index()
-                            complementos_por_mes.columns = ['Mes', 'Cantidad']
-                            
-                            fig = px.bar(
-                                complementos_por_mes,
-                                x='Mes',
-                                y='Cantidad',
-                                color='Cantidad',
-                                color_continuous_scale='greens',
-                                text='Cantidad'
-                            )
-                            fig.update_layout(
-                                xaxis_title="Mes",
-                                yaxis_title="Número de Complementos",
-                                plot_bgcolor='rgba(0,0,0,0)',
-                                paper_bgcolor='rgba(0,0,0,0)'
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
+                        if tab2.open:
+                            if disponible(df, 'Mes_XML'):
+                                st.markdown("#### Complementos por Mes")
+                                with etapa('grafica complementos_por_mes'):
+                                    meses_xml = motor.tomar(filas_complementos, ['Mes_XML'])['Mes_XML']
+                                    complementos_por_mes = meses_xml.value_counts().sort_index()
+                                    fig = barras_por_mes(
+                                        complementos_por_mes[complementos_por_mes > 0],
+                                        "Número de Complementos", 'greens', formato='%Y%m'
+                                    )
+                                mostrar_grafica(fig)
+                    
+                    with tab3:
+                        if tab3.open:
+                            # El grafo se construye una vez por conjunto y cubre todos los datos cargados
+                            grafo = conjunto.derivado('grafo_relaciones', GrafoRelaciones, ['UUIDs_Relacionados'])
+                            with etapa('complementos grafo'):
+                                canceladas_activas = grafo.canceladas_con_complementos_activos()
+                                huerfanas = grafo.referencias_huerfanas()
+                                tamanos = grafo.tamanos_componentes()
+                                en_ciclos = grafo.en_ciclos()
+                        
+                            st.caption("Análisis sobre todos los datos cargados, sin los filtros de la barra lateral")
+                            col1, col2, col3, col4 = st.columns(4)
+                            col1.metric("Relaciones", len(grafo))
+                            col2.metric("Referencias huérfanas", len(huerfanas), help="UUID citados por complementos que no están en los archivos cargados")
+                            col3.metric("Canceladas con complementos vigentes", len(canceladas_activas))
+                            col4.metric("Grupos relacionados", len(tamanos), help=f"El mayor agrupa {tamanos[0] if len(tamanos) else 0} documentos")
+                        
+                            if len(canceladas_activas):
+                                with st.expander(f"❌ {len(canceladas_activas)} facturas canceladas con complementos vigentes"):
+                                    mostrar_tabla(
+                                        para_mostrar(motor.tomar(canceladas_activas, [c for c in ['UUID', 'Fecha', 'Método de Pago', 'Total', 'Estatus'] if c in df.columns])),
+                                        use_container_width=True,
+                                        hide_index=True
+                                    )
+                            if len(huerfanas):
+                                with st.expander(f"🔗 {len(huerfanas)} UUID citados que no están en los datos"):
+                                    mostrar_tabla(huerfanas, use_container_width=True, hide_index=True)
+                            if len(en_ciclos):
+                                with st.expander(f"🔁 {len(en_ciclos)} documentos en relaciones circulares"):
+                                    mostrar_tabla(para_mostrar(motor.tomar(en_ciclos, ['UUID', 'Fecha', 'UUIDs_Relacionados', 'Estatus'])), use_container_width=True, hide_index=True)
+                        
+                            uuid_consulta = st.text_input("Consultar relaciones de un UUID", key="uuid_grafo")
+                            if uuid_consulta:
+                                nodo = grafo.nodo(uuid_consulta)
+                                if nodo is None:
+                                    st.markdown('<div class="warning-box">⚠️ El UUID no aparece en los datos ni en ninguna relación</div>', unsafe_allow_html=True)
+                                else:
+                                    citantes = grafo.complementos_de(uuid_consulta)
+                                    citados = grafo.facturas_de(uuid_consulta)
+                                    st.markdown(f"**Citado por {len(citantes)} complementos · cita {len(citados)} documentos**")
+                                    if len(citantes):
+                                        mostrar_tabla(para_mostrar(motor.tomar(citantes, ['UUID', 'Fecha', 'Total', 'Estatus'])), use_container_width=True, hide_index=True)
+                                    if len(citados):
+                                        mostrar_tabla(pd.DataFrame({
+                                            'UUID Relacionado': [grafo.uuid_de(n) for n in citados],
+                                            'En los datos': ['No' if grafo.es_huerfano(n) else 'Sí' for n in citados],
+                                        }), use_container_width=True, hide_index=True)
                 else:
                     st.markdown('<div class="warning-box">⚠️ No se encontraron complementos de pago en los datos filtrados</div>', unsafe_allow_html=True)
             else:
@@ -601,105 +1032,209 @@ if archivo:
             st.markdown("## 🔄 Gestión de PPD y PUE")
             
             if 'Método de Pago' in df.columns:
-                # Detectar PPD sin complemento
-                df_ppd = df_filtrado[
-                    (df_filtrado['Método de Pago'].astype(str).str.contains('PPD', case=False))
-                ]
-                
-                if 'UUIDs_Relacionados' in df.columns:
-                    # Obtener todos los UUIDs que están en relaciones
-                    uuids_relacionados = set()
-                    for lista in df['UUIDs_Relacionados'].dropna():
-                        if isinstance(lista, str):
-                            uuids_relacionados.update(lista.split('|'))
-                        elif isinstance(lista, list):
-                            uuids_relacionados.update(lista)
-                    
-                    # PPD sin complemento
-                    ppd_sin_complemento = df_ppd[~df_ppd['UUID'].isin(uuids_relacionados)]
+                if disponible(df, 'UUIDs_Relacionados'):
+                    indice_relaciones = indice_de(conjunto)
+                    # PPD sin complemento (consulta al índice de relaciones)
+                    with etapa('ppd sin_complemento'):
+                        df_ppd_sin_complemento = motor.tomar(
+                            ppd_sin_complemento(motor, indice_relaciones, filtros_base),
+                            [c for c in ['UUID', 'Fecha', 'Total', 'Estatus'] if c in df.columns]
+                        )
                     
                     st.markdown("### Facturas PPD sin complemento")
-                    if not ppd_sin_complemento.empty:
-                        st.markdown(f'<div class="warning-box">⚠️ Hay {len(ppd_sin_complemento)} facturas PPD sin complemento registrado</div>', unsafe_allow_html=True)
+                    if not df_ppd_sin_complemento.empty:
+                        st.markdown(f'<div class="warning-box">⚠️ Hay {len(df_ppd_sin_complemento)} facturas PPD sin complemento registrado</div>', unsafe_allow_html=True)
                         
-                        # Mostrar con expansor para no saturar la vista
-                        with st.expander("🔍 Ver detalles", expanded=False):
-                            st.dataframe(
-                                ppd_sin_complemento[[
-                                    'UUID', 'Fecha', 'Total', 'Estatus'
-                                ]],
-                                height=300,
-                                use_container_width=True
-                            )
+                        # Mostrar con expansor para no saturar la vista; la tabla solo se arma abierto
+                        detalles = st.expander("🔍 Ver detalles", expanded=False, key="detalles_ppd", on_change="rerun")
+                        with detalles:
+                            if detalles.open:
+                                mostrar_tabla(
+                                    para_mostrar(df_ppd_sin_complemento),
+                                    height=300,
+                                    use_container_width=True
+                                )
                     else:
                         st.markdown('<div class="success-box">✅ Todas las facturas PPD tienen complemento registrado</div>', unsafe_allow_html=True)
                     
                     # Búsqueda específica con mejor diseño
-                    st.markdown("### 🔍 Buscar complemento para factura PPD")
+                    st.markdown("### 🔍 Buscar factura PPD y sus complementos")
                     
                     col1, col2 = st.columns([3,1])
                     with col1:
                         uuid_buscar = st.text_input(
-                            "Ingrese UUID de factura PPD:",
-                            placeholder="Ej: 123e4567-e89b-12d3-a456-426614174000",
+                            "Ingrese el inicio de un UUID o uno o varios UUID completos:",
+                            placeholder="Ej: 123e4567 (primeros caracteres) o 123e4567-e89b-12d3-a456-426614174000 (varios separados por coma o espacio)",
                             label_visibility="collapsed",
                             key="uuid_search_input"
                         )
                     with col2:
                         st.write("")  # Espacio vacío para alinear
-                        buscar_btn = st.button("Buscar", key="search_btn")
+                        st.button("Buscar", key="search_btn")
                     
-                    if uuid_buscar and buscar_btn:
-                        complemento = df[
-                            df['UUIDs_Relacionados'].apply(
-                                lambda x: uuid_buscar in (x.split('|') if isinstance(x, str) else (uuid_buscar in x if isinstance(x, list) else False))
-                            )
+                    # La búsqueda corre al escribir (Enter) o al pulsar el botón
+                    uuids_buscados = uuids_en_texto(uuid_buscar)
+                    if len(uuids_buscados) > 1:
+                        with etapa('ppd busqueda'):
+                            encontrados = indice_relaciones.complementos_de_varios(uuids_buscados)
+                        
+                        # Búsqueda en lote: una fila por cada par factura-complemento
+                        encontrados_por_factura = [
+                            motor.tomar(filas).assign(**{'Factura buscada': uuid})
+                            for uuid, filas in encontrados.items() if len(filas)
                         ]
-                        if not complemento.empty:
-                            st.markdown('<div class="success-box">✅ Complemento encontrado</div>', unsafe_allow_html=True)
-                            st.dataframe(complemento, use_container_width=True)
+                        no_encontrados = [uuid for uuid, filas in encontrados.items() if not len(filas)]
+                        if encontrados_por_factura:
+                            st.markdown(f'<div class="success-box">✅ {len(uuids_buscados) - len(no_encontrados)} de {len(uuids_buscados)} facturas tienen complemento</div>', unsafe_allow_html=True)
+                            mostrar_tabla(para_mostrar(pd.concat(encontrados_por_factura)), use_container_width=True)
+                        if no_encontrados:
+                            st.markdown(f'<div class="danger-box">⚠️ Sin complemento: {", ".join(no_encontrados)}</div>', unsafe_allow_html=True)
+                    elif uuids_buscados:
+                        # Un UUID completo o su inicio: búsqueda por prefijo en el índice
+                        indice_busqueda = indice_busqueda_de(conjunto)
+                        with etapa('ppd busqueda_prefijo'):
+                            coincidencias = indice_busqueda.buscar(uuid_buscar)
+                            aproximadas = not coincidencias
+                            if aproximadas:
+                                coincidencias = indice_busqueda.parecidos(uuid_buscar)
+                        
+                        if not coincidencias:
+                            mensaje = (
+                                f"Escriba al menos {MIN_PREFIJO} caracteres del UUID"
+                                if len(uuids_buscados[0].replace('-', '')) < MIN_PREFIJO
+                                else "No se encontró ningún UUID que empiece así"
+                            )
+                            st.markdown(f'<div class="danger-box">⚠️ {mensaje}</div>', unsafe_allow_html=True)
                         else:
-                            st.markdown('<div class="danger-box">⚠️ No se encontró complemento para esta factura</div>', unsafe_allow_html=True)
+                            if aproximadas:
+                                st.markdown('<div class="warning-box">⚠️ No hay coincidencias exactas; estos UUID se parecen (un carácter distinto o dos intercambiados)</div>', unsafe_allow_html=True)
+                            else:
+                                limite = " (se muestran los primeros)" if len(coincidencias) == LIMITE_RESULTADOS else ""
+                                st.markdown(f'<div class="success-box">✅ {len(coincidencias)} UUID coinciden{limite}</div>', unsafe_allow_html=True)
+                            
+                            facturas = [c.fila for c in coincidencias if c.fila is not None]
+                            if facturas:
+                                st.markdown("**Facturas**")
+                                mostrar_tabla(
+                                    para_mostrar(motor.tomar(facturas, [c for c in COLUMNAS_FACTURA if c in df.columns])),
+                                    use_container_width=True
+                                )
+                            
+                            complementos_encontrados = [
+                                motor.tomar(c.complementos).assign(**{'Factura buscada': c.uuid})
+                                for c in coincidencias if len(c.complementos)
+                            ]
+                            if complementos_encontrados:
+                                st.markdown("**Complementos**")
+                                mostrar_tabla(para_mostrar(pd.concat(complementos_encontrados)), use_container_width=True)
+                            else:
+                                st.markdown('<div class="danger-box">⚠️ No se encontró complemento para estas facturas</div>', unsafe_allow_html=True)
                 
                 # Análisis de PUE con mejor visualización
                 st.markdown("### Facturas PUE con complementos")
-                if 'UUIDs_Relacionados' in df.columns:
-                    df_pue = df_filtrado[
-                        (df_filtrado['Método de Pago'].astype(str).str.contains('PUE', case=False))
-                    ]
-                    pue_con_complementos = df_pue[df_pue['UUID'].isin(uuids_relacionados)]
-                    if not pue_con_complementos.empty:
-                        st.markdown(f"**📌 {len(pue_con_complementos)} facturas PUE con complementos encontradas**")
+                if disponible(df, 'UUIDs_Relacionados'):
+                    with etapa('ppd pue_con_complementos'):
+                        df_pue_con_complementos = motor.tomar(pue_con_complementos(motor, indice_de(conjunto), filtros_base))
+                    if not df_pue_con_complementos.empty:
+                        st.markdown(f"**📌 {len(df_pue_con_complementos)} facturas PUE con complementos encontradas**")
                         
-                        # Agrupar por mes para visualización
-                        if 'Mes' in pue_con_complementos.columns:
-                            pue_por_mes = pue_con_complementos.groupby('Mes').size().reset_index(name='Cantidad')
-                            
-                            fig = px.line(
-                                pue_por_mes,
-                                x='Mes',
-                                y='Cantidad',
-                                markers=True,
-                                title="Facturas PUE con complementos por mes",
-                                line_shape='spline'
-                            )
-                            fig.update_layout(
-                                xaxis_title="Mes",
-                                yaxis_title="Número de Facturas",
-                                plot_bgcolor='rgba(0,0,0,0)',
-                                paper_bgcolor='rgba(0,0,0,0)'
-                            )
-                            fig.update_traces(
-                                line=dict(width=3, color='#4361ee'),
-                                marker=dict(size=8, color='#f72585')
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
+                        # La gráfica por mes solo se construye con su pestaña abierta
+                        tab_tabla, tab_mes = st.tabs(["📋 Facturas", "📈 Por mes"], key="pestanas_pue", on_change="rerun")
+                        with tab_tabla:
+                            if tab_tabla.open:
+                                mostrar_tabla(para_mostrar(df_pue_con_complementos), use_container_width=True)
                         
-                        st.dataframe(pue_con_complementos, use_container_width=True)
+                        with tab_mes:
+                            if tab_mes.open and 'Mes' in df_pue_con_complementos.columns:
+                                with etapa('grafica pue_por_mes'):
+                                    pue_por_mes = df_pue_con_complementos.groupby('Mes', observed=True).size()
+                                    fig = linea_por_mes(pue_por_mes, "Facturas PUE con complementos", "Número de Facturas")
+                                mostrar_grafica(fig)
                     else:
                         st.markdown('<div class="info-box">ℹ️ No se encontraron facturas PUE con complementos</div>', unsafe_allow_html=True)
 
+        # Página de Conciliación PPD
+        elif menu == "Conciliación PPD":
+            st.markdown("## 🧮 Conciliación de Pagos PPD")
+            
+            if 'Método de Pago' in df.columns and 'UUID' in df.columns:
+                # La conciliación se calcula una vez por conjunto; los filtros solo eligen filas
+                conciliacion = conjunto.derivado('conciliacion_ppd', conciliar_ppd, ['UUIDs_Relacionados'])
+                with etapa('conciliacion filas'):
+                    filas = motor.filas(filtros_base + [contiene_texto('Método de Pago', 'PPD')])
+                    tabla = conciliacion.loc[filas]
+                
+                if not tabla.empty:
+                    totales = resumen(tabla)
+                    col1, col2, col3, col4 = st.columns(4)
+                    for col, estado, color in [
+                        (col1, SIN_PAGO, '#dc3545'),
+                        (col2, PARCIAL, '#f8961e'),
+                        (col3, PAGADA, '#28a745'),
+                        (col4, SOBREPAGADA, '#7209b7'),
+                    ]:
+                        with col:
+                            st.markdown(f'<div class="metric-label">{estado}</div>', unsafe_allow_html=True)
+                            st.markdown(f'<div class="metric-value" style="color:{color};">{totales.loc[estado, "Facturas"]}</div>', unsafe_allow_html=True)
+                            st.markdown(f'<div style="text-align:center;color:#6c757d;">Saldo ${totales.loc[estado, "Saldo"]:,.2f}</div>', unsafe_allow_html=True)
+                    
+                    saldo_pendiente = tabla.loc[tabla['Saldo'] > 0, 'Saldo'].sum()
+                    st.markdown(f'<div class="info-box">ℹ️ {len(tabla)} facturas PPD conciliadas, saldo pendiente total ${saldo_pendiente:,.2f}. '
+                                'Cuando un complemento cita varios documentos, su monto se reparte en proporción al total de cada uno; '
+                                'a las facturas PPD solo les toca su parte.</div>', unsafe_allow_html=True)
+                    
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        estados = st.multiselect("Estado de pago", ESTADOS, default=[SIN_PAGO, PARCIAL, SOBREPAGADA], key="estado_conciliacion")
+                    with col2:
+                        tamano_pagina = st.selectbox("Filas por página", [25, 50, 100, 250, 500], index=2, key="tamano_pagina_conciliacion")
+                    
+                    tabla = tabla[tabla['Estado'].isin(estados)].sort_values('Saldo', ascending=False, kind='stable')
+                    posiciones = tabla.index.to_numpy()
+                    total_paginas = numero_de_paginas(posiciones, tamano_pagina)
+                    if st.session_state.get("pagina_conciliacion", 1) > total_paginas:
+                        st.session_state["pagina_conciliacion"] = 1
+                    numero_pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, step=1, key="pagina_conciliacion")
+                    
+                    mostrar_tabla(
+                        para_mostrar(tabla.loc[pagina(posiciones, tamano_pagina, numero_pagina)]),
+                        height=500,
+                        column_config={
+                            "Fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                            "Último Pago": st.column_config.DateColumn("Último Pago", format="DD/MM/YYYY"),
+                            "Total": st.column_config.NumberColumn("Total", format="$%.2f"),
+                            "Pagado": st.column_config.NumberColumn("Pagado", format="$%.2f"),
+                            "Saldo": st.column_config.NumberColumn("Saldo", format="$%.2f"),
+                        },
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                    
+                    # Igual que la vista filtrada: se escribe al pulsar y queda en disco
+                    # para el mismo estado de filtros y estados de pago
+                    st.download_button(
+                        "Exportar conciliación a CSV",
+                        data=partial(
+                            exporte_en_disco,
+                            clave_exporte(clave_conjunto, filtros_base + [en('Estado', estados)], 'conciliacion.csv'),
+                            'csv',
+                            partial(escribir_conciliacion, conciliacion=conciliacion, posiciones=posiciones)
+                        ),
+                        file_name="conciliacion_ppd.csv",
+                        mime="text/csv",
+                        key="download_conciliacion_btn"
+                    )
+                else:
+                    st.markdown('<div class="info-box">ℹ️ No hay facturas PPD con los filtros seleccionados</div>', unsafe_allow_html=True)
+            else:
+                st.markdown('<div class="warning-box">⚠️ No se encontró la columna Método de Pago en los datos</div>', unsafe_allow_html=True)
+
 else:
+    # Sin archivos ni historial: una carga que siga en curso ya no le sirve a
+    # nadie y el conjunto que tenía la sesión se puede desalojar
+    cancelar_trabajo_de_sesion(st.session_state)
+    registro.liberar(sesion_actual())
+
     # Pantalla de bienvenida cuando no hay archivo cargado
     st.markdown("""
     <div class="welcome-container">
@@ -710,7 +1245,7 @@ else:
             </svg>
         </div>
         <h2 class="welcome-title">Bienvenido al Facturador Inteligente</h2>
-        <p class="welcome-subtitle">Carga tu archivo Excel para comenzar a analizar tus facturas</p>
+        <p class="welcome-subtitle">Carga tus archivos Excel para comenzar a analizar tus facturas</p>
         <div style="margin-top:30px">
             <svg xmlns="http://www.w3.org/2000/svg" width="100" height="100" viewBox="0 0 24 24" fill="none" stroke="#4361ee" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
                 <path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"></path>
@@ -718,6 +1253,9 @@ else:
                 <line x1="12" y1="15" x2="12" y2="3"></line>
             </svg>
         </div>
-        <p style="margin-top:20px;color:#6c757d;font-size:0.9rem;">Soporta archivos .xls con columnas: UUID, Fecha, Método de Pago, etc.</p>
+        <p style="margin-top:20px;color:#6c757d;font-size:0.9rem;">Soporta archivos .xls, .xlsx y .csv con columnas: UUID, Fecha, Método de Pago, etc.</p>
     </div>
     """, unsafe_allow_html=True)
+
+# Diagnóstico de rendimiento al final de la página, con todas las etapas medidas
+mostrar_diagnostico()
@@ -0,0 +1,212 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from esquema import PATRON_UUID, TIPO_UUID, arreglo_arrow, binario_a_uuids, es_columna_uuid, uuid_a_bytes
+
+# Índices que se construyen una sola vez al cargar los datos y se reutilizan
+# en cada rerun de la interfaz.
+
+
+# Texto canónico del UUID, en minúsculas como lo escribe binario_a_uuids
+def normalizar_uuid(uuid):
+    return str(uuid).strip().lower()
+
+
+# Extraer todos los UUID de un texto pegado (separados por comas, espacios o saltos de línea)
+def uuids_en_texto(texto):
+    encontrados = re.findall(PATRON_UUID, texto or '')
+    if encontrados:
+        return [normalizar_uuid(u) for u in encontrados]
+    texto = (texto or '').strip()
+    return [normalizar_uuid(texto)] if texto else []
+
+
+# Índice invertido: UUID de factura relacionada -> filas de los complementos que la citan.
+# Las claves son los 16 bytes del UUID.
+class IndiceRelaciones:
+    def __init__(self, df):
+        self._indice = {}
+        self._claves = pa.array([], type=TIPO_UUID)
+        if 'UUIDs_Relacionados' not in df.columns:
+            return
+
+        relaciones = arreglo_arrow(df['UUIDs_Relacionados'])
+        valores = pc.list_flatten(relaciones)
+        if len(valores) == 0:
+            return
+        filas = df.index.to_numpy()[pc.list_parent_indices(relaciones).to_numpy()]
+
+        # Agrupación por hash: lineal en el número de relaciones
+        grupos = pd.Series(filas).groupby(valores.to_numpy(zero_copy_only=False), sort=False).indices
+        self._indice = {uuid: filas[posiciones] for uuid, posiciones in grupos.items()}
+        self._claves = pa.array(list(self._indice), type=TIPO_UUID)
+
+    def __len__(self):
+        return len(self._indice)
+
+    def __contains__(self, uuid):
+        return uuid_a_bytes(uuid) in self._indice
+
+    # Todos los UUID (en bytes) que aparecen como relacionados en algún complemento
+    @property
+    def uuids_relacionados(self):
+        return self._indice.keys()
+
+    # Filas de los complementos que citan a una factura
+    def complementos_de(self, uuid):
+        return self._indice.get(uuid_a_bytes(uuid), np.empty(0, dtype=np.int64))
+
+    # Búsqueda en lote: {uuid: filas de sus complementos}
+    def complementos_de_varios(self, uuids):
+        return {uuid: self.complementos_de(uuid) for uuid in uuids}
+
+    # Máscara booleana: qué UUID de la serie tienen al menos un complemento
+    def tiene_complemento(self, uuids):
+        if not es_columna_uuid(uuids):
+            claves = pa.array([uuid_a_bytes(u) for u in uuids], type=TIPO_UUID)
+        else:
+            claves = arreglo_arrow(uuids)
+        encontrados = pc.fill_null(pc.is_in(claves, value_set=self._claves), False)
+        return pd.Series(encontrados.to_numpy(zero_copy_only=False), index=uuids.index)
+
+
+MIN_PREFIJO = 4  # caracteres hexadecimales mínimos para buscar por prefijo
+MIN_DIFUSO = 8  # y para buscar UUID parecidos
+LIMITE_RESULTADOS = 20
+
+_NO_HEXADECIMAL = re.compile(r'[^0-9a-f]')
+
+# UUID encontrado: su texto, la fila de la factura (None si solo aparece citado
+# por complementos) y las filas de los complementos que lo citan
+Coincidencia = namedtuple('Coincidencia', ['uuid', 'fila', 'complementos'])
+
+
+# Dígitos hexadecimales del texto en minúsculas, sin guiones ni espacios
+def _hexadecimal(texto):
+    return _NO_HEXADECIMAL.sub('', str(texto or '').lower())[:32]
+
+
+# Arreglo fixed_size_binary(16) sin nulos -> arreglo numpy de claves 'S16'
+def _claves(arreglo):
+    return np.frombuffer(arreglo.buffers()[1], dtype='S16', count=len(arreglo), offset=arreglo.offset * 16)
+
+
+# Claves extremas de todos los UUID que empiezan con el prefijo hexadecimal
+def _extremos(prefijos):
+    bajos = np.array([bytes.fromhex(p.ljust(32, '0')) for p in prefijos], dtype='S16')
+    altos = np.array([bytes.fromhex(p.ljust(32, 'f')) for p in prefijos], dtype='S16')
+    return bajos, altos
+
+
+# Búsqueda por prefijo sobre los UUID de las facturas y los UUID relacionados.
+# Todas las apariciones (la factura misma y cada complemento que la cita) van
+# en un solo arreglo ordenado de claves de 16 bytes; un prefijo hexadecimal es
+# un rango de claves y se resuelve con dos búsquedas binarias, sin recorrer la
+# tabla. Las apariciones de un mismo UUID quedan contiguas.
+class IndiceBusqueda:
+    def __init__(self, df):
+        claves, filas, propias = [], [], []
+        if 'UUID' in df.columns:
+            uuids = arreglo_arrow(df['UUID'])
+            validas = np.flatnonzero(uuids.is_valid().to_numpy(zero_copy_only=False))
+            claves.append(_claves(uuids.take(pa.array(validas))))
+            filas.append(validas)
+            propias.append(np.ones(len(validas), dtype=bool))
+        if 'UUIDs_Relacionados' in df.columns:
+            relaciones = arreglo_arrow(df['UUIDs_Relacionados'])
+            valores = pc.list_flatten(relaciones).cast(TIPO_UUID)
+            claves.append(_claves(valores))
+            filas.append(pc.list_parent_indices(relaciones).to_numpy().astype(np.int64))
+            propias.append(np.zeros(len(valores), dtype=bool))
+
+        claves = np.concatenate(claves) if claves else np.empty(0, dtype='S16')
+        orden = np.argsort(claves)
+        self.claves = claves[orden]
+        self.filas = np.concatenate(filas)[orden] if filas else np.empty(0, dtype=np.int64)
+        self.propias = np.concatenate(propias)[orden] if propias else np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.claves)
+
+    # UUID que empiezan con el texto (se ignoran guiones, espacios y mayúsculas),
+    # en orden, hasta `limite`
+    def buscar(self, texto, limite=LIMITE_RESULTADOS):
+        prefijo = _hexadecimal(texto)
+        if len(prefijo) < MIN_PREFIJO:
+            return []
+        bajos, altos = _extremos([prefijo])
+        return self._coincidencias([(
+            int(np.searchsorted(self.claves, bajos[0], 'left')),
+            int(np.searchsorted(self.claves, altos[0], 'right')),
+        )], limite)
+
+    # UUID cuyo prefijo difiere del texto en un carácter o en dos caracteres
+    # contiguos intercambiados (errores al copiar de un CFDI impreso)
+    def parecidos(self, texto, limite=LIMITE_RESULTADOS):
+        prefijo = _hexadecimal(texto)
+        if len(prefijo) < MIN_DIFUSO:
+            return []
+        variantes = {
+            prefijo[:i] + c + prefijo[i + 1:]
+            for i in range(len(prefijo)) for c in '0123456789abcdef' if c != prefijo[i]
+        }
+        variantes |= {
+            prefijo[:i] + prefijo[i + 1] + prefijo[i] + prefijo[i + 2:]
+            for i in range(len(prefijo) - 1) if prefijo[i] != prefijo[i + 1]
+        }
+        bajos, altos = _extremos(sorted(variantes))
+        inicios = np.searchsorted(self.claves, bajos, 'left')
+        fines = np.searchsorted(self.claves, altos, 'right')
+        hay = fines > inicios
+        return self._coincidencias(list(zip(inicios[hay].tolist(), fines[hay].tolist())), limite)
+
+    # Agrupar por UUID las apariciones de los rangos [inicio, fin)
+    def _coincidencias(self, rangos, limite):
+        grupos = []
+        for inicio, fin in rangos:
+            while inicio < fin and len(grupos) < limite:
+                fin_grupo = int(np.searchsorted(self.claves, self.claves[inicio], 'right'))
+                grupos.append((inicio, fin_grupo))
+                inicio = fin_grupo
+        if not grupos:
+            return []
+
+        # Desde el búfer: los escalares 'S16' de numpy pierden los bytes nulos finales
+        claves = self.claves[[inicio for inicio, _ in grupos]]
+        textos = binario_a_uuids(pa.FixedSizeBinaryArray.from_buffers(
+            TIPO_UUID, len(claves), [None, pa.py_buffer(claves.tobytes())]
+        ))
+        resultado = []
+        for texto, (inicio, fin) in zip(textos, grupos):
+            propias = self.propias[inicio:fin]
+            filas = self.filas[inicio:fin]
+            resultado.append(Coincidencia(
+                texto,
+                int(filas[propias][-1]) if propias.any() else None,
+                filas[~propias],
+            ))
+        return resultado
+
+
+# Índice de fechas sobre una columna ordenada: un rango son dos búsquedas binarias
+class IndiceFechas:
+    def __init__(self, fechas):
+        fechas = np.asarray(fechas, dtype='datetime64[ns]')
+        nulas = np.isnat(fechas)
+        # Las filas sin fecha van al principio; el resto debe estar en orden ascendente
+        self.nulas = int(nulas.sum())
+        self.fechas = fechas[self.nulas:]
+        self.ordenado = not nulas[self.nulas:].any() and bool(np.all(self.fechas[1:] >= self.fechas[:-1]))
+
+    # Corte de filas con inicio <= fecha <= fin
+    def rango(self, inicio, fin):
+        inicio = np.datetime64(pd.Timestamp(inicio), 'ns')
+        fin = np.datetime64(pd.Timestamp(fin), 'ns')
+        desde = self.nulas + int(np.searchsorted(self.fechas, inicio, side='left'))
+        hasta = self.nulas + int(np.searchsorted(self.fechas, fin, side='right'))
+        return slice(desde, max(desde, hasta))
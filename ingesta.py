@@ -0,0 +1,183 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from diagnostico import etapa
+from esquema import (
+    concatenar,
+    extraer_uuids,
+    lista_de_uuids,
+    normalizar_esquema,
+    serie_arrow,
+)
+from lectores import leer_lotes
+
+# Ingesta por lotes de los exportes del SAT: la hoja se recorre en bloques de
+# filas, cada bloque se normaliza por separado y se agrega al resultado, de modo
+# que nunca existe una copia "en crudo" de todo el archivo como DataFrame. Los
+# lectores de cada formato (xls, xlsx, csv) están en lectores.py.
+#
+# Las columnas derivadas ('UUIDs_Relacionados', 'Mes', 'Mes_XML') no se calculan
+# al cargar: se piden por nombre (Conjunto.tabla, MotorFiltros.asegurar) la
+# primera vez que una página las necesita y se guardan con el conjunto.
+
+# Se incrementa cada vez que cambia el resultado de la normalización, para que
+# la caché no devuelva tablas con el formato anterior
+VERSION_NORMALIZACION = 6
+
+TAMANO_LOTE = 20000
+
+
+# Limpieza de un lote; las columnas derivadas se calculan después, a pedido
+def normalizar_lote(df):
+    with etapa('limpiar', filas_entrada=len(df)) as medicion:
+        df = df.dropna(how='all')
+        # Solo las columnas de texto u objetos; las que ya llegan tipadas (CSV) conservan sus nulos
+        texto = [c for c in df.columns if df[c].dtype == object or isinstance(df[c].dtype, pd.StringDtype)]
+        df = df.fillna({c: '' for c in texto})
+        medicion.salida(len(df))
+
+    # Los lectores tipados (csv, calamine) ya entregan la fecha convertida
+    if 'Fecha' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Fecha'].dtype):
+        with etapa('fechas', filas_entrada=len(df)):
+            df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+
+    with etapa('esquema', filas_entrada=len(df)):
+        return normalizar_esquema(df)
+
+
+# Mes de la fecha ('AAAA-MM') como categórica; las filas sin fecha quedan nulas
+def columna_mes(fechas):
+    meses = fechas.to_numpy(dtype='datetime64[ns]').astype('datetime64[M]')
+    validas = ~np.isnat(meses)
+    codigos = np.full(len(meses), -1, dtype=np.int64)
+    codigos[validas], valores = pd.factorize(meses[validas].view(np.int64), sort=True)
+    categorias = np.datetime_as_string(valores.astype('datetime64[M]'), unit='M')
+    return pd.Series(pd.Categorical.from_codes(codigos, categorias), index=fechas.index)
+
+
+# Primer grupo de seis dígitos del nombre del XML (el periodo AAAAMM)
+def columna_mes_xml(xml):
+    meses = pc.struct_field(pc.extract_regex(pa.array(xml.astype(str)), r'(?P<mes>\d{6})'), [0])
+    return pd.Series(meses.to_numpy(zero_copy_only=False), index=xml.index).astype('category')
+
+
+# Listas de UUID citados en 'Relacionados'; sin relaciones -> nulo, para distinguir
+# complementos con notna()
+def columna_uuids_relacionados(relacionados):
+    filas, uuids = extraer_uuids(relacionados.to_numpy())
+    return serie_arrow(lista_de_uuids(filas, uuids, len(relacionados)), index=relacionados.index)
+
+
+# Columna derivada -> (columna de origen, cálculo sobre la serie de origen)
+COLUMNAS_DERIVADAS = {
+    'UUIDs_Relacionados': ('Relacionados', columna_uuids_relacionados),
+    'Mes': ('Fecha', columna_mes),
+    'Mes_XML': ('XML', columna_mes_xml),
+}
+
+
+# La tabla tiene la columna o puede derivarla
+def disponible(df, columna):
+    if columna in df.columns:
+        return True
+    return columna in COLUMNAS_DERIVADAS and COLUMNAS_DERIVADAS[columna][0] in df.columns
+
+
+def calcular_columna(df, columna):
+    origen, calcular = COLUMNAS_DERIVADAS[columna]
+    return calcular(df[origen])
+
+
+# La tabla con las columnas derivadas indicadas (todas las posibles si no se
+# indican). Las que ya tiene no se recalculan; con Copy-on-Write no se copian
+# las demás columnas.
+def con_derivadas(df, columnas=None, derivar=None):
+    columnas = COLUMNAS_DERIVADAS if columnas is None else columnas
+    faltantes = [c for c in columnas if c not in df.columns and disponible(df, c)]
+    if not faltantes:
+        return df
+    derivar = derivar or (lambda columna: calcular_columna(df, columna))
+    return df.assign(**{columna: derivar(columna) for columna in faltantes})
+
+
+# Leer, normalizar y acumular todos los lotes de un archivo (xls, xlsx o csv).
+# progreso(filas_leidas, total_filas) se llama al terminar cada lote.
+def cargar_por_lotes(contenido, progreso=None, tamano_lote=TAMANO_LOTE):
+    lotes = []
+    for lote, leidas, total in leer_lotes(contenido, tamano_lote):
+        lote = normalizar_lote(lote)
+        if not lote.empty:
+            lotes.append(lote)
+        if progreso is not None:
+            progreso(leidas, total)
+
+    with etapa('ordenar', filas_entrada=sum(len(lote) for lote in lotes)):
+        return ordenar_por_fecha(concatenar(lotes))
+
+
+# La tabla se guarda ordenada por fecha ascendente (sin fecha al principio):
+# un rango de fechas es un corte contiguo y la vista descendente es el reverso
+def ordenar_por_fecha(df):
+    if 'Fecha' not in df.columns or df.empty:
+        return df
+    return df.sort_values('Fecha', kind='stable', na_position='first', ignore_index=True)
+
+
+# Función para los procesos del pool: devuelve la tabla y el tiempo de parseo
+def _procesar_en_proceso(contenido):
+    inicio = time.perf_counter()
+    df = cargar_por_lotes(contenido)
+    return df, time.perf_counter() - inicio
+
+
+# Parsear varios archivos en paralelo. xlrd es Python puro y limitado por CPU,
+# así que se usan procesos y no hilos. Produce (posición, df, segundos) en el
+# orden en que van terminando.
+def cargar_en_paralelo(contenidos, max_procesos=None):
+    if len(contenidos) == 1:
+        df, segundos = _procesar_en_proceso(contenidos[0])
+        yield 0, df, segundos
+        return
+
+    max_procesos = min(len(contenidos), max_procesos or os.cpu_count() or 1)
+    # "spawn" evita heredar los hilos y bloqueos del servidor de Streamlit
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_procesos, mp_context=contexto) as pool:
+        futuros = {
+            pool.submit(_procesar_en_proceso, contenido): i
+            for i, contenido in enumerate(contenidos)
+        }
+        try:
+            for futuro in as_completed(futuros):
+                df, segundos = futuro.result()
+                yield futuros[futuro], df, segundos
+        finally:
+            # Si se deja de consumir (carga cancelada) no se empiezan los archivos pendientes
+            for futuro in futuros:
+                futuro.cancel()
+
+
+# Unir las tablas de varios exportes quitando facturas repetidas por UUID.
+# Si un UUID aparece en varios archivos se conserva el del último archivo,
+# que normalmente es el exporte más reciente.
+def combinar_sin_duplicados(tablas):
+    tablas = [df for df in tablas if df is not None and not df.empty]
+    if len(tablas) <= 1:
+        return concatenar(tablas)
+
+    with etapa('combinar', filas_entrada=sum(len(df) for df in tablas)) as medicion:
+        df = concatenar(tablas)
+        if 'UUID' in df.columns:
+            # Las filas sin UUID válido no se consideran duplicadas entre sí
+            duplicadas = df['UUID'].duplicated(keep='last') & df['UUID'].notna()
+            df = df[~duplicadas.to_numpy(dtype=bool)]
+        df = ordenar_por_fecha(df.reset_index(drop=True))
+        medicion.salida(len(df))
+    return df
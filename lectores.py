@@ -0,0 +1,370 @@
+import codecs
+import csv
+import io
+import itertools
+import math
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import xlrd
+from xlrd import (
+    XL_CELL_BOOLEAN,
+    XL_CELL_DATE,
+    XL_CELL_NUMBER,
+    XL_CELL_TEXT,
+    xldate,
+)
+
+from diagnostico import etapa
+
+# Lectores de exportes por formato. Cada lector recorre el archivo en lotes y
+# produce (lote, filas_leidas, total_filas) con los nombres de columna del
+# encabezado; la normalización (ingesta.normalizar_lote) es la misma para todos.
+# El formato se detecta por el contenido, no por la extensión del archivo:
+#
+# - xls, xlsx: python-calamine (en Rust). Cada columna del lote se arma en Arrow
+#         con el tipo declarado en TIPOS_COLUMNAS (las demás como texto), igual
+#         que en el CSV; sin calamine se usan xlrd (xls) y openpyxl (xlsx), que
+#         entregan objetos de Python y los convierte normalizar_lote
+# - csv:  el lector de Arrow (en C++), con los tipos de columna declarados
+
+TAMANO_BLOQUE_CSV = 8 * 1024 * 1024  # bytes por lote del lector de CSV
+
+# Tipos declarados de las columnas conocidas del exporte; las demás se leen como texto
+TIPOS_COLUMNAS = {
+    'Total': pa.float64(),
+    'Fecha': pa.timestamp('us'),
+}
+FORMATOS_FECHA = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y',
+]
+DELIMITADORES = [',', ';', '\t', '|']
+
+
+# Nombres de columna como los genera pandas: vacíos -> "Unnamed: n", repetidos -> "X.1"
+def _nombres_columnas(encabezados):
+    nombres = []
+    vistos = {}
+    for j, valor in enumerate(encabezados):
+        if isinstance(valor, float) and valor.is_integer():
+            valor = int(valor)
+        nombre = str(valor).strip() if valor not in ('', None) else f"Unnamed: {j}"
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+# Convertir una columna de celdas xlrd a valores de Python
+def _convertir_celdas(valores, tipos, modo_fecha):
+    resultado = []
+    for valor, tipo in zip(valores, tipos):
+        if tipo == XL_CELL_TEXT:
+            resultado.append(valor if valor != '' else None)
+        elif tipo == XL_CELL_NUMBER:
+            if math.isfinite(valor) and valor == int(valor):
+                valor = int(valor)
+            resultado.append(valor)
+        elif tipo == XL_CELL_DATE:
+            try:
+                resultado.append(xldate.xldate_as_datetime(valor, modo_fecha))
+            except (OverflowError, xldate.XLDateError):
+                resultado.append(valor)
+        elif tipo == XL_CELL_BOOLEAN:
+            resultado.append(bool(valor))
+        else:
+            # Vacías, en blanco y errores de Excel
+            resultado.append(None)
+    return resultado
+
+
+# Libro de calamine (xls o xlsx); None si calamine no está instalado
+def _abrir_calamine(contenido):
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        return None
+    return CalamineWorkbook.from_filelike(io.BytesIO(contenido))
+
+
+# Valor de una celda como texto, como lo escribe Excel: los números enteros sin
+# decimales ('99', no '99.0')
+def _texto_celda(valor):
+    if valor is None or isinstance(valor, str):
+        return valor
+    if isinstance(valor, float) and math.isfinite(valor) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _columna_texto(valores):
+    try:
+        return pa.array(valores, type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Celdas numéricas, fechas o booleanos en una columna de texto
+        return pa.array([_texto_celda(valor) for valor in valores], type=pa.string())
+
+
+# Columna de celdas de calamine con su tipo declarado. Las celdas vacías
+# llegan como '': nulas en las columnas tipadas, '' en las de texto (como en el
+# CSV). Si las celdas no traen el tipo (fechas o montos escritos como texto) se
+# convierten como en el CSV.
+def _columna_celdas(valores, tipo):
+    if tipo is None:
+        return _columna_texto(valores)
+    valores = [None if valor == '' else valor for valor in valores]
+    try:
+        return pa.array(valores, type=tipo)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        texto = _columna_texto(valores)
+        return _columna_numerica(texto) if tipo == pa.float64() else _columna_fecha(texto)
+
+
+# Lote de filas de calamine como tabla Arrow tipada, sin las filas vacías
+def _tabla_celdas(columnas, registros):
+    valores = list(zip(*registros))
+    vacia = ('',) * len(registros)
+    tabla = pa.table({
+        nombre: _columna_celdas(valores[j] if j < len(valores) else vacia, TIPOS_COLUMNAS.get(nombre))
+        for j, nombre in enumerate(columnas)
+    })
+    con_datos = pa.array([False] * len(tabla))
+    for columna in tabla.columns:
+        no_vacia = pc.is_valid(columna)
+        if pa.types.is_string(columna.type):
+            no_vacia = pc.and_kleene(no_vacia, pc.not_equal(columna, ''))
+        con_datos = pc.or_(con_datos, pc.fill_null(no_vacia, False))
+    return tabla if pc.all(con_datos).as_py() else tabla.filter(con_datos)
+
+
+# Primera hoja de un libro de calamine en lotes de filas tipadas
+def _leer_lotes_calamine(libro, tamano_lote, formato):
+    try:
+        with etapa(f'abrir_{formato}'):
+            hoja = libro.get_sheet_by_index(0)
+        filas = hoja.iter_rows()
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        columnas = _nombres_columnas(encabezado)
+        total = max((hoja.total_height or 1) - 1, 0)
+        leidas = 0
+
+        while True:
+            with etapa(f'leer_{formato}') as medicion:
+                registros = list(itertools.islice(filas, tamano_lote))
+                lote = _tabla_celdas(columnas, registros).to_pandas() if registros else None
+                medicion.salida(len(lote) if lote is not None else 0)
+            if lote is None:
+                return
+            leidas += len(registros)
+            yield lote, leidas, max(total, leidas)
+    finally:
+        libro.close()
+
+
+def leer_lotes_xls(contenido, tamano_lote):
+    libro = _abrir_calamine(contenido)
+    if libro is None:
+        return _leer_lotes_xls_xlrd(contenido, tamano_lote)
+    return _leer_lotes_calamine(libro, tamano_lote, 'xls')
+
+
+def leer_lotes_xlsx(contenido, tamano_lote):
+    libro = _abrir_calamine(contenido)
+    if libro is None:
+        return _leer_lotes_xlsx_openpyxl(contenido, tamano_lote)
+    return _leer_lotes_calamine(libro, tamano_lote, 'xlsx')
+
+
+# Sin calamine: recorrer la primera hoja con xlrd en lotes de filas
+def _leer_lotes_xls_xlrd(contenido, tamano_lote):
+    with etapa('abrir_xls'):
+        libro = xlrd.open_workbook(file_contents=contenido, on_demand=True)
+    try:
+        hoja = libro.sheet_by_index(0)
+        if hoja.nrows == 0:
+            return
+        columnas = _nombres_columnas(hoja.row_values(0))
+        total = hoja.nrows - 1
+
+        for inicio in range(1, hoja.nrows, tamano_lote):
+            fin = min(inicio + tamano_lote, hoja.nrows)
+            with etapa('leer_xls', filas_entrada=fin - inicio) as medicion:
+                lote = pd.DataFrame({
+                    nombre: _convertir_celdas(
+                        hoja.col_values(j, inicio, fin),
+                        hoja.col_types(j, inicio, fin),
+                        libro.datemode
+                    )
+                    for j, nombre in enumerate(columnas)
+                })
+                medicion.salida(len(lote))
+            yield lote, fin - 1, total
+    finally:
+        libro.release_resources()
+
+
+# Sin calamine: openpyxl en modo de solo lectura entrega los valores de Python
+# de cada celda (texto, número o fecha), igual que las celdas convertidas de xlrd
+def _leer_lotes_xlsx_openpyxl(contenido, tamano_lote):
+    import openpyxl
+
+    with etapa('abrir_xlsx'):
+        libro = openpyxl.load_workbook(io.BytesIO(contenido), read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        filas = hoja.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        columnas = _nombres_columnas(encabezado)
+        ancho = len(columnas)
+        # La dimensión declarada en el archivo puede faltar; solo se usa para el avance
+        total = (hoja.max_row or 1) - 1
+        leidas = 0
+
+        while True:
+            with etapa('leer_xlsx') as medicion:
+                registros = []
+                for fila in filas:
+                    # Las filas pueden venir más cortas o más largas que el encabezado
+                    if len(fila) != ancho:
+                        fila = (tuple(fila) + (None,) * ancho)[:ancho]
+                    registros.append(fila)
+                    if len(registros) == tamano_lote:
+                        break
+                lote = pd.DataFrame.from_records(registros, columns=columnas) if registros else None
+                medicion.salida(len(registros))
+            if lote is None:
+                return
+            leidas += len(lote)
+            yield lote, leidas, max(total, leidas)
+    finally:
+        libro.close()
+
+
+# Codificación del texto: UTF-8 si todo el archivo lo es, si no Latin-1 (los
+# CSV de Excel en español suelen venir en Windows-1252)
+def _codificacion(contenido):
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for inicio in range(0, len(contenido), 1024 * 1024):
+            decodificador.decode(contenido[inicio:inicio + 1024 * 1024])
+        decodificador.decode(b'', final=True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def _columna_numerica(columna):
+    columna = pc.if_else(pc.equal(pc.utf8_trim_whitespace(columna), ''), pa.scalar(None, pa.string()), columna)
+    try:
+        return pc.cast(columna, pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Montos con formato ("$1,234.50") o texto suelto: lo que no es número queda nulo
+        limpia = pc.replace_substring_regex(columna, r'[$,\s]', '')
+        return pa.array(pd.to_numeric(limpia.to_pandas(), errors='coerce'), type=pa.float64())
+
+
+# Primer formato que reconoce cada valor; los que ninguno reconoce quedan nulos
+def _columna_fecha(columna):
+    texto = pc.utf8_trim_whitespace(columna)
+    por_reconocer = pc.sum(pc.not_equal(texto, '')).as_py() or 0
+    resultado = pa.nulls(len(texto), pa.timestamp('us'))
+    for formato in FORMATOS_FECHA:
+        if len(resultado) - resultado.null_count == por_reconocer:
+            break
+        intento = pc.strptime(texto, format=formato, unit='us', error_is_null=True)
+        resultado = pc.coalesce(resultado, intento)
+    return resultado
+
+
+def _convertir_tipos(lote):
+    columnas = {}
+    for nombre, columna in zip(lote.schema.names, lote.columns):
+        tipo = TIPOS_COLUMNAS.get(nombre)
+        if tipo == pa.float64():
+            columna = _columna_numerica(columna)
+        elif tipo == pa.timestamp('us'):
+            columna = _columna_fecha(columna)
+        columnas[nombre] = columna
+    return pa.table(columnas)
+
+
+# CSV con el lector por bloques de Arrow. Todas las columnas se declaran como
+# texto (sin inferencia: 'Forma de Pago' conserva el cero inicial) y las de
+# TIPOS_COLUMNAS se convierten en Arrow, sin pasar por objetos de Python.
+def leer_lotes_csv(contenido, tamano_lote):
+    codificacion = _codificacion(contenido)
+    texto_inicial = contenido[:64 * 1024].decode(codificacion, errors='ignore').lstrip('\ufeff')
+    primera_linea = texto_inicial.splitlines()[0] if texto_inicial.strip() else ''
+    if not primera_linea:
+        return
+    delimitador = max(DELIMITADORES, key=primera_linea.count)
+    columnas = _nombres_columnas(next(csv.reader([primera_linea], delimiter=delimitador)))
+    # Estimación para el avance: los saltos de línea dentro de comillas la inflan un poco
+    total = max(contenido.count(b'\n') - 1, 0)
+
+    lector = pa_csv.open_csv(
+        pa.BufferReader(contenido),
+        read_options=pa_csv.ReadOptions(
+            column_names=columnas, skip_rows=1, block_size=TAMANO_BLOQUE_CSV, encoding=codificacion
+        ),
+        parse_options=pa_csv.ParseOptions(delimiter=delimitador, newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={nombre: pa.string() for nombre in columnas},
+            strings_can_be_null=False,
+        ),
+    )
+    leidas = 0
+    while True:
+        with etapa('leer_csv') as medicion:
+            try:
+                bloque = lector.read_next_batch()
+            except StopIteration:
+                return
+            tabla = _convertir_tipos(pa.Table.from_batches([bloque]))
+            medicion.salida(len(tabla))
+        # Cada bloque de bytes se entrega en lotes de tamano_lote filas
+        for inicio in range(0, len(tabla), tamano_lote):
+            lote = tabla.slice(inicio, tamano_lote).to_pandas()
+            leidas += len(lote)
+            yield lote, leidas, max(total, leidas)
+
+
+LECTORES = {
+    'xls': leer_lotes_xls,
+    'xlsx': leer_lotes_xlsx,
+    'csv': leer_lotes_csv,
+}
+
+EXTENSIONES = tuple(LECTORES)
+
+
+# Formato por la firma del archivo: OLE2 (xls), ZIP (xlsx) o texto (csv)
+def detectar_formato(contenido):
+    if contenido.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'xls'
+    if contenido.startswith(b'PK\x03\x04'):
+        return 'xlsx'
+    inicio = contenido[:1024].lstrip(b'\xef\xbb\xbf \t\r\n')
+    if inicio.startswith(b'<'):
+        raise ValueError("El archivo parece HTML o XML, no un exporte .xls, .xlsx o .csv")
+    if b'\x00' in contenido[:1024]:
+        raise ValueError("Formato de archivo no reconocido")
+    return 'csv'
+
+
+def leer_lotes(contenido, tamano_lote):
+    return LECTORES[detectar_formato(contenido)](contenido, tamano_lote)
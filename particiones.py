@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from cache_datos import tipo_pandas
+from ingesta import ordenar_por_fecha
+
+# Tabla normalizada particionada por mes en disco: un archivo Arrow IPC sin
+# comprimir por mes ('AAAA-MM.arrow') y uno para las filas sin fecha. Leer un
+# rango de fechas abre solo los meses que toca, con las columnas mapeadas en
+# memoria: los datos no se copian al leer y el costo depende de los meses
+# abiertos, no de los años guardados.
+#
+# Cada partición se escribe completa a un archivo temporal y se reemplaza de
+# forma atómica; quien tenga mapeado el archivo anterior lo sigue leyendo.
+
+SIN_FECHA = 'sin-fecha'
+EXTENSION = '.arrow'
+
+
+# Partición de cada fila: 'AAAA-MM' o SIN_FECHA
+def particion_de(fechas):
+    meses = fechas.to_numpy(dtype='datetime64[ns]').astype('datetime64[M]')
+    etiquetas = np.datetime_as_string(meses, unit='M').astype(object)
+    etiquetas[np.isnat(meses)] = SIN_FECHA
+    return etiquetas
+
+
+class DatasetMensual:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def _ruta(self, particion):
+        return os.path.join(self.directorio, f"{particion}{EXTENSION}")
+
+    # Meses guardados en orden ('AAAA-MM'; sin la partición sin fecha)
+    def meses(self):
+        if not os.path.isdir(self.directorio):
+            return []
+        return sorted(
+            nombre[:-len(EXTENSION)] for nombre in os.listdir(self.directorio)
+            if nombre.endswith(EXTENSION) and nombre != f"{SIN_FECHA}{EXTENSION}"
+        )
+
+    # Versión del origen con la que se escribieron las particiones (None si no hay)
+    def version(self):
+        try:
+            with open(os.path.join(self.directorio, 'version.json')) as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return None
+
+    # Reescribir las particiones indicadas con las filas de df, que debe traer
+    # todas las filas de esas particiones; las que quedan vacías se borran. Sin
+    # particiones, se reemplaza el dataset completo.
+    def escribir(self, df, version, particiones=None):
+        with self._lock:
+            os.makedirs(self.directorio, exist_ok=True)
+            df = ordenar_por_fecha(df)
+            etiquetas = particion_de(df['Fecha']) if 'Fecha' in df.columns else np.full(len(df), SIN_FECHA, dtype=object)
+            grupos = pd.Series(np.arange(len(df))).groupby(etiquetas, sort=False).indices
+            if particiones is None:
+                particiones = set(grupos) | set(self.meses()) | {SIN_FECHA}
+            for particion in particiones:
+                if particion in grupos:
+                    self._escribir_particion(particion, df.take(grupos[particion]))
+                else:
+                    self._borrar(self._ruta(particion))
+
+            temporal = os.path.join(self.directorio, f"version.json.{os.getpid()}-{threading.get_ident()}.tmp")
+            with open(temporal, 'w') as archivo:
+                json.dump(version, archivo)
+            os.replace(temporal, os.path.join(self.directorio, 'version.json'))
+
+    def _escribir_particion(self, particion, df):
+        ruta = self._ruta(particion)
+        temporal = f"{ruta}.{os.getpid()}-{threading.get_ident()}.tmp"
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(temporal, 'wb') as archivo, ipc.new_file(archivo, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+        os.replace(temporal, ruta)
+
+    # Filas con fecha entre los meses desde y hasta ('AAAA-MM', inclusivos;
+    # None deja el extremo abierto), ordenadas por fecha. Las filas sin fecha
+    # solo se incluyen si no se acota ningún extremo. Con columnas, solo se
+    # leen esas (las demás no se tocan en disco).
+    def leer(self, desde=None, hasta=None, columnas=None):
+        particiones = [
+            mes for mes in self.meses()
+            if (desde is None or mes >= desde) and (hasta is None or mes <= hasta)
+        ]
+        if desde is None and hasta is None and os.path.exists(self._ruta(SIN_FECHA)):
+            particiones.insert(0, SIN_FECHA)
+        if not particiones:
+            return pd.DataFrame()
+
+        tablas = []
+        for particion in particiones:
+            with pa.memory_map(self._ruta(particion)) as archivo:
+                tabla = ipc.open_file(archivo).read_all()
+            if columnas is not None:
+                tabla = tabla.select([c for c in columnas if c in tabla.column_names])
+            tablas.append(tabla)
+        # Los meses pueden traer columnas extra distintas: las que faltan quedan nulas
+        tabla = pa.concat_tables(tablas, promote_options='default')
+        # Cada partición se escribe en orden y se leen en orden de mes: el
+        # resultado ya está ordenado por fecha y no hace falta reordenar (copiar)
+        return tabla.to_pandas(ignore_metadata=True, split_blocks=True, types_mapper=tipo_pandas)
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
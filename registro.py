@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+from diagnostico import etapa
+from ingesta import calcular_columna, con_derivadas
+
+# Registro de conjuntos de datos compartido por todas las sesiones del servidor.
+# Cada conjunto (identificado por el hash de sus archivos) guarda una sola tabla
+# normalizada y sus derivados (columnas derivadas, índices, cubo de agregados),
+# que se construyen la primera vez que una página los pide; las sesiones que lo
+# usan lo adquieren y el conjunto se libera cuando ninguna sesión lo usa y lleva
+# un tiempo inactivo. La memoria crece con los archivos distintos, no con los
+# usuarios.
+#
+# La tabla se trata como de solo lectura: con Copy-on-Write de pandas, cualquier
+# modificación en una sesión crea su propia copia y no altera la compartida.
+# Copy-on-Write es el comportamiento fijo desde pandas 3 (requirements.txt pide
+# pandas>=3); con una versión anterior la tabla compartida quedaría expuesta.
+
+INACTIVIDAD_SEGUNDOS = int(os.environ.get("FACTURADOR_REGISTRO_INACTIVIDAD", "900"))
+
+
+class Conjunto:
+    def __init__(self, clave, df):
+        self.clave = clave
+        self.df = df
+        self.sesiones = set()
+        self.ultimo_uso = time.monotonic()
+        self._derivados = {}
+        # Reentrante: un derivado puede pedir columnas derivadas al construirse
+        self._lock = threading.RLock()
+
+    # Estructura derivada de la tabla, construida una sola vez para todas las
+    # sesiones. construir recibe la tabla con las columnas derivadas indicadas.
+    def derivado(self, nombre, construir, columnas=()):
+        with self._lock:
+            if nombre not in self._derivados:
+                with etapa(f'derivado {nombre}', filas_entrada=len(self.df)):
+                    self._derivados[nombre] = construir(self.tabla(*columnas))
+            return self._derivados[nombre]
+
+    # Serie de una columna derivada de la tabla (ingesta.COLUMNAS_DERIVADAS)
+    def columna(self, nombre):
+        return self.derivado(f'columna {nombre}', lambda df: calcular_columna(df, nombre))
+
+    # La tabla con las columnas derivadas indicadas; sin argumentos, la tabla base
+    def tabla(self, *columnas):
+        return con_derivadas(self.df, columnas, derivar=self.columna)
+
+
+class RegistroConjuntos:
+    def __init__(self, inactividad_segundos=INACTIVIDAD_SEGUNDOS):
+        self.inactividad_segundos = inactividad_segundos
+        self._conjuntos = {}  # clave -> Conjunto
+        self._sesiones = {}  # sesión -> (clave, último acceso)
+        self._lock = threading.Lock()
+        self.desalojos = 0
+
+    # Conjunto de la clave para una sesión; cargar() construye la tabla si no está
+    # registrada. Una sesión usa un solo conjunto: al pedir otro se suelta el anterior.
+    def adquirir(self, clave, sesion, cargar, sesion_activa=None):
+        with self._lock:
+            self._recolectar(sesion_activa)
+            conjunto = self._conjuntos.get(clave)
+
+        if conjunto is None:
+            # La carga se hace fuera del lock; si dos sesiones cargan a la vez gana la primera
+            df = cargar()
+            if df is None:
+                return None
+            with self._lock:
+                conjunto = self._conjuntos.setdefault(clave, Conjunto(clave, df))
+
+        with self._lock:
+            self._soltar(sesion)
+            conjunto.sesiones.add(sesion)
+            conjunto.ultimo_uso = time.monotonic()
+            self._sesiones[sesion] = (clave, conjunto.ultimo_uso)
+        return conjunto
+
+    def liberar(self, sesion):
+        with self._lock:
+            self._soltar(sesion)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "conjuntos": len(self._conjuntos),
+                "sesiones": len(self._sesiones),
+                "referencias": {clave: len(c.sesiones) for clave, c in self._conjuntos.items()},
+                "desalojos": self.desalojos,
+            }
+
+    # Quitar la referencia de una sesión (se llama con el lock tomado)
+    def _soltar(self, sesion):
+        anterior = self._sesiones.pop(sesion, None)
+        if anterior is None:
+            return
+        conjunto = self._conjuntos.get(anterior[0])
+        if conjunto is not None:
+            conjunto.sesiones.discard(sesion)
+
+    # Soltar las sesiones cerradas o inactivas y desalojar los conjuntos sin
+    # referencias que llevan más del tiempo límite sin usarse (con el lock tomado)
+    def _recolectar(self, sesion_activa):
+        ahora = time.monotonic()
+        for sesion, (_, acceso) in list(self._sesiones.items()):
+            cerrada = sesion_activa is not None and not sesion_activa(sesion)
+            if cerrada or ahora - acceso > self.inactividad_segundos:
+                self._soltar(sesion)
+
+        for clave, conjunto in list(self._conjuntos.items()):
+            if not conjunto.sesiones and ahora - conjunto.ultimo_uso > self.inactividad_segundos:
+                del self._conjuntos[clave]
+                self.desalojos += 1
+
+
+# Instancia compartida por todas las sesiones del servidor
+registro = RegistroConjuntos()